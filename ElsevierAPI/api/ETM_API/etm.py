@@ -2,6 +2,7 @@ from urllib.error import HTTPError
 import json, http.client, time, urllib.request, urllib.parse,ssl,re
 from collections import defaultdict
 from ...utils.utils import  load_api_config
+from ...utils.metastore import MetadataStore,ETM_KIND
 from time import sleep
 from ..ResnetAPI.references import AUTHORS,INSTITUTIONS,JOURNAL,SENTENCE,EMAIL,RELEVANCE,PUBLISHER,GRANT_APPLICATION
 from ..ResnetAPI.references import DocMine,Reference
@@ -331,6 +332,7 @@ class ETMsearch:
         self.hit_count = 0
         self.page_size = 100
         self.request_type = '/search/basic?'  # '/search/advanced?'
+        self.store = MetadataStore.open(self.APIconfig.get('MetadataStore',''))
 
 
     def __base_url(self): 
@@ -374,6 +376,11 @@ class ETMsearch:
     def _url_request(self):
         return self.__base_url()+self.__get_param_str()
 
+    def __store_key(self):
+        # request without credentials
+        params = {k:v for k,v in self.params.items() if k not in ['apikey','insttoken']}
+        return self.__base_url()+urllib.parse.urlencode(sorted(params.items()))
+
     def search_reviews_only(self):
         self.params.update({'so_p': '1~'})
 
@@ -394,6 +401,11 @@ class ETMsearch:
         if page_start: self.params['start'] = page_start
         if need_snippets:
             self.params.update({'snip': '1.desc'})
+        store_key = self.__store_key()
+        result = self.store.get(ETM_KIND,store_key)
+        if result is not None:
+            return list(result['article-data']), int(result['total-hits='])
+
         for attempt in range(1, 11):
             try:
                 context = ssl._create_unverified_context()
@@ -401,6 +413,7 @@ class ETMsearch:
                 the_page = urllib.request.urlopen(self._url_request(),context=context).read()         
                 if the_page:
                     result = json.loads(the_page.decode('utf-8'))
+                    self.store.put(ETM_KIND,store_key,{'article-data':result['article-data'],'total-hits=':result['total-hits=']})
                     if attempt > 1:
                         print(f'ETM connection was restored on the {attempt} attempt')
                     sleep(5)
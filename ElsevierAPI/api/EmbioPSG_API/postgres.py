@@ -1,6 +1,6 @@
-import psycopg2
+import psycopg2,io,threading
 from ...utils.utils import ThreadPoolExecutor,time,as_completed,load_api_config, plot_distribution,print_error_info,execution_time
-from ...utils.pandas.panda_tricks import df,pd
+from ...utils.pandas.panda_tricks import df
 from ..ResnetAPI.references import AUTHORS,JOURNAL,MEDLINETA,SENTENCE,PUBYEAR,TITLE,Reference
 from collections import defaultdict
 
@@ -9,6 +9,9 @@ RELATION_ID = 'id'
 REFID2ATTR = {'doi':'DOI','pmid':'PMID','embase':'EMBASE','pii':'PII', 'pui':'PUI','nct_id':'NCT ID'}
 #DB_SCHEMA = 'resnet18'
 DB_SCHEMA = 'resnetcustomnov'
+REF_COPY_TABLE = 'relids4refs' # temporary table with relation ids copied by PostgreSQL.fetch_refs
+REF_FETCH_BATCH = 20000 # rows fetched from server-side cursor at once
+SCOPUS_PREFIX = 'scopus_' # prefix for scopus_data columns joined to reference table
 
 SENTENCE_PROPS = {'msrc':SENTENCE,'organism':'Organism','source':'Source','textmods':'TextMods','organ':'Organ','tissue':'Tissue',
   'biomarkertype':'BiomarkerType', 'celllinename':'CellLineName','celltype':'CellType', 'px':'pX','quantitativetype':'QuantitativeType',
@@ -32,8 +35,12 @@ class PostgreSQL:
       APIconfig = load_api_config()
     self.resnet_version = APIconfig.get('postgreSQschema', DB_SCHEMA)
     self.rel2refDict = dict() # {int(relid):[Reference]}
-    self.executor = ThreadPoolExecutor(thread_name_prefix='postgres')
+    self.fetched_relids = set() # relation ids with references in self.rel2refDict including relations without references
+    # one worker serializes use of self.db by reference fetching futures
+    self.executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix='postgres')
     self.futures = [] # futures of reference retrieval
+    self.lock = threading.Lock()
+    self.__scopus_columns = None
     
     try:
         self.db = psycopg2.connect(
@@ -135,118 +142,151 @@ class PostgreSQL:
         plot_distribution([{f'{table}.{col}':distribution}],outdir=outdir)
 
 
-  def get_refs(self,relations_id:list[str]):
-    new_relids = set(relations_id).difference(self.rel2refDict)
-    newrelid_str = ','.join(map(str, new_relids))
-    sql = f"SELECT * FROM {self.resnet_version}.reference WHERE {self.resnet_version}.reference.id IN ({newrelid_str})"
-    with self.db.cursor() as cur:
-      cur.execute(sql)
-      rows = cur.fetchall()
-      colnames = [desc[0] for desc in cur.description]
-    rows = [list(r) for r in rows]
-    ref_pd = pd.DataFrame(rows,columns=colnames)
-    return ref_pd
-    
-
   def submit_refs(self, relations_ids:list[str]):
     """
       submits reference fetching job to ThreadPoolExecutor future that is added to self.futures
     """
     if relations_ids:
-      self.futures.append(self.executor.submit(self.get_refs,relations_ids))
+      self.futures.append(self.executor.submit(self.fetch_refs,relations_ids))
 
 
-  def scopus_data(self, refids:list[int]):
+  def scopus_columns(self)->list[str]:
     '''
-      scopus_data.reference_id is joined with reference.unique_id
+    output:
+      columns of scopus_data table that are in SCOPUS_DATA
     '''
-    refid_str = ','.join(map(str, refids))
-    sql = f"SELECT * FROM {self.resnet_version}.scopus_data WHERE {self.resnet_version}.scopus_data.reference_id IN ({refid_str})"
-    with self.db.cursor() as cur:
+    if self.__scopus_columns is None:
+      sql = "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = 'scopus_data'"
+      with self.db.cursor() as cur:
+        cur.execute(sql,(self.resnet_version,))
+        table_columns = {r[0] for r in cur.fetchall()}
+      self.__scopus_columns = [c for c in SCOPUS_DATA if c in table_columns]
+    return self.__scopus_columns
+
+
+  def fetch_refs(self,relations_ids:list[str])->dict[int,list[Reference]]:
+    '''
+    relation ids are loaded into temporary table by COPY,
+    references are joined with scopus_data on server and streamed by server-side cursor in REF_FETCH_BATCH rows
+    output:
+      {relation_id:[Reference]}
+    '''
+    relids = {int(i) for i in relations_ids}.difference(self.fetched_relids)
+    if not relids: return dict()
+
+    with self.lock:
       try:
-        cur.execute(sql)
-        rows = cur.fetchall()
-        colnames = [desc[0] for desc in cur.description]
-      except Exception as e:
-        print(f'Fetching Scopus data from Postgres with SQL {sql[:255]} has finished with error:')
-        print(e)
+        with self.db.cursor() as cur:
+          cur.execute(f'CREATE TEMP TABLE IF NOT EXISTS {REF_COPY_TABLE} (id bigint PRIMARY KEY) ON COMMIT DELETE ROWS')
+          cur.copy_expert(f'COPY {REF_COPY_TABLE} (id) FROM STDIN',io.StringIO('\n'.join(map(str,relids))))
+        relid2refs = self.__stream_refs(f'JOIN {REF_COPY_TABLE} t ON r.id = t.id')
+        self.db.commit() # deletes rows from REF_COPY_TABLE
+      except (psycopg2.OperationalError,psycopg2.InterfaceError) as e:
+        # connection errors leave relids out of self.fetched_relids to fetch them again later
+        print_error_info(e,f'Fetching references for {len(relids)} relations from Postgres')
+        if not self.db.closed: self.db.rollback()
+        return dict()
+      except Exception:
         self.db.rollback()
-        return pd.DataFrame()
-      
-    rows = [list(r) for r in rows]
-    scopus_pd = pd.DataFrame(rows,columns=colnames).set_index('reference_id')
-    return scopus_pd
-  
+        raise
 
-  def __rows2refs(self,ref_pd:pd.DataFrame,scopus_pd:pd.DataFrame)->dict[str,list[Reference]]:
+    self.fetched_relids.update(relids)
+    return relid2refs
+
+
+  def __stream_refs(self,join:str='',where:str='',params:tuple|None=None)->dict[int,list[Reference]]:
     '''
+    input:
+      join, where - SQL clauses selecting rows from reference table aliased as "r"
+    output:
+      {relation_id:[Reference]} from references joined with scopus_data on server
+      and streamed by server-side cursor in REF_FETCH_BATCH rows.
+      Caller must hold self.lock and commit or rollback transaction
+    '''
+    vrsn = self.resnet_version
+    scopus_columns = self.scopus_columns()
+    sql = f'SELECT r.*{"".join(f", s.{c} AS {SCOPUS_PREFIX}{c}" for c in scopus_columns)} FROM {vrsn}.reference r'
+    if join:
+      sql += f' {join}'
+    if scopus_columns:
+      sql += f' LEFT JOIN {vrsn}.scopus_data s ON s.reference_id = r.unique_id'
+    if where:
+      sql += f' WHERE {where}'
+
+    relid2refs = defaultdict(list)
+    with self.db.cursor(name=f'{REF_COPY_TABLE}_cursor') as cur:
+      cur.itersize = REF_FETCH_BATCH
+      cur.execute(sql,params)
+      while rows := cur.fetchmany(REF_FETCH_BATCH):
+        colnames = [desc[0] for desc in cur.description]
+        for relid, refs in self.__batch2refs(colnames,rows,bool(scopus_columns)).items():
+          relid2refs[relid] += refs
+    return dict(relid2refs)
+
+
+  @staticmethod
+  def __batch2refs(colnames:list[str],rows:list[tuple],has_scopus=False)->dict[int,list[Reference]]:
+    '''
+    input:
+      rows from reference table joined with SCOPUS_PREFIX columns of scopus_data
     output:
       {relation_id:[Reference]}
-      scopus_data.reference_id is joined with reference.unique_id
     '''
+    def isnull(v):
+      return v is None or v != v # NaN
+
+    columns = dict(zip(colnames,zip(*rows)))
+    id_columns = [(REFID2ATTR[c],columns[c]) for c in REFID2ATTR if c in columns]
+    sentence_columns = [(attr,columns[c]) for c,attr in SENTENCE_PROPS.items() if c in columns]
+    attr_columns = [(attr,columns[c]) for c,attr in COLUMN2ATTR.items() if c in columns]
+    scopus_columns = [(attr,columns[SCOPUS_PREFIX+c]) for c,attr in SCOPUS_DATA.items() if SCOPUS_PREFIX+c in columns]
+    relids, textrefs = columns[RELATION_ID], columns['textref']
+
     relid2refs = defaultdict(list)
-    for refpd_idx in ref_pd.index:
-      relid = ref_pd.at[refpd_idx,RELATION_ID]
-      textref = ref_pd.at[refpd_idx,'textref']
-      ref = dict()
-      ref_idtypes = list(REFID2ATTR.keys())
-      for idtype_idx, idtype in enumerate(ref_idtypes):
-        refid = ref_pd.at[refpd_idx,idtype]
-        if not pd.isna(refid):
-          ref = Reference(REFID2ATTR[idtype],refid)
-          for idt in ref_idtypes[idtype_idx+1:]:
-            id = ref_pd.at[refpd_idx,idt]
-            if not pd.isna(id):
-              ref.Identifiers[REFID2ATTR[idt]] = id
-          break
-
-      if isinstance(ref,Reference):
-        for col, attr in SENTENCE_PROPS.items():
-          attr_val = ref_pd.at[refpd_idx,col]
-          if not pd.isna(attr_val):
-            ref.add_sentence_prop(textref,attr,attr_val)
-
-        for col, attr in COLUMN2ATTR.items():
-          attr_val = ref_pd.at[refpd_idx,col]
-          if not pd.isna(attr_val):
-            if attr in [PUBYEAR]:
-              attr_val = int(attr_val)
-            ref[attr] = [attr_val]
-
-        snippet_id = int(ref_pd.at[refpd_idx,SNIPPET_ID])
-        if snippet_id in scopus_pd.index:
-          ref_scopus_data = scopus_pd.loc[snippet_id].to_dict()
-          ref.update({SCOPUS_DATA[k]:[v] for k,v in ref_scopus_data.items() if k in SCOPUS_DATA})
-        else:
-          refid = ref.doi_or_id()
-          if not refid.startswith('NCT') and not scopus_pd.empty:
-            print(f'Reference {refid} has no Scopus data')
-      
-        ref.toAuthors()
-        relid2refs[int(relid)].append(ref)
+    no_scopus = 0
+    for i in range(len(rows)):
+      ref_ids = [(idtype,col[i]) for idtype,col in id_columns if not isnull(col[i])]
+      if not ref_ids: continue
+      ref = Reference(*ref_ids[0])
+      ref.Identifiers.update(ref_ids[1:])
 
-    return dict(relid2refs)
+      for attr,col in sentence_columns:
+        if not isnull(col[i]):
+          ref.add_sentence_prop(textrefs[i],attr,col[i])
+
+      for attr,col in attr_columns:
+        if not isnull(col[i]):
+          ref[attr] = [int(col[i]) if attr == PUBYEAR else col[i]]
+
+      scopus_data = {attr:[col[i]] for attr,col in scopus_columns if not isnull(col[i])}
+      if scopus_data:
+        ref.update(scopus_data)
+      elif has_scopus and not ref.doi_or_id().startswith('NCT'):
+        no_scopus += 1
+
+      ref.toAuthors()
+      relid2refs[int(relids[i])].append(ref)
+
+    if no_scopus:
+      print(f'{no_scopus} references have no Scopus data')
+    return relid2refs
 
 
-  def load_refs(self):
+  def load_refs(self,relations_ids:list[str]=[]):
     """
+    input:
+      relations_ids - relations to fetch in addition to those submitted by submit_refs
     output:
       {embio_relation_id:[Reference]}
     """
     if self.futures:
-      processed_futures = []
       print(f'Got {len(self.futures)} Postgres futures to process')
-      for get_refs_future in as_completed(self.futures):
-        try:
-          ref_pd = get_refs_future.result()
-          processed_futures.append(get_refs_future)
-          scopus_pd = self.scopus_data(set(ref_pd[SNIPPET_ID].to_list()))
-          self.rel2refDict.update(self.__rows2refs(ref_pd,scopus_pd))
-        except Exception as e:
-          print_error_info(e,f'Loading references from Postgres with SQL {e.cursor.query.decode()}')
-          self.db.rollback()
-      self.futures = [f for f in  self.futures if f not in processed_futures]
+      for fetch_refs_future in as_completed(self.futures):
+        self.rel2refDict.update(fetch_refs_future.result())
+      self.futures.clear()
       print(f'Cached references for {len(self.rel2refDict)} relations from Postgres')
+    if relations_ids:
+      self.rel2refDict.update(self.fetch_refs(relations_ids))
     return self.rel2refDict
   
   
@@ -258,11 +298,14 @@ class PostgreSQL:
       
     '''
     start = time.time()
-    vrsn = self.resnet_version
-    sql = f'''SELECT * FROM {vrsn}.reference
-          WHERE {vrsn}.reference.msrc ILIKE ANY (ARRAY[{','.join([f"\'%{kw}%\'" for kw in keywords])}]);
-      '''
-    ref_pd = self.get_refs(sql)
-    rel2refs = self.__rows2refs(ref_pd)
-    print(f'Snippet search for keywords {keywords} found {len(rel2refs)} relations and {len(ref_pd)} snippets in {execution_time(start)}')
-    return rel2refs
\ No newline at end of file
+    patterns = [f'%{kw}%' for kw in keywords]
+    with self.lock:
+      try:
+        rel2refs = self.__stream_refs(where='r.msrc ILIKE ANY (%s)',params=(patterns,))
+        self.db.commit()
+      except Exception:
+        self.db.rollback()
+        raise
+    snippet_count = sum(len(refs) for refs in rel2refs.values())
+    print(f'Snippet search for keywords {keywords} found {len(rel2refs)} relations and {snippet_count} snippets in {execution_time(start)}')
+    return rel2refs
@@ -4,6 +4,7 @@ from ...utils.utils import et,dir2flist, execution_time,pretty_xml,next_tag,dir2
 from ..ResnetAPI.NetworkxObjects import PSObject,PSRelation,AUTHORS,JOURNAL,PUBYEAR
 from ..ResnetAPI.ResnetGraph import ResnetGraph,Reference,TITLE,SENTENCE,OBJECT_TYPE
 from ..ResnetAPI.references import CLINVAR_ID,CLINVAR_ACC
+from ..ResnetAPI.mapping_index import MappingIndex
 from collections import defaultdict
 
 
@@ -234,12 +235,12 @@ def parse_trait(assertion:et._Element):
       return PSObject(),[]
 
 
-def rcv2psrels(ClinVarSet:et._Element,mapdic:dict[str,dict[str,dict[str,PSObject]]],
+def rcv2psrels(ClinVarSet:et._Element,mapdic:dict[str,dict[str,dict[str,PSObject]]]|MappingIndex,
                only4rsids=set()) -> tuple[PSObject,PSRelation,PSRelation]:
   '''
   input:
     only4rsids - filter by dbSNP rs identifiers
-    mapdic - {OBJECT_TYPE:{propname:{provalue:PSObject}}}
+    mapdic - {OBJECT_TYPE:{propname:{provalue:PSObject}}} or MappingIndex from APIcache.get_index()
   output:
     gv: PSObject
     rel_fa:PSRelation = GV-FunctionalAssociation-Disease
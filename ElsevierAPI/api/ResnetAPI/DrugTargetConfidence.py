@@ -2,8 +2,7 @@ from .ResnetAPIcache import APIcache
 from .PathwayStudioGOQL import OQL
 from .ResnetGraph import ResnetGraph,EFFECT,REFCOUNT,PROTEIN_TYPES,PSObject,CONSISTENCY
 from ...utils.utils import execution_time2,time,execution_time
-from math import log, sqrt
-from collections import defaultdict
+import numpy as np
 from ..EmbioPSG_API.cypher import Cypher
 
 CACHE_PROPS = [CONSISTENCY,REFCOUNT,EFFECT,'Affinity']
@@ -151,10 +150,8 @@ class DrugTargetConsistency(APIcache):
         calc_start = time.time()
         d2t_need = self.drugs2targets.get_subgraph(list(drugs_need_consistency),list(targets4drugs_need_consistency))
         d2t2dG = d2t2dG.compose(d2t_need)
-        update4consistency = defaultdict(float) # = {(drug_uid,target_uid,effect):consistency_coefficient}
-        for drug in drugs_need_consistency:
-          for (drug_uid, target_uid, effect), consistency_coefficient in self.__consistency4(drug, d2t2dG).items():
-            update4consistency[(drug_uid, target_uid, effect)] = consistency_coefficient
+        # = {(drug_uid,target_uid,effect):consistency_coefficient}
+        update4consistency = self.__consistencies(list(drugs_need_consistency),d2t2dG)
               
         if update4consistency:
           # update4consistency can be empty if drug-target pair have no common diseases linked with known Effect 
@@ -239,8 +236,10 @@ class DrugTargetConsistency(APIcache):
           return
 
   @staticmethod
-  def __consist_coeff(consistent_count:int,inconsistent_count:int):
+  def __consist_coeff(consistent_count,inconsistent_count):
       '''
+      input:
+        counts as int or as numpy arrays of equal shape
       output:
         if drug-target has only one consistent disease in common consistency = 0.315
         if consistent_count == inconsistent_count, consistency coefficient = 0.0\n
@@ -248,57 +247,70 @@ class DrugTargetConsistency(APIcache):
         to correct drug ranking use correction = 1+consistency coefficient 
       '''
       zero_adj = 0.1
-      zscore= log((consistent_count+zero_adj)/(inconsistent_count+zero_adj),10)
-      std = sqrt((1.0/(consistent_count+zero_adj)) + (1.0/(inconsistent_count+zero_adj)))
+      zscore= np.log10((consistent_count+zero_adj)/(inconsistent_count+zero_adj))
+      std = np.sqrt((1.0/(consistent_count+zero_adj)) + (1.0/(inconsistent_count+zero_adj)))
       return zscore/std 
 
 
   @staticmethod
-  def __consistency4(drug:PSObject,in_d2t2d:ResnetGraph)->dict[tuple[int,int,str],float]:
+  def __consistencies(drugs:list[PSObject],in_d2t2d:ResnetGraph)->dict[tuple[int,int,str],float]:
       '''
       Returns
       -------
-      {(drug.uid(),target.uid(),effect):1 + consistency_coefficient},  where\n
-      consistency_coefficient = self.__consist_coeff()
+      {(drug.uid(),target.uid(),effect):consistency_coefficient} for drug-target relations without CONSISTENCY, where\n
+      consistency_coefficient = self.__consist_coeff()\n
+      For every disease linked to drug and target with known Effect, predicted drug-disease effect is drug-target effect * target-disease effect.
+      Disease is consistent if predicted effect equals known drug-disease effect and inconsistent otherwise.
+      Effect votes are calculated once as sparse signed matrices drug x target, drug x disease and target x disease.
+      Then for every drug-target pair:\n
+      consistent - inconsistent = drug-target vote * (drug x disease @ disease x target)\n
+      consistent + inconsistent = |drug x disease| @ |disease x target|\n
+      Drug-target pairs without common diseases get consistency_coefficient = 0.0 equal to default correction 
       '''
-      targets = list()
-      diseases = list()
       target_types = PROTEIN_TYPES + ['SmallMol']
-      for r,target,rel in in_d2t2d.targets_of(drug):
-          target_objtype = target.objtype()
-          if target_objtype in ['Disease','Virus','CellProcess']:
-              diseases.append(target)
-          elif target_objtype in target_types:
-              if CONSISTENCY not in rel:
-                  targets.append(target)
+      disease_types = ['Disease','Virus','CellProcess']
+      targets = dict() # {uid:PSObject}
+      diseases = dict() # {uid:PSObject}
+      dt_need_consistency = set() # {(drug index,target uid)}
+      for i,drug in enumerate(drugs):
+          for r,target,rel in in_d2t2d.targets_of(drug):
+              target_objtype = target.objtype()
+              if target_objtype in disease_types:
+                  diseases[target.uid()] = target
+              elif target_objtype in target_types:
+                  if CONSISTENCY not in rel:
+                      targets[target.uid()] = target
+                      dt_need_consistency.add((i,target.uid()))
 
-      if not targets or not diseases:
+      if not dt_need_consistency:
           return dict()
 
-      d2t_consistencies = defaultdict(lambda: 1.0)
-      for target in targets:
-          known_drug2target_effect = in_d2t2d.effect_vote(drug,target)
-          if known_drug2target_effect: # not unknown
-              effect_str = 'positive' if known_drug2target_effect == 1 else 'negative'
-              consistency_counter = 0
-              inconsistency_counter = 0
-              for disease in diseases:
-                  known_target2disease_effect = in_d2t2d.effect_vote(target,disease,any_direction=True)
-                  # any_direction must be True because Regulation and QuantitativeChange have opposite directions
-                  if not known_target2disease_effect: continue
-                  predicted_drug2disease_effect = known_drug2target_effect*known_target2disease_effect
-              
-                  known_drug2disease_effect = in_d2t2d.effect_vote(drug,disease)
-                  if not known_drug2disease_effect: continue
+      targets = list(targets.values())
+      diseases = list(diseases.values())
+      target2col = {t.uid():j for j,t in enumerate(targets)}
+      d2t_votes = in_d2t2d.effect_vote_matrix(drugs,targets)
+      d2d_votes = in_d2t2d.effect_vote_matrix(drugs,diseases).astype(np.int32)
+      # any_direction must be True because Regulation and QuantitativeChange have opposite directions
+      t2d_votes = in_d2t2d.effect_vote_matrix(targets,diseases,any_direction=True).astype(np.int32)
+      signed_agreement = (d2d_votes @ t2d_votes.T).tocsr()
+      common_diseases = (abs(d2d_votes) @ abs(t2d_votes).T).tocsr()
 
-                  if predicted_drug2disease_effect == known_drug2disease_effect:
-                      consistency_counter += 1
-                  else:
-                      inconsistency_counter += 1
+      rows = np.fromiter((i for i,_ in dt_need_consistency),dtype=np.int64,count=len(dt_need_consistency))
+      cols = np.fromiter((target2col[uid] for _,uid in dt_need_consistency),dtype=np.int64,count=len(dt_need_consistency))
+      d2t_vote = np.asarray(d2t_votes[rows,cols]).ravel().astype(np.int32)
+      known = d2t_vote != 0 # drug-target pairs with unknown effect do not have consistency
+      rows,cols,d2t_vote = rows[known],cols[known],d2t_vote[known]
+      agreement = d2t_vote*np.asarray(signed_agreement[rows,cols]).ravel()
+      common_count = np.asarray(common_diseases[rows,cols]).ravel()
+      consistency_counter = (common_count+agreement)//2
+      inconsistency_counter = (common_count-agreement)//2
+      coefficients = DrugTargetConsistency.__consist_coeff(consistency_counter,inconsistency_counter).round(3).tolist()
 
-              consistency_coeff = DrugTargetConsistency.__consist_coeff(consistency_counter,inconsistency_counter)
-              d2t_consistencies[(drug.uid(),target.uid(),effect_str)] = round(consistency_coeff,3)
-      return dict(d2t_consistencies)
+      d2t_consistencies = dict()
+      for row,col,vote,coefficient in zip(rows.tolist(),cols.tolist(),d2t_vote.tolist(),coefficients):
+          effect_str = 'positive' if vote == 1 else 'negative'
+          d2t_consistencies[(drugs[row].uid(),targets[col].uid(),effect_str)] = coefficient
+      return d2t_consistencies
 
 
   def consistency_correction(self,for_drug:PSObject,acting_on_target:PSObject, with_effect:str):
@@ -7,6 +7,7 @@ from ...utils.pandas.panda_tricks import df,np
 from ..FDA_API.fda_api import FDA
 from ..ReaxysAPI.Reaxys_API import drugs2props
 from numpy import nan_to_num
+from scipy import sparse
 import networkx as nx
 from .DrugTargetConfidence import DrugTargetConsistency
 from ...utils.utils import run_tasks,execution_time,os,DEFAULT_CONFIG_DIR,ThreadPoolExecutor
@@ -87,33 +88,46 @@ class Drugs4Targets(DiseaseTargets):
     return self.data_dir+self.report_name()+ext
 
 
-  def __rank(self,targets:list[PSObject],_4drug:PSObject,with_effect:str,correct_by_consistency:bool)->dict[int,float]:
+  def __drug_target_weights(self,drugs:list[PSObject],targets:list[PSObject],with_effect:str,correct_by_consistency:bool):
     '''
     output:
-      target_uid2corrected_rank = {target_uid:rank},\n
-      if "correct_by_consistency" rank from "self.target_uid2rank" corrected by "self.dt_consist" 
+      target_uid2rank = {target_uid:rank} from "self.target_uid2rank" for "targets",\n
+      sparse matrix [drugs x target_uids] with ranks of targets linked to drugs in "self.drugs2targets" corrected by drug affinity\n
+      and, if "correct_by_consistency", by "self.dt_consist",\n
+      target_uids - columns of sparse matrix
     '''
-  # debug ranking for a drug here:
-    # if _4drug.urn() in ['urn:agi-smol:jr-446','urn:agi-cas:1808916-28-0']:
-    #    print('')
-    targets_uids = ResnetGraph.uids(targets)
-    target_uid2corrected_rank = {k:v for k,v in self.target_uid2rank.items() if k in targets_uids}
+    targets_uids = set(ResnetGraph.uids(targets))
+    target_uid2rank = {k:v for k,v in self.target_uid2rank.items() if k in targets_uids}
+    target_uids = list(target_uid2rank.keys())
+    target2col = {uid:j for j,uid in enumerate(target_uids)}
     meanpX = 6.7 # this value was calculated as average pX of all DirectRegulation from Reaxys
-    for target in targets:
-      target_uid = target.uid()
-      dt_rels = self.drugs2targets._psrels4(_4drug.uid(),target_uid)
-      if dt_rels: # dt_rels may be empty because not every target from df is linked to drug
-        dt_rel = dt_rels[0]
+    rows,cols,pXcorrections,consistency_corrections = list(),list(),list(),list()
+    for row,drug in enumerate(drugs):
+      drug_uid = drug.uid()
+      if drug_uid not in self.drugs2targets: continue
+      for target_uid,edges in self.drugs2targets[drug_uid].items():
+        # not every target from df is linked to drug
+        if target_uid not in target2col or not edges: continue
+        dt_rel = next(iter(edges.values()))['relation']
         if dt_rel.isprimarytarget():
-          pX = float(dt_rels[0].get_prop('Affinity',0,meanpX))
-          pXcorrection = 1.5 + pX/12.0
-          target_uid2corrected_rank[target_uid] *= pXcorrection
-          
-        if correct_by_consistency:
-          consistency_correction = self.dt_consist.consistency_correction(_4drug,target,with_effect)
-          target_uid2corrected_rank[target_uid] *= consistency_correction
+          pX = float(dt_rel.get_prop('Affinity',0,meanpX))
+          pXcorrections.append(1.5 + pX/12.0)
+        else:
+          pXcorrections.append(1.0)
 
-    return target_uid2corrected_rank
+        if correct_by_consistency:
+          target = self.drugs2targets._get_node(target_uid)
+          consistency_corrections.append(self.dt_consist.consistency_correction(drug,target,with_effect))
+        else:
+          consistency_corrections.append(1.0)
+        rows.append(row)
+        cols.append(target2col[target_uid])
+
+    # same multiplication order as for one drug to keep ranks identical
+    ranks = np.array([target_uid2rank[target_uids[col]] for col in cols],dtype=np.float64)
+    corrected_ranks = ranks*np.array(pXcorrections,dtype=np.float64)*np.array(consistency_corrections,dtype=np.float64)
+    weights = sparse.csr_matrix((corrected_ranks,(rows,cols)),shape=(len(drugs),len(target_uids)))
+    return target_uid2rank,weights,target_uids
   
 
   def add_rank(self,_2df:df,d2t_graph:ResnetGraph):
@@ -128,14 +142,9 @@ Adds columns DRUG2TARGET_REGULATOR_SCORE to drug_df.  Used for SNEA
     if DRUG2TARGET_REGULATOR_SCORE not in list(df_copy.columns):
       df_copy[DRUG2TARGET_REGULATOR_SCORE] = np.nan
 
-    for idx in df_copy.index:
-      drug_name = df_copy.at[idx,'Name']
-      try:
-        rank2add = drug2rank[drug_name]
-        new_rank = nan_to_num(df_copy.at[idx,DRUG2TARGET_REGULATOR_SCORE]) + rank2add
-        df_copy.at[idx,DRUG2TARGET_REGULATOR_SCORE] = new_rank
-      except KeyError:
-        continue
+    ranks2add = df_copy['Name'].map(drug2rank)
+    has_rank = ranks2add.notna()
+    df_copy.loc[has_rank,DRUG2TARGET_REGULATOR_SCORE] = nan_to_num(df_copy.loc[has_rank,DRUG2TARGET_REGULATOR_SCORE].to_numpy(dtype=float)) + ranks2add[has_rank].to_numpy()
 
     df_copy._name_ = _2df._name_
     return df_copy
@@ -146,15 +155,12 @@ Adds columns DRUG2TARGET_REGULATOR_SCORE to drug_df.  Used for SNEA
       drug2rank = {d.name():float(d.get_prop(DRUG2TARGET_REGULATOR_SCORE,if_missing_return=0.0)) for d in drug_objs}
       df_copy = my_df.dfcopy()
 
-      for idx in df_copy.index:
-          drug_name = df_copy.at[idx,'Name']
-          try:
-              rank2subtract = drug2rank[drug_name]
-              my_rank = nan_to_num(df_copy.at[idx,DRUG2TARGET_REGULATOR_SCORE])
-              new_rank = my_rank-rank2subtract
-              df_copy.at[idx,DRUG2TARGET_REGULATOR_SCORE] = new_rank
-          except KeyError:
-              continue
+      if DRUG2TARGET_REGULATOR_SCORE not in df_copy.columns:
+          return df_copy
+
+      ranks2subtract = df_copy['Name'].map(drug2rank)
+      has_rank = ranks2subtract.notna()
+      df_copy.loc[has_rank,DRUG2TARGET_REGULATOR_SCORE] = nan_to_num(df_copy.loc[has_rank,DRUG2TARGET_REGULATOR_SCORE].to_numpy(dtype=float)) - ranks2subtract[has_rank].to_numpy()
 
       return df_copy
 
@@ -244,7 +250,8 @@ Directly inhibited targets',\n'Indirectly inhibited targets',\n'Directly activat
     my_drugs = [d for d in my_drugs if d not in self._targets()] # to remove metabolite targets
     
     # initializing drug ranks   
-    drug2rank = {d.uid():[my_dtG.rank_regulator(d,self.__rank(targets,d,with_effect,correct_by_consistency))] for d in my_drugs}
+    target_uid2rank,drug_target_weights,target_uids = self.__drug_target_weights(my_drugs,targets,with_effect,correct_by_consistency)
+    drug2rank = {uid:[rank] for uid,rank in my_dtG.rank_regulators4pairs(my_drugs,target_uid2rank,drug_target_weights,target_uids).items()}
    # print(sortdict(drug2rank, by_key=False, reverse=True, return_top=25))
     nx.set_node_attributes(my_dtG,drug2rank,DRUG2TARGET_REGULATOR_SCORE)
   
@@ -2,6 +2,7 @@ from .ResnetAPISession import APISession, time,SNIPPET_PROPERTIES,glob,Path
 from .ResnetGraph import ResnetGraph,RESNET,OBJECT_TYPE,PSObject,nx, PSRelation, REGULATORS, TARGETS
 from collections import Counter,defaultdict
 from .PSPathway import PSPathway
+from .rnef_writer import open_rnef,RNEF_EXTENSIONS
 from lxml import etree as et
 from urllib.parse import quote
 from concurrent.futures import ThreadPoolExecutor,as_completed
@@ -54,6 +55,9 @@ class FolderContent(APISession):
       new_session.entProps = api_session.entProps
       new_session.relProps = api_session.relProps
       new_session.data_dir = api_session.data_dir
+      new_session.oql_cache = api_session.oql_cache
+      new_session.rnef_writers = api_session.rnef_writers
+      new_session.rnef_writers_lock = api_session.rnef_writers_lock
       new_session.id2folder = dict(self.id2folder)
       new_session.FolderGraph = self.FolderGraph
       new_session.root_folder = self.root_folder
@@ -532,8 +536,8 @@ and {obj_graph.number_of_edges()} relations in {execution_time(fobj_download_sta
         '''
         fobjs = set()  # Using a set directly to avoid duplicate URNs
         fobj_counter = Counter()
-        with open(rnef_file, "r", encoding='utf-8') as f:
-          content = f.read().strip()
+        with open_rnef(rnef_file) as f:
+          content = f.read().decode('utf-8').strip()
         
         # Unfinished RNEF files will be missing </batch> tag
         if not content.endswith('</batch>'):
@@ -565,7 +569,9 @@ and {obj_graph.number_of_edges()} relations in {execution_time(fobj_download_sta
         fobj_counter = Counter()
         path_exist = Path(dirname).exists()
         if path_exist:
-          listing = glob.glob(dirname+"/**/*.rnef", recursive=True)
+          listing = list()
+          for ext in RNEF_EXTENSIONS:
+            listing += glob.glob(dirname+"/**/*"+ext, recursive=True)
           if listing:
             max_workers = min(32,len(listing),(os.cpu_count() or 1) + 4)
             with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='InspectDir') as i:
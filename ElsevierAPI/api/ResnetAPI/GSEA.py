@@ -1,15 +1,48 @@
 import time, glob, os
-import scipy.stats as stats
+import numpy as np
 import xml.etree.ElementTree as et
+from scipy import sparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from .rnef2sbgn import make_file_name,to_sbgn_file
 from .FolderContent import FolderContent,PSPathway
-from .Zeep2Experiment import Experiment
+from .Zeep2Experiment import Experiment,mannwhitneyu4sets
 from ...utils.pandas.panda_tricks import df,ExcelWriter
 from .NetworkxObjects import RELATION_PROPS
 
 MEASURED_COUNT = '# measured entities'
 MEASURED_ENTITIES = 'measured entities'
 
+
+def _sample_enrichment(values:np.ndarray,pvalues:np.ndarray,annotated:np.ndarray,sample_distribution:np.ndarray,
+                       membership:sparse.csr_matrix,difexp_pval_cutoff=0.05):
+    '''
+    input:
+      values,pvalues,annotated - sample annotation of entities in columns of "membership"
+      membership - pathways x entities matrix
+    output:
+      measured_counts,de_counts,value_sums,mw_pvalues for every pathway
+    '''
+    measured_counts = membership @ annotated.astype(float)
+    de_counts = membership @ (annotated & (pvalues <= difexp_pval_cutoff)).astype(float)
+    value_sums = membership @ np.where(annotated,values,0.0)
+    if np.isnan(sample_distribution).any():
+        # stats.mannwhitneyu propagates NaN in sample distribution
+        mw_pvalues = np.full(membership.shape[0],np.nan)
+    else:
+        # mannwhitneyu(x=sample,y=pathway,alternative='less') == mannwhitneyu(x=pathway,y=sample,alternative='greater')
+        mw_pvalues = mannwhitneyu4sets(sample_distribution,np.where(annotated,np.abs(values),np.nan),membership,True)
+    return measured_counts,de_counts,value_sums,mw_pvalues
+
+
+def _init_enrichment_worker(membership:sparse.csr_matrix,difexp_pval_cutoff:float):
+    global _MEMBERSHIP, _DIFEXP_PVAL_CUTOFF
+    _MEMBERSHIP, _DIFEXP_PVAL_CUTOFF = membership, difexp_pval_cutoff
+
+
+def _sample_enrichment_worker(values,pvalues,annotated,sample_distribution):
+    return _sample_enrichment(values,pvalues,annotated,sample_distribution,_MEMBERSHIP,_DIFEXP_PVAL_CUTOFF)
+
 def get_file_listing(dirname:str):
     listing = glob.glob(dirname+'/*.rnef')
     return list(map(os.path.basename, listing))
@@ -128,49 +161,93 @@ class GSEA(FolderContent):
                 self.__load_cache(must_have_urns,folder_name)
 
 
-    def gsea(self, experiment:Experiment, sample_names=[], sample_ids=[], calculate_activity=False):
+    def __pathway_index(self)->tuple[list[str],list[PSPathway],sparse.csr_matrix]:
+        '''
+        Returns
+        -------
+        entity URNs from self.Graph.urn2obj, pathways from self.id2pathway, pathways x entities membership matrix
+        '''
+        urns = list(self.Graph.urn2obj.keys())
+        urn2idx = {u:i for i,u in enumerate(urns)}
+        pathways = list(self.id2pathway.values())
+        rows, cols = list(), list()
+        for row, ps_pathway in enumerate(pathways):
+            member_idxs = [urn2idx[u] for u in ps_pathway.graph.urn2obj if u in urn2idx]
+            rows += [row]*len(member_idxs)
+            cols += member_idxs
+        membership = sparse.csr_matrix((np.ones(len(rows)),(rows,cols)),shape=(len(pathways),len(urns)))
+        return urns, pathways, membership
+
+
+    def __sample_vectors(self,urns:list[str],sample_annotation:str):
+        values = np.full(len(urns),np.nan)
+        pvalues = np.full(len(urns),np.nan)
+        annotated = np.zeros(len(urns),dtype=bool)
+        for i, urn in enumerate(urns):
+            obj = self.Graph.urn2obj[urn]
+            if sample_annotation in obj:
+                values[i], pvalues[i] = obj[sample_annotation][0][:2]
+                annotated[i] = True
+        return values, pvalues, annotated
+
+
+    def gsea(self, experiment:Experiment, sample_names=[], sample_ids=[], calculate_activity=False, max_processes=1):
+        '''
+        Input
+        -----
+        max_processes - number of processes to run Mann-Whitney and Fisher Exact tests for different samples
+
+        pathway membership index is made once and all pathways are tested for every sample in one vectorized pass
+        '''
         start_time = time.time()
         print('Performing GSEA and Fisher Exact test')
 
         samples = experiment.get_samples(sample_names,sample_ids)
         annotated_pathway_counter = set()
         experiment.annotate_objs(self.Graph.urn2obj,sample_names=[],sample_ids=[0])
+        urns, pathways, membership = self.__pathway_index()
+        urn2original_ids = defaultdict(list)
+        for pos, (urn, original_id) in enumerate(zip(experiment.identifiers['URN'],experiment.identifiers['OriginalGeneID'])):
+            urn2original_ids[urn].append((pos,original_id))
+
+        sample_vectors = [self.__sample_vectors(urns,experiment.name4annotation(sample)) for sample in samples]
+        sample_distributions = [sample.data['value'].abs().to_numpy(dtype=float) for sample in samples]
+        if max_processes > 1 and len(samples) > 1:
+            with ProcessPoolExecutor(min(max_processes,len(samples)),initializer=_init_enrichment_worker,
+                                     initargs=(membership,self.diffexp_pvalue_cutoff)) as e:
+                enrichments = list(e.map(_sample_enrichment_worker,*zip(*sample_vectors),sample_distributions))
+        else:
+            enrichments = [_sample_enrichment(*vectors,distribution,membership,self.diffexp_pvalue_cutoff) 
+                           for vectors,distribution in zip(sample_vectors,sample_distributions)]
 
-        for sample in samples:
+        for sample, (values,pvalues,annotated), (measured_counts,de_counts,value_sums,mw_pvalues) in zip(samples,sample_vectors,enrichments):
             sample_annotation = experiment.name4annotation(sample)
-            abs_sample_distribution = sample.data['value'].abs()
-
-            for ps_pathway in self.id2pathway.values():
-                annotated_pathway_obj = {u:o for u,o in self.Graph.urn2obj.items() if u in ps_pathway.graph.urn2obj and sample_annotation in o}
-                # self.Graph.urn2obj can have duplicate 'Id' because it collects objects from multiple pathways
-
-                pathway_values = [v[sample_annotation][0][0] for v in annotated_pathway_obj.values()]
-                ps_pathway[MEASURED_COUNT]= [len(pathway_values)]
-                measured_entities_urns = {n.urn() for n in annotated_pathway_obj.values()}
-                ps_pathway[MEASURED_ENTITIES] = experiment.original_identifiers(measured_entities_urns)
-                
-                sub_pd = df.from_dict({'value':pathway_values})
-                abs_sub_pd = sub_pd['value'].abs()
-                mw_results = stats.mannwhitneyu(x=abs_sample_distribution, y=abs_sub_pd, alternative = 'less') 
-                mv_pvalue = mw_results[1]
-
-                ft_result = sample.fisher_exact(annotated_pathway_obj,using_prefix=experiment.prefix4annotation())
-                if ft_result[1] < 0.05:
-                    ps_pathway[sample_annotation+':FisherExact'] = [ft_result]
+            oddsratios, ft_pvalues = sample.fisher_exact4sets(de_counts,measured_counts,self.diffexp_pvalue_cutoff)
+
+            for row, ps_pathway in enumerate(pathways):
+                member_idxs = membership.indices[membership.indptr[row]:membership.indptr[row+1]]
+                measured_idxs = member_idxs[annotated[member_idxs]]
+                ps_pathway[MEASURED_COUNT]= [len(measured_idxs)]
+                original_ids = sorted(i for idx in measured_idxs for i in urn2original_ids.get(urns[idx],[]))
+                ps_pathway[MEASURED_ENTITIES] = [original_id for _,original_id in original_ids]
+
+                if ft_pvalues[row] < 0.05:
+                    ps_pathway[sample_annotation+':FisherExact'] = [(oddsratios[row],ft_pvalues[row])]
                                 
-                if mv_pvalue <= self.mv_pvalue_cutoff:
-                    logfc_sum = sum([n[sample_annotation][0][0] for n in annotated_pathway_obj.values()])
+                if mw_pvalues[row] <= self.mv_pvalue_cutoff:
+                    logfc_sum = value_sums[row]
                     enity_count = ps_pathway.graph.number_of_nodes(experiment.objtype())
-                    ps_pathway[sample_annotation+':GSEA'] = [(logfc_sum/enity_count, mv_pvalue)]
+                    ps_pathway[sample_annotation+':GSEA'] = [(logfc_sum/enity_count, mw_pvalues[row])]
                     
                     if calculate_activity:
                         pathway_activity = 0.0
-                        for urn, node in annotated_pathway_obj.items():
+                        for idx in measured_idxs:
+                            urn = urns[idx]
                             node_id = ps_pathway.urn2obj[urn]['Id'][0]
                             node_downstrem_rels = ps_pathway.graph.downstream_relations(node_id)
                             node_impact = 0
                             node_impact += sum([r.effect_sign() for r in node_downstrem_rels])
-                            pathway_activity += node_impact*node[sample_annotation][0][0]
+                            pathway_activity += node_impact*values[idx]
                     
                         ps_pathway[sample_annotation+':Activity'] = [pathway_activity]
 
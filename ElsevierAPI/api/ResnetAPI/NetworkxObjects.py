@@ -1,4 +1,4 @@
-import re,json,itertools,pickle,hashlib,math,copy
+import re,json,itertools,pickle,hashlib,math,copy,sys
 from datetime import datetime
 from collections import defaultdict
 
@@ -45,11 +45,48 @@ MINAFFINITY4DIRECT = 6.0
 DIRECT = 1
 INDIRECT = 0
 
+URN2UID = dict() # process-wide {URN:uid} intern table to calculate md5 hash only once per URN
+
+# compact storage: values of POOLED_PROPS are shared between all objects through STRING_POOL
+POOLED_PROPS = {OBJECT_TYPE,EFFECT,MECHANISM,'Organism','CellType','CellLineName','Organ','Tissue','Source',
+                'ChangeType','BiomarkerType','QuantitativeType','TextMods','Phase','TrialStatus',
+                JOURNAL,MEDLINETA,PUBYEAR,'PubTypes','ISSN','ESSN'}
+STRING_POOL = dict() # {value:value}
+
+
+def pooled(value):
+  '''
+  output:
+    shared instance of "value" from STRING_POOL
+  '''
+  return STRING_POOL.setdefault(value,value) if isinstance(value,str) else value
+
+
+def compact_props(props:dict):
+  '''
+  rebuilds props = {prop_name:[values]} in place:\n
+  property names are interned, values of POOLED_PROPS are taken from STRING_POOL,
+  value lists are trimmed to their exact size
+  '''
+  items = list(props.items())
+  props.clear()
+  for prop_name, values in items:
+    if isinstance(prop_name,str):
+      prop_name = sys.intern(prop_name)
+    if isinstance(values,(list,tuple)):
+      if prop_name in POOLED_PROPS:
+        values = [pooled(v) for v in values]
+      values = list(values)
+    props[prop_name] = values
+
 
 class PSObject(defaultdict):  # {PropId:[values], PropName:[values]}
   pass
+
   def __init__(self, dic:dict=dict()):
       super().__init__(list)
+      self._uid_urn = None # URN string memoized self._uid was calculated for
+      self._uid = 0
       if isinstance(dic,dict): # closseness passes <class:type> for some reason
           self.update(dic)
 
@@ -107,14 +144,37 @@ class PSObject(defaultdict):  # {PropId:[values], PropName:[values]}
 
   @staticmethod
   def urn2uid(urn:str):
-      #return hash(urn)
-      my_hash = hashlib.md5(str(urn).encode())
-      return int(my_hash.hexdigest(),32)
+      '''
+      output:
+        md5-based uid for urn. uid is calculated only once per URN and interned in URN2UID
+      '''
+      try:
+        return URN2UID[urn]
+      except KeyError:
+        my_hash = hashlib.md5(str(urn).encode())
+        uid = int(my_hash.hexdigest(),32)
+        URN2UID[urn] = uid
+        return uid
+      
+
+  @staticmethod
+  def clear_uid_cache():
+      '''
+      releases memory used by URN2UID intern table
+      '''
+      URN2UID.clear()
 
 
   def __hash__(self):
       #__hash__ needs __eq__ to work properly
-      return self.urn2uid(self.urn())
+      urn = self.urn()
+      # uid is memoized for the URN string object it was calculated from.
+      # Any change of URN by set_property, update_with_value, merge_obj or direct assignment 
+      # replaces the string object and forces uid recalculation
+      if urn is not self._uid_urn:
+        self._uid = self.urn2uid(urn)
+        self._uid_urn = urn
+      return self._uid
 
 
   def __eq__(self, other:"PSRelation"):
@@ -122,6 +182,18 @@ class PSObject(defaultdict):  # {PropId:[values], PropName:[values]}
       return self.urn() == other.urn()
 
 
+  def compact(self):
+      '''
+      opt-in compact storage for large graphs.
+      Interns property names, shares values of POOLED_PROPS via STRING_POOL and trims value lists.
+      get_prop/get_props/urn API is not affected
+      output:
+        self
+      '''
+      compact_props(self)
+      return self
+
+
   def __repr__(self):
     return f"PSObject({self})"
 
@@ -387,10 +459,14 @@ class PSObject(defaultdict):  # {PropId:[values], PropName:[values]}
     '''
     input:
       use normalized mapdic as input for best mapping
+      mapdic can also be MappingIndex from mapping_index.py
       map_by - defines list of properties for mapping and their order 
     output:
       if URN is remapped self['URN'] = [newURN,oldURN] and self is flagged by 'was_mapped' property
     '''
+    if not isinstance(mapdic,dict): # MappingIndex
+      return mapdic.remap(self,map_by,normalize_propvalues)
+
     for prop in map_by:
       try:
         provals = self.get_props(prop)
@@ -456,6 +532,9 @@ class PSRelation(PSObject):
   references - list of unique references sorted by PUBYEAR in descending order
   '''
   pass
+  # incremented every time ObjTypeName or Effect of any relation is assigned or deleted.
+  # ResnetGraph.relation_index compares it with the value at index creation to detect stale index
+  type_effect_version = 0
 
   def __init__(self, dic=dict()):
       '''
@@ -465,13 +544,12 @@ class PSRelation(PSObject):
       self.PropSetToProps = defaultdict(lambda: defaultdict(list))  # {PropSetID:{PropID:[values]}}
       self.Nodes = defaultdict(list)  # {"Regulators':[PSObject], "Targets':[PSObject]}
       self.references = list() # has to be list for sorting
+      self._refs_cache = None # (self.references,len(self.references)) after self.refs() has sorted and cleaned them
 
 
   def __hash__(self):
       #__hash__ needs __eq__ to work properly
-      urn = self.urn()
-      my_hash = hashlib.md5(str(urn).encode())
-      return int(my_hash.hexdigest(),32)
+      return super().__hash__()
 
 
   def __eq__(self, other):
@@ -479,6 +557,69 @@ class PSRelation(PSObject):
       return self['URN'][0] == other['URN'][0]
 
 
+  def __setitem__(self, key, value):
+      if key in (OBJECT_TYPE,EFFECT):
+        PSRelation.type_effect_version += 1
+      super().__setitem__(key,value)
+
+
+  def __delitem__(self, key):
+      if key in (OBJECT_TYPE,EFFECT):
+        PSRelation.type_effect_version += 1
+      super().__delitem__(key)
+
+
+  def pop(self, key, *default):
+      if key in (OBJECT_TYPE,EFFECT):
+        PSRelation.type_effect_version += 1
+      return super().pop(key,*default)
+
+
+  def __reduce__(self):
+      '''
+      makes Nodes, PropSetToProps and references picklable together with relation properties.
+      Used to pass relations between processes
+      '''
+      propsets = {propset_id:dict(props) for propset_id,props in self.PropSetToProps.items()}
+      return (PSRelation._unpickle,(type(self),dict(self),dict(self.Nodes),propsets,self.references))
+
+
+  @staticmethod
+  def _unpickle(cls,props:dict,nodes:dict,propsets:dict,references:list):
+      rel = cls(props)
+      rel.Nodes.update(nodes)
+      [rel.PropSetToProps[propset_id].update(p) for propset_id,p in propsets.items()]
+      rel.references = references
+      return rel
+
+
+  def compact(self,uid2node:dict[int,PSObject]|None=None):
+      '''
+      input:
+        uid2node - {uid:PSObject} canonical node instances to share among all relations in a graph.
+        Nodes missing in uid2node are compacted and added to uid2node
+      output:
+        self with compacted properties, Nodes, PropSetToProps and references.\n
+        Compacted relation can be modified like relation that was not compacted
+      '''
+      super().compact()
+      if uid2node is None: uid2node = dict()
+      for nodes in self.Nodes.values():
+        for i, node in enumerate(nodes):
+          node_uid = node.uid()
+          try:
+            nodes[i] = uid2node[node_uid]
+          except KeyError:
+            uid2node[node_uid] = node.compact()
+
+      for props in self.PropSetToProps.values():
+        compact_props(props)
+
+      for ref in self.references:
+        compact_props(ref)
+      return self
+
+
   def effect(self,unknown='unknown')->str:
     '''
     output:
@@ -488,6 +629,14 @@ class PSRelation(PSObject):
     return unknown if effect_value not in ['positive','negative'] else effect_value
 
 
+  def set_effect(self,effect:str):
+    '''
+    replaces Effect values with [effect].\n
+    Use it instead of editing self[EFFECT] list in place to keep ResnetGraph.relation_index valid
+    '''
+    self[EFFECT] = [effect]
+
+
   def flip_effect(self):
     '''
     flip effect from positive to negative and vice versa\n
@@ -496,10 +645,10 @@ class PSRelation(PSObject):
         False if effect was not changed
     '''
     if self.effect() == 'positive':
-      self[EFFECT][0] = 'negative'
+      self.set_effect('negative')
       return True
     elif self.effect() == 'negative':
-      self[EFFECT][0] = 'positive'
+      self.set_effect('positive')
       return True
     return False
 
@@ -649,6 +798,7 @@ class PSRelation(PSObject):
         ref_dict.update({ref.identifiers_str(k,v):ref for k,v in ref.Identifiers.items()})
         
     self.references = list(set(ref_dict.values()))
+    self._refs_cache = None
     return len(self.references) - old_refcount
 
 
@@ -750,6 +900,8 @@ class PSRelation(PSObject):
     my_copy.PropSetToProps = copy.deepcopy(self.PropSetToProps)
     my_copy.Nodes = copy.deepcopy(self.Nodes)
     my_copy.references = self.references.copy()
+    if self.__refs_are_cached():
+      my_copy._refs_cache = (my_copy.references,len(my_copy.references))
     return my_copy
   
 
@@ -840,14 +992,25 @@ class PSRelation(PSObject):
       return to_return
 
 
+  def __refs_are_cached(self)->bool:
+    # self.references can be replaced or appended outside of PSRelation methods
+    cache = self._refs_cache
+    return cache is not None and cache[0] is self.references and cache[1] == len(self.references)
+
+
   def refs(self,refresh=False,ref_limit=0,relid2refs:dict[str,list[Reference]]=dict())->list[Reference]:
     '''
     input:
       relid2refs - optional dictionary {RelationID:[Reference]} to use when graph is loaded from Neo4j
     output:
       self.references sorted by PUBYEAR
+    references are made and cleaned once. Cache is invalidated by _add_refs, replace_refs, filter_references and merge_rel
     '''
-    if refresh: self.references.clear()     
+    if refresh: 
+      self.references.clear()
+      self._refs_cache = None
+    elif self.references and self.__refs_are_cached():
+      return self.references[:ref_limit] if ref_limit else self.references
     if not self.references: # making self.references from self.PropSetToProps:
       if relid2refs: # case when graph is loaded from Neo4j
         relid = int(self['RelationID'][0])
@@ -929,6 +1092,7 @@ class PSRelation(PSObject):
     [x.toAuthors() for x in self.references] #converting AUTHORS to _AUTHORS_
     self.references.sort(key=lambda r: r.pubyear(), reverse=True)
     [r.deduplicate_sentences() for r in self.references]
+    self._refs_cache = (self.references,len(self.references))
     return self.references[:ref_limit] if ref_limit else self.references
   
   
@@ -945,6 +1109,8 @@ class PSRelation(PSObject):
       ref2keep = [ref for ref in all_refs if ref.has_values_in(keep_prop2values)]
       if in_place:
         self.references = ref2keep
+        # ref2keep is sorted and cleaned by self.refs()
+        self._refs_cache = (self.references,len(self.references))
       return self.references
 
 
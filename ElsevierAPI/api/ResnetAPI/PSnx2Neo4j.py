@@ -6,6 +6,7 @@ from neo4j import GraphDatabase
 from neo4j import ManagedTransaction as tx
 from neo4j.exceptions import ServiceUnavailable
 from concurrent.futures import ThreadPoolExecutor
+from .neo4j_bulk import load_graph,NEO4J_BATCH,NEO4J_RETRIES
 nondirectional_reltype = list(map(str.upper,NONDIRECTIONAL_RELTYPES))
 
 REL_PROP_Neo4j = ['Name', 'Effect', 'Mechanism', 'Source', 'TextRef']
@@ -258,17 +259,21 @@ class nx2neo4j(GraphDatabase):
       print('%d relation were loaded in %s' % (create_relation_count,execution_time(start)))
 
 
-  def load_graph2neo4j(self, resnet:ResnetGraph):
+  def load_graph_bulk(self, resnet:ResnetGraph, batch_size=NEO4J_BATCH, retries=NEO4J_RETRIES):
+      '''
+      loads nodes grouped by label and relations grouped by type with "UNWIND $rows" statements
+      output:
+        number of loaded nodes, number of loaded relations
+      '''
+      return load_graph(self.session,resnet,batch_size,retries)
+
+
+  def load_graph2neo4j(self, resnet:ResnetGraph, batch_size=NEO4J_BATCH):
       resnet_size = resnet.number_of_edges()
       print('Importing Resnet with %d edges into local Neo4j' % resnet_size)
       import_start = time.time()
       resnet.load_references()
-      if resnet_size > 50000:
-          self.load_nodes(resnet)
-          self.load_relations_multithread(resnet)
-      else:
-          self.load_nodes_1by1(resnet)
-          self.load_relations_1by1(resnet)
+      self.load_graph_bulk(resnet,batch_size)
 
       print("Graph with %d nodes and %d edges was imported into Neo4j in %s ---" % 
           (resnet.number_of_nodes(), resnet_size, execution_time(import_start)))
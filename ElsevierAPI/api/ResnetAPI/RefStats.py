@@ -1,4 +1,4 @@
-import math,time,json,os,zipfile
+import time,json,os,zipfile
 from ...utils.pandas.panda_tricks import df,pd
 from ...utils.utils import ThreadPoolExecutor, execution_time,sortdict,load_api_config
 from ..NCBI_API.pubmed import medlineTA2issn
@@ -6,8 +6,10 @@ from ..NCBI_API.PMC import docid2pmid
 from ..SBS_API.sbs import SBSapi
 from ..ETM_API.etm import ETMsearch
 from ..ScopusAPI.scopus import Scopus,AuthorSearch
-from .references import Reference,DocMine,pubmed_hyperlink,make_hyperlink,pmc_hyperlink,pii_hyperlink,doi_hyperlink
+from .references import Reference,DocMine,pubmed_hyperlink,pii_hyperlink,doi_hyperlink
+from .ref_counter import RefCounter,identifier_hyperlink
 from ..ScopusAPI.scopus import SCOPUS_AUTHORIDS,SCOPUS_CITESCORE,SCOPUS_SJR,SCOPUS_SNIP
+from ...utils.metastore import OPENACCESS_KIND
 from .references import AUTHORS,INSTITUTIONS,JOURNAL,PUBYEAR,RELEVANCE,ETM_CITATION_INDEX,IN_OPENACCESS,PUBLISHER,GRANT_APPLICATION
 from datetime import datetime,date
 from urllib.error import HTTPError
@@ -19,15 +21,15 @@ MAX_TM_SESSIONS = 10 #ETM performance deteriorates if number of concurrent sessi
 
 class RefStats:
   """
-  self.ref_counter = {str(id_type+':'+identifier):(ref,count)}
+  self.ref_counter = RefCounter() with (ref,count) for every (id_type,identifier)
   """
   def __init__(self,APIconfig:dict,**kwargs):
       """
-        self.ref_counter = {(id_type,identifier):(ref,count)}
+        self.ref_counter = RefCounter() with (ref,count) for every (id_type,identifier)
       """
       my_kwargs = {'load_medlineTA': True,'limit':5}
       my_kwargs.update(kwargs)
-      self.ref_counter = dict() # {(id_type,identifier):(ref,count)}
+      self.ref_counter = RefCounter()
       self.refcols = set() # stores refcount columns names for formatting by SemanticSearch.clean_df()
       self.doi_columns = set()
 
@@ -55,30 +57,20 @@ class RefStats:
 
 
   def references(self)->set[DocMine]:
-      return set([x[0] for x in self.ref_counter.values()])
+      return self.ref_counter.references()
 
 
   def _add2counter(self, ref:DocMine):
     '''
     updates:
-      self.ref_counter - {str(id_type+':'+identifier):(ref,count)}
-      ref[RELEVANCE] with ref.relevance()
-
-    output:
-      id_type,identifier of added ref
+      self.ref_counter - RefCounter with count and sum of ref.relevance() for (id_type,identifier) of ref
     '''
-    counter_key = ref.get_doc_id()
-    if counter_key in self.ref_counter:
-      count_exist = self.ref_counter[counter_key][1]
-      self.ref_counter[counter_key] = (ref, count_exist+1)
-      self.ref_counter[counter_key][0][RELEVANCE][0] += ref.relevance()
-    else:
-      self.ref_counter[counter_key] = (ref,1)
+    self.ref_counter.add(ref)
 
 
   def counter2df(self, use_relevance=True):
     """
-    Creates DataFrame from self.ref_counter = {identifier:(ref,ref_count)}
+    Creates DataFrame from self.ref_counter
     used to count references from ETM
     """
     if not self.ref_counter: 
@@ -86,44 +78,14 @@ class RefStats:
       return df()
     
     first_col = RELEVANCE if use_relevance else ETM_CITATION_INDEX
-    header = [first_col,PUBYEAR,'Identifier type',IDENTIFIER_COLUMN,'Citation']
-
-    # normalization constant for relevance score between 0 and 100
-    log_scores = []
-    for ref, refcount in self.ref_counter.values():
-      boosted_relevance = ref.relevance() * int(refcount)
-      ref[RELEVANCE] = [boosted_relevance]
-      log_scores.append(math.log(boosted_relevance,10))
-    
-    #normalization_constant = statistics.median(relevance_vec)
-    min_log = min(log_scores)
-    max_log = max(log_scores)
-    maxmin = max_log - min_log
-
-    table_rows = set()
-    for (id_type,identifier), (ref,refcount) in self.ref_counter.items():
-      assert(isinstance(ref,Reference))
-      if use_relevance:
-        score = 100 * (math.log(ref[RELEVANCE][0],10)-min_log)/maxmin
-      else:
-        score = refcount
-        
-      biblio_str,_,_ = ref._biblio_tuple()
-      if id_type == 'PMID':
-          identifier = pubmed_hyperlink([identifier],identifier)
-      elif id_type == 'DOI':
-          identifier = make_hyperlink(identifier,'http://dx.doi.org/')
-      elif id_type == 'PMC':
-          identifier = pmc_hyperlink([identifier],identifier)
-      elif id_type == 'PII':
-          identifier =  pii_hyperlink(identifier,identifier)
-      table_rows.add(tuple([score,ref.pubyear(),id_type,identifier,biblio_str]))
-
-    return_df = df.from_rows(list(table_rows),header)
+    columns = {first_col: self.ref_counter.scores(use_relevance),
+               PUBYEAR: self.ref_counter.pubyears(),
+               'Identifier type': self.ref_counter.id_types(),
+               IDENTIFIER_COLUMN: self.ref_counter.hyperlinks(),
+               'Citation': self.ref_counter.biblios()}
+    return_df = df.from_dict(columns)
     if use_relevance:
-      return_df[RELEVANCE] = return_df[RELEVANCE].astype(float).round(2)
-    else:
-      return_df[ETM_CITATION_INDEX] = return_df[ETM_CITATION_INDEX].astype(int)
+      return_df[RELEVANCE] = return_df[RELEVANCE].round(2)
 
     return_df[PUBYEAR] = pd.to_numeric(return_df[PUBYEAR], errors='coerce')
     return_df = return_df.sortrows(by=first_col)
@@ -140,21 +102,13 @@ class RefStats:
       use for external ref_counter = {Reference} where Reference objects are annotated as Reference[stat_prop]
       used to count references in ResnetGraph()
       '''
-      table_rows = set()
-      for ref in ref_counter:
-          biblio_str, id_type, identifier = ref._biblio_tuple()
-          if id_type == 'PMID':
-              identifier = pubmed_hyperlink([identifier],identifier)
-          elif id_type == 'DOI':
-              identifier = make_hyperlink(identifier,'http://dx.doi.org/')
-          elif id_type == 'NCT ID':
-              identifier = make_hyperlink(identifier,'https://clinicaltrials.gov/ct2/show/')
-          elif id_type == 'PMC':
-              identifier = pmc_hyperlink([identifier],identifier)
-          table_rows.add(tuple([ref[stat_prop][0],id_type,identifier,biblio_str]))
-
-      header = [stat_prop,'Identifier type',IDENTIFIER_COLUMN,'Citation']
-      return_df = df.from_rows(list(table_rows),header)
+      refs = list(ref_counter)
+      biblio_tuples = [ref._biblio_tuple() for ref in refs]
+      columns = {stat_prop: [ref[stat_prop][0] for ref in refs],
+                 'Identifier type': [id_type for _,id_type,_ in biblio_tuples],
+                 IDENTIFIER_COLUMN: [identifier_hyperlink(id_type,identifier) for _,id_type,identifier in biblio_tuples],
+                 'Citation': [biblio_str for biblio_str,_,_ in biblio_tuples]}
+      return_df = df.from_dict(columns).drop_duplicates()
       if stat_prop == RELEVANCE:
           return_df[RELEVANCE] = return_df[RELEVANCE].astype(float).round(2)
       else:
@@ -345,7 +299,7 @@ class SBSstats(RefStats):
     names2hyperlinks = dict()
     for name, (search_url,count, refs) in name2refs.items():
       names2hyperlinks[name] = self._2hyperlink(refs,count,search_url)
-      [self._add2counter(ref) for ref in refs]
+      self.ref_counter.add_refs(refs)
     # true count of rows with non-zero references are printed by sentcooc4list, so here we print only the count of rows with hyperlinks added
     print(f'Added SBS references to worksheet "{to_df._name_}" with {len(to_df)} rows in {execution_time(start_time)}')
     return names2hyperlinks
@@ -439,7 +393,7 @@ class ETMStats(RefStats):
           for f in futures: # cannot use as_completed here to ensure the same order for concatenation
               session_df, session_refcounter = f.result()
               dfs2concat.append(session_df)
-              [self._add2counter(t[0]) for t in session_refcounter.values()] # combine references from all futures 
+              self.ref_counter.merge(session_refcounter) # combine references from all futures 
 
           dfs2concat.append(unannoated_rows)
 
@@ -494,7 +448,7 @@ class ETMStats(RefStats):
               for f in futures: # cannot use as_completed here to ensure the same order for concatenation
                   session_df, session_refcounter = f.result()
                   dfs2concat.append(session_df)
-                  [self._add2counter(t[0]) for t in session_refcounter.values()] # combine references from all futures
+                  self.ref_counter.merge(session_refcounter) # combine references from all futures
               
               dfs2concat.append(unannoated_rows)
               annotated_df = df.concat_df(dfs2concat,to_df._name_)
@@ -551,7 +505,7 @@ class ETMStats(RefStats):
         total_hits += hit_count
         references.update(refs)
 
-    [self._add2counter(ref) for ref in references]
+    self.ref_counter.add_refs(references)
     if getScopusInfo:
       [self.Scopus.scopus_stats4(ref) for ref in references]
 
@@ -693,45 +647,37 @@ class ETMcache (RefStats):
         
 
     def scopus_annotation(self):
+        '''
+        open access status and journal metrics are taken from self.Scopus.store before requesting Scopus
+        '''
         def set_oa_status(ref:Reference):
-            ref_doi = ref.doi()
-            if ref_doi:
-                try:
-                    ref[IN_OPENACCESS] = [bool(doi2oa[ref_doi])]
-                except KeyError:
-                    is_in_oa = self.Scopus.is_in_open_access(ref)
-                    ref[IN_OPENACCESS] = [is_in_oa]
-                    doi2oa[ref_doi] = is_in_oa
+            if ref.doi():
+                ref[IN_OPENACCESS] = [self.Scopus.is_in_open_access(ref)]
             else:
-                print(f'#{i} article "{etm_ref.title()}" out of {len(self.articles)} has no DOI!!!')
+                print(f'Article "{ref.title()}" out of {len(self.articles)} has no DOI!!!')
 
         dump_dir = os.path.join(self.etm_results_dir,'')
         do12oa_dump = dump_dir+self.search_name+'_do12oa.json'
-        try:
-            doi2oa = json.load(open(do12oa_dump, 'r',encoding='utf-8'))
-        except FileNotFoundError:
-            doi2oa = dict()
+        if self.Scopus.store.import_json(OPENACCESS_KIND,do12oa_dump):
+            os.replace(do12oa_dump,do12oa_dump+'.imported')
 
         print(f'Reannotating articles from "{self.search_name}" query with Scopus data')
-        for i,article in enumerate(self.articles):
+        etm_refs = list()
+        for article in self.articles:
             etm_ref = ETMsearch.article2ref(article)
             if etm_ref: # etm_ref can be empty if it is conference proceedings
-            # scopus_authors = self.AuthorSearch.get_authors(etm_ref)
-                if etm_ref.journal() != GRANT_APPLICATION:
-                    with ThreadPoolExecutor(max_workers=3, thread_name_prefix='Scopus annotation') as e:
-                        #e.submit(self.AuthorSearch.normalize_institution,etm_ref)
-                        e.submit(set_oa_status,etm_ref)
-                        e.submit(self.get_publisher,etm_ref)
-                    e.shutdown()
-
-                relevance_score = float(article['score'])
-                etm_ref[RELEVANCE] = [relevance_score]
-                self._add2counter(etm_ref)
+                etm_ref[RELEVANCE] = [float(article['score'])]
+                etm_refs.append(etm_ref)
+
+        journal_refs = [r for r in etm_refs if r.journal() != GRANT_APPLICATION]
+        with ThreadPoolExecutor(max_workers=MAX_TM_SESSIONS, thread_name_prefix='Scopus annotation') as e:
+            oa_futures = [e.submit(set_oa_status,r) for r in journal_refs]
+            [self.get_publisher(r) for r in journal_refs] # Scopus requests change self.Scopus.params
+            [f.result() for f in oa_futures]
+        self.ref_counter.add_refs(etm_refs)
 
         self.AuthorSearch.close()
         self.Scopus.close()
-        with open(do12oa_dump, 'w',encoding='utf-8') as f:
-            json.dump(doi2oa,f,indent=1)
 
 
     def get_statistics(self, stat_prop_list):
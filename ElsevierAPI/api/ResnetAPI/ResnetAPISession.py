@@ -1,14 +1,20 @@
 import time, math, os, glob, json, threading
 import networkx as nx
+from lxml import etree as et
 from zeep import exceptions
 from pathlib import Path
+from concurrent.futures import wait,FIRST_COMPLETED
 from collections import defaultdict
 
 from .ZeepToNetworkx import PSNetworx, len
-from .ResnetGraph import ResnetGraph,df,REFCOUNT,CHILDS,DBID,PSObject,OBJECT_TYPE
+from .ResnetGraph import ResnetGraph,df,REFCOUNT,CHILDS,DBID,PSObject,PSRelation,OBJECT_TYPE
 from .NetworkxObjects import RELATION_PROPS,ALL_PSREL_PROPS,EFFECT
 from .PathwayStudioGOQL import OQL
 from .Zeep2Experiment import Experiment
+from .oql_cache import OQLcache,OQL_CACHE_TTL,OQL_CACHE_SIZE
+from .oql_batcher import OQLbatcher,ChunkSizer,OQL_MAX_IDS
+from .rnef_writer import RNEFwriter,COMPRESSION2EXT,has_closing_batch_tag
+from .mapping_index import MappingIndex
 from ..ResnetAPI.references import PS_BIBLIO_PROPS,PS_SENTENCE_PROPS,PS_REFIID_TYPES
 from ..ScopusAPI.scopus import loadCI
 from ...utils.utils import ThreadPoolExecutor,as_completed,urlencode,unpack,execution_time,execution_time2,load_api_config,pretty_xml,list2chunks_generator,multithread
@@ -31,7 +37,8 @@ ALL_PROPERTIES = 10
 NO_RNEF_REL_PROPS={'RelationNumberOfReferences','Name','URN'}
 
 APISESSION_KWARGS = {'what2retrieve','connect2server','no_mess','data_dir',TO_RETRIEVE,
-                  'use_cache','load_model','ent_props','rel_props','useNeo4j'}
+                  'use_cache','load_model','ent_props','rel_props','useNeo4j',
+                  'oql_cache_dir','oql_cache_ttl','oql_cache_size'}
 MAX_SESSIONS = 25 # by default sessions_max=200 in Oracle 
 MAX_PAGE_THREADS = 80
 MAX_OQLSTR_LEN = 65000 # string properties can form long oql queries exceeding 65000 chars limit
@@ -49,6 +56,7 @@ class APISession(PSNetworx):
     reference_cache_size = 1000000 # max number of reference allowed in self.Graph. Clears self.Graph if exceeded
     resnet_size = 1000 # number of <node><control> sections in RNEF dump
     max_rnef_size = 100000000 # max size of RNEF XML dump file. If dump file exceeds max_file_size new file is opened with index++
+    rnef_compression = '' # compression of RNEF dump files: '', 'gzip' or 'zstd'
     max_sessions = MAX_SESSIONS
     data_dir = ''
     sep = '\t'
@@ -72,6 +80,8 @@ class APISession(PSNetworx):
         [DATABASE_REFCOUNT_ONLY,REFERENCE_IDENTIFIERS,BIBLIO_PROPERTIES,SNIPPET_PROPERTIES,ONLY_REL_PROPERTIES,ALL_PROPERTIES]
         no_mess - default True, if False your script becomes more verbose
         connect2server - default True, set to False to run script using data in __pscache__ files instead of database
+        oql_cache_dir - if not empty, results of process_oql are cached in this directory. Defaults to ''
+        oql_cache_ttl, oql_cache_size - expiration time in seconds and max size in bytes of OQL cache
         '''
         self.GOQLquery = str()
         self.DumpFiles = []
@@ -84,7 +94,10 @@ class APISession(PSNetworx):
                             'oql_queries' : [],
                             'add2self':True,
                             'connect2server':True,
-                            'useNeo4j' : False
+                            'useNeo4j' : False,
+                            'oql_cache_dir' : '',
+                            'oql_cache_ttl' : OQL_CACHE_TTL,
+                            'oql_cache_size' : OQL_CACHE_SIZE
                             }
 
         my_kwargs.update(kwargs)
@@ -109,6 +122,10 @@ class APISession(PSNetworx):
         self.ontology_cache = dict() # {urn:[urns]}
         if my_kwargs.pop('useNeo4j',False):
           self.neo4j = nx2neo4j()
+        oql_cache_dir = my_kwargs.get('oql_cache_dir','')
+        self.oql_cache = OQLcache(oql_cache_dir,my_kwargs['oql_cache_ttl'],my_kwargs['oql_cache_size']) if oql_cache_dir else None
+        self.rnef_writers = dict() # {(dump folder path,dump file base name):RNEFwriter}
+        self.rnef_writers_lock = threading.Lock()
 
     @staticmethod
     def _what2retrieve(what2retrieve:int):
@@ -192,6 +209,10 @@ class APISession(PSNetworx):
         if self.useNeo4j():
           new_session.neo4j = self.neo4j
 
+        new_session.oql_cache = self.oql_cache
+        # clones share RNEFwriters to let parent session close dump files written by clones
+        new_session.rnef_writers = self.rnef_writers
+        new_session.rnef_writers_lock = self.rnef_writers_lock
         return new_session
 
 
@@ -206,16 +227,6 @@ class APISession(PSNetworx):
         self.ResultRef = None
 
 
-    def __add2self(self,other:'APISession'):
-        '''
-        needs relations to have dbid
-        works only with another graph from database
-        '''
-        if self.add2self:
-            self.Graph = self.Graph.compose(other.Graph)
-            self.dbid2relation.update(other.dbid2relation)
-
-
     def set_dir(self,indir:str):
         self.data_dir = os.path.join(indir, '')
 
@@ -305,30 +316,89 @@ class APISession(PSNetworx):
           else: return ResnetGraph()
 
 
+    def __fetch_page(self,result_pos:int):
+        '''
+        1st stage of retrieval pipeline
+        output:
+          zeep_data with page of results starting from result_pos
+        '''
+        obj_props = self.relProps if self.getLinks else self.entProps
+        zeep_data,_,_ = self.get_session_page(self.ResultRef, result_pos, self.PageSize,
+                                              self.ResultSize,obj_props,getLinks=self.getLinks)
+        return zeep_data
+
+
+    def __page2graph(self,zeep_data)->tuple[ResnetGraph,dict[int,PSRelation]]:
+        '''
+        2nd stage of retrieval pipeline: retrieves properties for entities linked by relations in zeep_data
+        output:
+          page graph, {dbid:PSRelation}
+        '''
+        if isinstance(zeep_data, type(None)):
+            return ResnetGraph(), dict()
+        if self.getLinks and len(zeep_data.Links.Link) > 0:
+            obj_dbids = list(set([x['EntityId'] for x in zeep_data.Links.Link]))
+            zeep_objects = self.get_object_properties(obj_dbids, self.entProps)
+            return self._zeep2graph(zeep_data, zeep_objects)
+        else:
+            return self._zeep2graph(None, zeep_data)
+
+
     def __thread__(self,pages:int,process_name='oql_results'):
+      '''
+      retrieves next "pages" pages of results starting from self.ResultPos.\n
+      Page retrieval and retrieval of entity properties for the page relations run as pipeline in MAX_PAGE_THREADS threads.\n
+      At most 2*max_workers pages are in flight. Finished pages are merged in place into one graph in calling thread
+      output:
+        ResnetGraph with retrieved pages. Graph is also added to self.Graph if self.add2self
+      '''
       max_workers = pages if pages < MAX_PAGE_THREADS else MAX_PAGE_THREADS
+      first_pos = self.ResultPos
+      last_pos = min(first_pos+pages*self.PageSize, self.ResultSize)
+      download_size = max(last_pos-first_pos,0)
       if not self.no_mess:
-        print(f'Retrieval starts from {self.ResultPos} result')
-        remaining_retrieval = self.ResultSize - self.ResultPos
-        next_download_size = min(pages*self.PageSize, remaining_retrieval)
-        print(f'Begin retrieving next {next_download_size} results in {max_workers} threads',flush=True)
+        print(f'Retrieval starts from {first_pos} result')
+        print(f'Begin retrieving next {download_size} results in {max_workers} threads',flush=True)
     
       entire_graph = ResnetGraph()
-      result_pos = self.ResultPos
+      new_relations = dict()
+      positions = iter(range(first_pos,last_pos,self.PageSize))
+      future2page = dict() # {future:(stage,result_pos)}
+      retrieved = 0
+      pages_done = 0
+      report_every = max(1,int(pages/10))
+      start = time.time()
       with ThreadPoolExecutor(max_workers, thread_name_prefix=process_name) as e:
-        futures = list()
-        for i in range(0,pages):
-            futures.append(e.submit(self.__nextpage__,result_pos))
-            result_pos += self.PageSize
-        
-        for future in as_completed(futures):
-            try:
-                entire_graph = entire_graph.compose(future.result())
-            except exceptions.TransportError:
-                raise exceptions.TransportError
-        e.shutdown()
+        def fetch_next():
+          result_pos = next(positions,None)
+          if result_pos is not None:
+            future2page[e.submit(self.__fetch_page,result_pos)] = (1,result_pos)
+
+        [fetch_next() for _ in range(2*max_workers)]
+        try:
+          while future2page:
+            done, _ = wait(future2page, return_when=FIRST_COMPLETED)
+            for future in done:
+              stage, result_pos = future2page.pop(future)
+              if stage == 1:
+                future2page[e.submit(self.__page2graph,future.result())] = (2,result_pos)
+              else:
+                page_graph, page_relations = future.result()
+                entire_graph.compose_inplace(page_graph)
+                new_relations.update(page_relations)
+                retrieved += min(self.PageSize,last_pos-result_pos)
+                pages_done += 1
+                fetch_next()
+                if not self.no_mess and (pages_done % report_every == 0 or not future2page):
+                  elapsed = max(time.time()-start,1e-6)
+                  print(f'"{process_name}": {retrieved} of {download_size} results retrieved in {execution_time(start)} ({retrieved/elapsed:.0f} results/sec)',flush=True)
+        except exceptions.TransportError:
+          [f.cancel() for f in future2page]
+          raise exceptions.TransportError
       
-      self.ResultPos = result_pos
+      if self.add2self:
+        self._add2graph(entire_graph,new_relations)
+      self.ResultPos = first_pos+pages*self.PageSize
       return entire_graph
 
 
@@ -337,10 +407,22 @@ class APISession(PSNetworx):
         output:
           if max_result is not 0 and number of results exceeds max_result returns int = self.ResultSize\n
           otherwise returns ResnetGraph with query results
+        results are loaded from self.oql_cache if session was created with "oql_cache_dir"
         '''
         with threading.Lock():
           self.__replace_goql(oql_query)
           start_time = time.time()
+          use_oql_cache = self.oql_cache is not None and not max_result and not debug
+          if use_oql_cache:
+            cache_key = self.oql_cache.key(oql_query,self.entProps,self.relProps,self.getLinks,self.APIconfig.get('ResnetURL',''))
+            cached_graph = self.oql_cache.get(cache_key)
+            if isinstance(cached_graph,ResnetGraph):
+              if self.add2self:
+                self._add2graph(cached_graph,self.oql_cache.dbid2rel(cached_graph))
+              if not self.no_mess:
+                print(f'"{request_name if request_name else self.GOQLquery[:100]}" results were loaded from OQL cache')
+              return cached_graph
+
           return_type = 'relations' if self.getLinks else 'entities'
           entire_graph = self.__init_session(max_result=max_result,request_name=request_name)
           if debug: return entire_graph
@@ -356,20 +438,23 @@ class APISession(PSNetworx):
                       print('\n\"%s\"\nrequest found %d %s.\n%d is retrieved. Remaining %d results will be retrieved in %d iterations' % 
                   (my_request_name,self.ResultSize,return_type,self.ResultPos,(self.ResultSize-self.PageSize),pages))
                   try:
-                      iterations_graph = self.__thread__(pages,process_name=request_name)
-                      entire_graph = entire_graph.compose(iterations_graph)
+                      iterations_graph = self.__thread__(pages,process_name=my_request_name)
+                      entire_graph.compose_inplace(iterations_graph)
                   except exceptions.TransportError:
                       raise exceptions.TransportError('Table lock detected!!! Aborting operation!!!')
 
                   if not self.no_mess:
-                      print('"%s"\nretrieved %d nodes and %d edges in %s by %d parallel iterations' % 
+                      elapsed = max(time.time()-start_time,1e-6)
+                      print('"%s"\nretrieved %d nodes and %d edges in %s by %d parallel iterations (%.0f results/sec)' % 
                       (my_request_name, entire_graph.number_of_nodes(), entire_graph.number_of_edges(),
-                              execution_time(start_time), pages+1),flush=True)
+                              execution_time(start_time), pages+1, self.ResultSize/elapsed),flush=True)
 
           self.ResultRef = ''
           self.ResultPos = 0
           self.ResultSize = 0
           self.__IsOn1st_page = True
+          if use_oql_cache:
+            self.oql_cache.put(cache_key,entire_graph,oql_query)
           return entire_graph
 
 
@@ -433,13 +518,72 @@ class APISession(PSNetworx):
             return self.process_oql(oql,request_name)
 
 
+    @staticmethod
+    def __join_ids(ids:list)->str:
+        return ','.join(list(map(str,ids)))
+
+
+    def __chunk_sizer(self,oql_query:str,values:list,step:int)->ChunkSizer:
+        '''
+        output:
+          ChunkSizer starting from "step" identifiers. 
+          String properties can form long oql queries exceeding MAX_OQLSTR_LEN chars limit
+        '''
+        if oql_query.find('{ids',20) > 0:
+            return ChunkSizer(step)
+        max_id_len = max([len(str(s)) for s in values])
+        max_size = int(MAX_OQLSTR_LEN/max_id_len)
+        return ChunkSizer(min(step,max_size),max_size)
+
+
+    def __run_batches(self,jobs:list[tuple[str,list]],join_list,sizer:ChunkSizer,request_name='',download=False)->ResnetGraph:
+        '''
+        input:
+          jobs - [(oql_query,ids)], where oql_query has {ids} placeholder
+        output:
+          graph merged from results of all chunks. Results are also added to self.Graph if self.add2self
+        '''
+        lock = threading.Lock() if download else None
+        sessions_graph = ResnetGraph()
+        sessions_lock = threading.Lock()
+        def run_chunk(session:APISession,oql_query:str,ids:list,chunk_name:str):
+            oql_query_with_ids = oql_query.format(ids=join_list(ids))
+            if self.dump_oql_queries:
+                self.my_oql_queries.append((oql_query_with_ids,chunk_name))
+            chunk_graph = session.choose_process(oql_query_with_ids,chunk_name,download,lock)
+            # session is reused for many chunks. process_oql copies session.Graph to add results,
+            # therefore session.Graph is moved into sessions_graph and emptied after every chunk
+            if self.add2self:
+                with sessions_lock:
+                    sessions_graph.compose_inplace(session.Graph)
+                    self.dbid2relation.update(session.dbid2relation)
+            session.Graph = ResnetGraph()
+            session.dbid2relation = dict()
+            return chunk_graph
+
+        # every worker thread uses its own session to avoid ResultRef pointer overwriting
+        batcher = OQLbatcher(self._clone_session,self.max_sessions,sizer)
+        try:
+            entire_graph = batcher.run(jobs,run_chunk,request_name,merge=not download)
+        finally:
+            for session in batcher.sessions:
+                session.close_connection()
+            if sessions_graph:
+                self.Graph = self.Graph.compose(sessions_graph)
+
+        if self.dump_oql_queries:
+            with open(self.data_dir+"iterations_oql.json","w") as o:
+                json.dump(self.my_oql_queries,o)
+        return entire_graph
+
+
     def __iterate__(self,oql_query:str,dbids:set,request_name='',step=1000,download=False):
         '''
         Input
         -----
         oql_query MUST contain string placeholder called {ids} to iterate dbids\n
         oql_query MUST contain string placeholder called {props} to iterate other database properties
-        "step" - controls duration of request to avoid timeout during multithreading
+        "step" - size of the first chunks. Next chunks are sized by oql_batcher.ChunkSizer to avoid timeout
 
         uses self.entProp and self.relProp to retrieve properties\n
         use self.add2self and self.merge2self to control caching
@@ -448,52 +592,17 @@ class APISession(PSNetworx):
         use self.close_rnef_dump() to close batch
         '''
         if not dbids: return ResnetGraph()
+        dbids_list = list(dbids)
+        sizer = self.__chunk_sizer(oql_query,dbids_list,step)
         if oql_query.find('{ids',20) > 0:
             my_oql = oql_query
-            iteration_size =  min(step,1000)
-            def join_list (l:list):
-                return ','.join(list(map(str,l)))
+            join_list = self.__join_ids
         else:
             my_oql = oql_query.replace('{props','{ids')
-            # string properties can form long oql queries exceeding 65500 chars limit
-            max_id_len = max([len(str(s)) for s in dbids])
-            iteration_size = min(step, 1000, int(MAX_OQLSTR_LEN/max_id_len))
-            def join_list (l:list):
-                return OQL.join_with_quotes(l)
-
-        number_of_iterations = math.ceil(len(dbids)/iteration_size)  
-        # new sessions must be created to avoid ResultRef pointer overwriting
-        entire_graph = ResnetGraph()
-        thread_name = f'Iterate_{len(dbids)}_ids_by_{iteration_size}'
+            join_list = OQL.join_with_quotes
+
         print(f'Retrieval of {len(dbids)} objects will be done in {self.max_sessions} parallel sessions' )
-        dbids_list = list(dbids)
-        lock = threading.Lock() if download else None
-        with ThreadPoolExecutor(max_workers=self.max_sessions, thread_name_prefix=thread_name) as e:
-          future_sessions = list()
-          futures = list()
-          for i in range(0,len(dbids_list), iteration_size):
-            iter_dbids = dbids_list[i:i+iteration_size]
-            oql_query_with_dbids = my_oql.format(ids=join_list(iter_dbids))
-            iter_name = f'Iteration #{int(i/iteration_size)+1} in {number_of_iterations} for "{request_name}" retrieving {len(iter_dbids)} ids'
-            if self.dump_oql_queries:
-                self.my_oql_queries.append((oql_query_with_dbids,iter_name))   
-            future_session = self._clone_session()
-            futures.append(e.submit(future_session.choose_process,oql_query_with_dbids,iter_name,download,lock))
-            future_sessions.append(future_session)
-          
-          if not download:
-              for future in as_completed(futures):
-                  entire_graph = entire_graph.compose(future.result())
-          
-          for session in future_sessions:
-              self.__add2self(session)
-              session.close_connection()
-          e.shutdown()
-        
-        if self.dump_oql_queries:
-            with open(self.data_dir+"iterations_oql.json","w") as o:
-                json.dump(self.my_oql_queries,o)
-        return entire_graph
+        return self.__run_batches([(my_oql,dbids_list)],join_list,sizer,request_name,download)
 
 
     def __iterate_oql__(self,oql_query:str,ids_or_props:set,request_name='',step=1000,download=False):
@@ -533,49 +642,33 @@ class APISession(PSNetworx):
         Input
         -----
         oql_query MUST contain string placeholder called {ids} to iterate dbids\n
-        oql_query MUST contain string placeholder called {props} to iterate other database properties
+        oql_query MUST contain string placeholder called {props} to iterate other database properties\n
+        Shorter list is cut into chunks of "step" identifiers.
+        All pairs of its chunks with adaptively sized chunks of longer list are processed concurrently
         '''
-        
+        if not ids1 or not ids2: return ResnetGraph()
         if oql_query.find('{ids',20) > 0:
             id_oql = oql_query
-            hint = r'{ids}'
-            iteration1step = min(step, 1000) # cannot exceed 1000
-            iteration2step = min(2*iteration1step, 1000) # cannot exceed 1000
-            def join_list (l:list):
-                return ','.join(list(map(str,l)))
+            join_list = self.__join_ids
+            iteration1step = min(step, OQL_MAX_IDS)
+            sizer = ChunkSizer(min(2*iteration1step, OQL_MAX_IDS))
         else:
             id_oql = oql_query.replace('{props','{ids')
-            hint = r'{props}'
+            join_list = OQL.join_with_quotes
             # string properties can form long oql queries exceeding 65500 chars limit
-            max_id_len = max(len(str(s)) for s in ids1)
-            iteration1step = min(step, 1000, int(MAX_OQLSTR_LEN/max_id_len))
-            iteration2step = min(2*iteration1step, 1000)
-            def join_list (l:list):
-                return OQL.join_with_quotes(l)
-                             
-        number_of_iterations = math.ceil(len(ids1)/iteration1step) * math.ceil(len(ids2)/iteration2step)
-        if not number_of_iterations: return ResnetGraph()
-        print(f'Iterating {len(ids1)} entities with {len(ids2)} entities for {request_name}')
-        if number_of_iterations > 2:
-            print(f'Query will be executed in {number_of_iterations} iterations by {self.max_sessions} sessions')
+            max_id_len = max(len(str(s)) for s in ids1+ids2)
+            iteration1step = min(step, OQL_MAX_IDS, int(MAX_OQLSTR_LEN/max_id_len))
+            sizer = ChunkSizer(min(2*iteration1step, OQL_MAX_IDS),int(MAX_OQLSTR_LEN/max_id_len))
 
-        entire_graph = ResnetGraph()
         if len(ids1) <= len(ids2):
-            for i1 in range(0,len(ids1), iteration1step):
-                iter_ids1 = ids1[i1:i1+iteration1step]
-                iter_oql_query = id_oql.format(ids1=join_list(iter_ids1),ids2=hint)
-                iter_graph = self.__iterate__(iter_oql_query,set(ids2),'iteration2',iteration2step,download)
-                entire_graph = entire_graph.compose(iter_graph)
-                print(f'Processed {min([i1+iteration1step,len(ids1)])} in {len(ids1)} identifiers against {len(ids2)} identifiers')
+            jobs = [(id_oql.format(ids1=join_list(ids1[i:i+iteration1step]),ids2='{ids}'),ids2) for i in range(0,len(ids1),iteration1step)]
         else:
-            for i2 in range(0,len(ids2), iteration1step):
-                iter_ids2 = ids2[i2:i2+iteration1step]
-                iter_oql_query = id_oql.format(ids1=hint,ids2=join_list(iter_ids2))
-                iter_graph = self.__iterate__(iter_oql_query,set(ids1),'iteration2',iteration2step,download)
-                entire_graph = entire_graph.compose(iter_graph)
-                print(f'Processed {min([i2+iteration1step,len(ids2)])} in {len(ids2)} identifiers against {len(ids1)} identifiers')
-            
-        return entire_graph
+            jobs = [(id_oql.format(ids1='{ids}',ids2=join_list(ids2[i:i+iteration1step])),ids1) for i in range(0,len(ids2),iteration1step)]
+
+        print(f'Iterating {len(ids1)} entities with {len(ids2)} entities for {request_name}')
+        if len(jobs) > 1:
+            print(f'Query will be executed in {len(jobs)} iterations by {self.max_sessions} sessions')
+        return self.__run_batches(jobs,join_list,sizer,request_name,download)
     
 
     def __iterate_oql2__(self,oql_query:str, ids_or_props1:set, ids_or_props2:set, request_name='', step=500):
@@ -665,7 +758,7 @@ class APISession(PSNetworx):
                 futures.append(e.submit(new_session.process_oql,oql,request_name=job_name))
 
             for f in as_completed(futures):
-                accumulate_graph = accumulate_graph.compose(f.result())
+                accumulate_graph.compose_inplace(f.result())
             e.shutdown()
         return accumulate_graph
             
@@ -1344,6 +1437,10 @@ class APISession(PSNetworx):
         return 'content_of_'+ APISession.filename4(folder_name)+'_'
 
 
+    def __dump_ext(self):
+        return 'rnef'+COMPRESSION2EXT[self.rnef_compression]
+
+
     def __dumpfiles(self, in_folder:str,in2parent_folder='', root_folder='', with_extension='rnef'):
         folder_path = self.dump_path(in_folder,in2parent_folder,root_folder)
         base_name = self.__dump_base_name(in_folder)
@@ -1353,17 +1450,7 @@ class APISession(PSNetworx):
 
     @staticmethod
     def __dumpfile_has_closing_batch_tag(dump_file:str):
-        try:
-            with open(dump_file, 'rb') as f:  # Open in binary mode to avoid potential line ending issues
-                f.seek(-2, 2)  # Seek to the second-to-last byte (to handle newline variations)
-                while f.read(1) != b'\n':  # Move backward until a newline is found
-                  if f.tell() < 2:
-                      break
-                  f.seek(-2, 1) # f.seek(-1, 1) does not work
-                last_line = f.readline().decode('utf-8').strip()  # Read and decode the last line
-                return last_line.endswith("</batch>")  # Check if "</batch>" is present
-        except FileNotFoundError:
-            return False # directory has no RNEF 
+        return has_closing_batch_tag(dump_file)
 
 
     def was_downloaded(self,folder_name:str,in_parent_folder='',root_folder=''):
@@ -1379,29 +1466,60 @@ class APISession(PSNetworx):
         new - forces to return name for new dumpfile
         filecount - if not zero forces to create dump file with index = filecount+1
         '''
-        folder_path,of_folder_base_name,file_index = self.__dumpfiles(of_folder,in2parent_folder,root_folder,'rnef')
+        ext = self.__dump_ext()
+        folder_path,of_folder_base_name,file_index = self.__dumpfiles(of_folder,in2parent_folder,root_folder,ext)
         if start_index:
             file_index = start_index
         if new:
             file_index += 1
         else:
-            last_dumpfile = os.path.join(folder_path,of_folder_base_name+str(file_index)+'.rnef')
+            last_dumpfile = os.path.join(folder_path,of_folder_base_name+str(file_index)+'.'+ext)
             if APISession.__dumpfile_has_closing_batch_tag(last_dumpfile):
                 file_index += 1
 
-        return os.path.join(folder_path,of_folder_base_name+str(file_index)+'.rnef')
+        return os.path.join(folder_path,of_folder_base_name+str(file_index)+'.'+ext)
 
 
+    def __rnef_writer(self,to_folder='',in2parent_folder='',root_folder='',new=False)->RNEFwriter:
+        '''
+        output:
+          open RNEFwriter for the last dump file of "to_folder". 
+          if new=True or dump file exceeds self.max_rnef_size closes <batch> in the last dump file and opens new one
+        '''
+        key = (self.dump_path(to_folder,in2parent_folder,root_folder),self.__dump_base_name(to_folder))
+        with self.rnef_writers_lock:
+          writer = self.rnef_writers.get(key)
+          if writer is None:
+            write2 = self.__make_dumpfile_path(to_folder,in2parent_folder,root_folder)
+            if not os.path.exists(write2):
+              write2 = self.__make_dumpfile_path(to_folder,in2parent_folder,root_folder,new=True)
+            writer = RNEFwriter(write2,append=True)
+          if new:
+            writer.close()
+            write2 = self.__make_dumpfile_path(to_folder,in2parent_folder,root_folder,new=True)
+            writer = RNEFwriter(write2)
+          self.rnef_writers[key] = writer
+          return writer
+    
+
     def close_rnef_dump(self,for_folder='',in_parent_folder='',root_folder='',check_last_tag=False):
+        '''
+        closes <batch> element in the last dump file of "for_folder" and waits until all data is written to disk
+        '''
         parent_folder = '' if for_folder == in_parent_folder else in_parent_folder
+        key = (self.dump_path(for_folder,parent_folder,root_folder),self.__dump_base_name(for_folder))
+        with self.rnef_writers_lock:
+          writer = self.rnef_writers.pop(key,None)
+        if writer is not None:
+          writer.close()
+          return
+
         last_dump_file = self.__make_dumpfile_path(for_folder,parent_folder,root_folder)
         if os.path.exists(last_dump_file):
             if check_last_tag:
                 if APISession.__dumpfile_has_closing_batch_tag(last_dump_file):
                     return
-            f = open(last_dump_file,'a',encoding='utf-8')
-            f.write('</batch>')
-            f.close()
+            RNEFwriter(last_dump_file,append=True).close()
 
 
     def _2rnefs(self,graph=ResnetGraph(),add_rel_props:dict={},add_pathway_props:dict={}):
@@ -1416,59 +1534,33 @@ class APISession(PSNetworx):
         return my_graph.to_rnefstr(self.entProps,rel_props,add_rel_props,add_pathway_props)
     
 
-    def rnefs2dump(self,rnef_xml:str,to_folder='',in2parent_folder='',root_folder='',
+    def rnefs2dump(self,rnef_xml:str|et._Element,to_folder='',in2parent_folder='',root_folder='',
       can_close=True,lock=None):
       '''
       # set can_close=False to continue dumping into last dump file
       Dumps
       -----
-      "rnef_xml" string into 'to_folder' inside 'in2parent_folder' located in "self.data_dir"
+      "rnef_xml" string or <resnet> element into 'to_folder' inside 'in2parent_folder' located in "self.data_dir"
       if size of dump file exceeds "max_rnef_size", "rnef_xml" is splitted into several RNEF files\n
-      dump RNEF files are named as: 'content of to_folder#', where # - dump file number
+      dump RNEF files are named as: 'content of to_folder#', where # - dump file number\n
+      data is written to disk by RNEFwriter thread. Use self.close_rnef_dump() to complete dump file
       '''
       if lock is None: lock = threading.Lock()
 
       with lock:
-        write2 = self.__make_dumpfile_path(to_folder,in2parent_folder,root_folder)
-        if Path(write2).exists():
-          file_size = os.path.getsize(write2)
-          if file_size < self.max_rnef_size:
-            with open(write2,'a',encoding='utf-8') as f:
-              f.write(rnef_xml)
-              f.flush()
-              if os.path.getsize(write2) > self.max_rnef_size and can_close:
-                # need to create new dump file ASAP for next thread to write into it
-                new_write2 = self.__make_dumpfile_path(to_folder,in2parent_folder,root_folder,new=True)
-                with open(new_write2,'w',encoding='utf-8') as new_f:
-                  new_f.write('<batch>\n')
-                  new_f.flush()
-                f.write('</batch>')
-              f.flush()
-          else:
-              # file_size >= self.max_rnef_size
-              if can_close:
-                  # need to create new dump file ASAP for next thread to write into it
-                  new_write2 = self.__make_dumpfile_path(to_folder,in2parent_folder,root_folder,new=True)
-                  with open(new_write2,'w',encoding='utf-8') as new_f:
-                      new_f.write('<batch>\n')
-                      new_f.write(rnef_xml)
-                      new_f.flush()
-
-                  with open(write2,'a',encoding='utf-8') as f:
-                      f.write('</batch>')
-                      f.flush()
-              else:
-                  with open(write2,'a',encoding='utf-8') as f:
-                      f.write(rnef_xml)
-                      f.flush()                    
+        writer = self.__rnef_writer(to_folder,in2parent_folder,root_folder)
+        if writer.size >= self.max_rnef_size and can_close:
+          writer = self.__rnef_writer(to_folder,in2parent_folder,root_folder,new=True)
+
+        if isinstance(rnef_xml,et._Element):
+          writer.write_resnet(rnef_xml)
         else:
-            write2 = self.__make_dumpfile_path(to_folder,in2parent_folder,root_folder,new=True)
-            with open(write2,'w',encoding='utf-8') as new_f:
-                new_f.write('<batch>\n')
-                new_f.write(rnef_xml)
-                new_f.flush()
+          writer.write(rnef_xml)
 
-        return write2
+        if writer.size > self.max_rnef_size and can_close:
+          # need to create new dump file ASAP for next thread to write into it
+          self.__rnef_writer(to_folder,in2parent_folder,root_folder,new=True)
+        return writer.path
 
 
     def _dump2rnef(self,graph=ResnetGraph(),to_folder='',in_parent_folder='',root_folder='',can_close=True,lock=None):
@@ -1483,7 +1575,7 @@ class APISession(PSNetworx):
 
         Dumps
         -----
-        large graph objects into several RNEF XML files
+        large graph objects into several RNEF XML files. <resnet> sections are streamed into RNEFwriter without making XML strings
         
         Return
         -------
@@ -1495,9 +1587,8 @@ class APISession(PSNetworx):
         
         if my_graph:
           if my_graph.number_of_edges() == 0:
-            rnef_str = my_graph.to_rnefstr(ent_props=self.entProps,rel_props=self.relProps)
-            rnef_str = pretty_xml(rnef_str,remove_declaration=True)
-            self.rnefs2dump(rnef_str,to_folder,in_parent_folder,root_folder,can_close,lock)
+            resnet = my_graph.to_resnet(ent_props=self.entProps,rel_props=self.relProps)
+            self.rnefs2dump(resnet,to_folder,in_parent_folder,root_folder,can_close,lock)
             self.close_rnef_dump(to_folder,in_parent_folder,root_folder,True)
           else:
             my_graph = my_graph.remove_undirected_duplicates()
@@ -1506,18 +1597,16 @@ class APISession(PSNetworx):
               section_rels.add(e)
               if len(section_rels) == self.resnet_size:
                 resnet_section = my_graph.subgraph_by_rels(list(section_rels))
-                rnef_str = resnet_section.to_rnefstr(ent_props=self.entProps,rel_props=self.relProps)
-                rnef_str = pretty_xml(rnef_str,remove_declaration=True)
+                resnet = resnet_section.to_resnet(ent_props=self.entProps,rel_props=self.relProps)
                 # dumps section
-                self.rnefs2dump(rnef_str,to_folder,in_parent_folder,root_folder,can_close,lock)
+                self.rnefs2dump(resnet,to_folder,in_parent_folder,root_folder,can_close,lock)
                 resnet_section.clear_resnetgraph()
                 section_rels.clear()
         
             # dumps leftover resnet_section with size < self.resnet_size
             resnet_section = my_graph.subgraph_by_rels(list(section_rels))
-            rnef_str = resnet_section.to_rnefstr(ent_props=self.entProps,rel_props=self.relProps)
-            rnef_str = pretty_xml(rnef_str,remove_declaration=True)
-            self.rnefs2dump(rnef_str,to_folder,in_parent_folder,root_folder,can_close,lock)
+            resnet = resnet_section.to_resnet(ent_props=self.entProps,rel_props=self.relProps)
+            self.rnefs2dump(resnet,to_folder,in_parent_folder,root_folder,can_close,lock)
             self.close_rnef_dump(to_folder,in_parent_folder,root_folder,True)
 
             print('RNEF dump of "%s" graph into %s folder was done in %s' % 
@@ -1936,11 +2025,16 @@ class APISession(PSNetworx):
 
 
 ##################### EXPERIMENT EXPERIMENT EXPERIMENT EXPERIMENT ###########################
-    def map_experiment(self, exp:Experiment):
+    def map_experiment(self, exp:Experiment,index:MappingIndex|None=None):
+        '''
+        index - optional MappingIndex with database entities to use instead of database queries
+        '''
         identifier_name = exp.identifier_name()
         identifier_names = identifier_name.split(',')
         identifiers = exp.list_identifiers()
         map2objtypes = exp['ObjTypeName']
+        if index is not None:
+            return exp.map(index.values2objs(identifiers,identifier_names,map2objtypes))
         identifier2objs, objid2prop = self.map_props2objs(identifiers,identifier_names,map2objtypes)
         return exp.map(identifier2objs)
     
@@ -1960,18 +2054,25 @@ class APISession(PSNetworx):
         return graph_with_ci
     
 
-    def map_graph(self,graph:ResnetGraph, map_by=['Name'])->tuple[ResnetGraph,set[PSObject]]:
+    def map_graph(self,graph:ResnetGraph, map_by=['Name'],index:MappingIndex|None=None)->tuple[ResnetGraph,set[PSObject]]:
         '''
         Input
         -----
         graph - ResnetGraph where nodes may have arbitrary URNs
         map_by - list of database properties for mapping. Nodes in "graph" must have same properties  
+        index - optional MappingIndex with database entities to use instead of database queries
 
         Return
         ------
         ResnetGraph with nodes with database URNs
         '''
         print(f'Mapping input graph with {len(graph)} entities using {map_by} identifiers')
+        if index is not None:
+            graph_psobjs = graph.psobjs_with(map_by)
+            obj_props = {str(v) for v in graph.node_props(map_by,graph_psobjs)}
+            props2objs = {v.lower():objs for v,objs in index.values2objs(list(obj_props),map_by).items()}
+            return graph.remap_graph(props2objs,map_by)
+
         kwargs = {TO_RETRIEVE:NO_REL_PROPERTIES}
         my_session = self._clone_session(**kwargs)
         my_session.add_ent_props(map_by)
@@ -1,14 +1,17 @@
 import os,glob,zipfile,json,time
 from pathlib import Path
 from shutil import copyfile
-from .ResnetAPISession import REFERENCE_IDENTIFIERS,REFCOUNT
+from .ResnetAPISession import REFERENCE_IDENTIFIERS,REFCOUNT,DATABASE_REFCOUNT_ONLY,TO_RETRIEVE
 from .ResnetAPISession import APISession, execution_time
 from ...utils.utils import execution_time,Tee
 from .ResnetGraph import EFFECT,ResnetGraph
-from .NetworkxObjects import PSObject,PSObjectDecoder,PSObjectEncoder
+from .NetworkxObjects import PSObject,PSRelation,PSObjectDecoder,PSObjectEncoder
+from .mapping_index import MappingIndex
+from . import snapshot
 
 CACHE_DIR = os.path.join(os.getcwd(),'ElsevierAPI/.cache/__resnetcache__/')
 DEFAULT_CACHE_NAME = 'Resnet subset'
+MANIFEST_EXT = '_manifest.json' # {oql_query:{relation URN:[relation dbid,RelationNumberOfReferences]}} saved by APIcache.update_cache
 
 class APIcache(APISession):
   '''
@@ -52,7 +55,10 @@ class APIcache(APISession):
           'predict_effect4' : [], # [_4enttypes:list,_4reltypes:list] - parameters for ResnetGraph.predict_effect4()
           'no_id_version': True,
           'max_threads' : 25, # controls download speed.  Make it 10 if what2retrieve=ALL_PROPERTIES
-          'read_raw' : False
+          'read_raw' : False,
+          'compact' : False, # if True loaded graph uses compact storage. Use for large caches to save RAM
+          'use_snapshot' : True, # if True cache is loaded from binary snapshot saved next to cache RNEF file
+          'incremental' : False # if True existing cache is updated by update_cache() after loading
       }
 
       ent_props = list(kwargs.pop('ent_props',[]))
@@ -76,8 +82,12 @@ class APIcache(APISession):
       
       # loads cache_name from self.data_dir:
       load_cache = my_kwargs.pop('load_cache',True)
+      self.cache_kwargs = dict(my_kwargs)
       if load_cache:
+        cache_existed = os.path.exists(self.__path2cache(**my_kwargs))
         self.network = self._load_cache(**my_kwargs)
+        if cache_existed and my_kwargs.get('incremental',False):
+          self.update_cache()
         if self.network:
           self.save_description()
 
@@ -88,6 +98,36 @@ class APIcache(APISession):
       return os.path.join(self.__data_dir(**kwargs),'simple',cache_name+extension)
   
 
+  def __path2snapshot(self,**kwargs)->str:
+      return self.__path2cache(**dict(kwargs,extension=snapshot.SNAPSHOT_EXT))
+
+
+  def __path2manifest(self,**kwargs)->str:
+      return self.__path2cache(**dict(kwargs,extension=MANIFEST_EXT))
+
+
+  @staticmethod
+  def __snapshot_params(path2cache:str)->dict:
+      '''
+      output:
+        parameters of cache RNEF file used to validate snapshot.
+      raises FileNotFoundError if path2cache does not exist
+      '''
+      rnef_stat = os.stat(path2cache)
+      return {'rnef_mtime':rnef_stat.st_mtime_ns,'rnef_size':rnef_stat.st_size}
+
+
+  @staticmethod
+  def __dump2snapshot(graph:ResnetGraph,path2snapshot:str,ent_props:list=[],rel_props:list=[],params:dict=dict()):
+      '''
+      graphs with property values not supported by snapshot are not saved. Such cache is loaded from RNEF
+      '''
+      try:
+        graph.dump2snapshot(path2snapshot,ent_props,rel_props,params)
+      except TypeError as e:
+        print(f'Snapshot {path2snapshot} was not saved: {e}. Cache will be loaded from RNEF')
+
+
   def __data_dir(self,**kwargs):
     return kwargs.get('data_dir',CACHE_DIR)
   
@@ -120,8 +160,11 @@ class APIcache(APISession):
       # Used for dumping graph with pX annotations in relprops2rnef instead of refprops
       for refprop, relprop in refprop2rel.items():
         simple_graph.refprop2rel(refprop,relprop,refprop_minmax)
-        self.relprops2rnef.remove(refprop)
-        self.relprops2rnef.append(relprop)
+        # simplify_graph is called again by update_cache after refprop was already replaced
+        if refprop in self.relprops2rnef:
+          self.relprops2rnef.remove(refprop)
+        if relprop not in self.relprops2rnef:
+          self.relprops2rnef.append(relprop)
           
       if predict_effect4:
         simple_graph,modified_rels = simple_graph.predict_effect4(**predict_effect4)
@@ -256,9 +299,20 @@ class APIcache(APISession):
       else:
         my_cache_file = self.__path2cache(**kwargs)
         try:
-          cached_graph = ResnetGraph.fromRNEF(my_cache_file,prop2values=prop2values)
+          # snapshot is made from entire cache and cannot be used with prop2values filter
+          use_snapshot = kwargs.get('use_snapshot',True) and not prop2values
+          my_snapshot = self.__path2snapshot(**kwargs)
+          if use_snapshot and snapshot.is_valid(my_snapshot,self.__snapshot_params(my_cache_file)):
+            cached_graph = ResnetGraph.fromSnapshot(my_snapshot)
+            cached_graph.name = cache_name
+          else:
+            cached_graph = ResnetGraph.fromRNEF(my_cache_file,prop2values=prop2values)
+            cached_graph.name = cache_name
+            if use_snapshot:
+              self.__dump2snapshot(cached_graph,my_snapshot,params=self.__snapshot_params(my_cache_file))
           print(f'Loaded "{cache_name}" cache with {len(cached_graph)} nodes and {cached_graph.number_of_edges()} edges')
-          cached_graph.name = cache_name
+          if kwargs.get('compact',False):
+            cached_graph.compact()
           return cached_graph
         except FileNotFoundError:
           print(f'Cannot find {my_cache_file} cache file')
@@ -277,6 +331,8 @@ class APIcache(APISession):
             database_graph = self.simplify_graph(database_graph,**kwargs)
             database_graph_nodup = database_graph.remove_undirected_duplicates()
             database_graph_nodup.dump2rnef(my_cache_file,self.entProps,self.relprops2rnef) #with_section_size=1000
+            self.__dump2snapshot(database_graph_nodup,self.__path2snapshot(**kwargs),self.entProps,self.relprops2rnef,
+                                 self.__snapshot_params(my_cache_file))
             
             print('%s with %d edges and %d nodes was written into %s' 
         % (database_graph.name,database_graph.number_of_edges(),database_graph.number_of_nodes(),my_cache_file))
@@ -285,6 +341,166 @@ class APIcache(APISession):
           return database_graph
 
 
+  def __list_relations(self)->dict[str,dict[str,list[int]]]:
+    '''
+    output:
+      {oql_query:{relation URN:[relation dbid,RelationNumberOfReferences]}} for every query in self.my_oql_queries.
+    Only relation URNs and reference counts are retrieved from database
+    '''
+    listing_session = self._clone_session(**{TO_RETRIEVE:DATABASE_REFCOUNT_ONLY,'connect2server':True,'no_mess':self.no_mess})
+    listing_session.oql_cache = None # listing must reflect current database content
+    query2rels = dict()
+    for query in self.my_oql_queries:
+      oql, reqname = query[0], query[1]
+      listing = listing_session.process_oql(oql,f'Listing relations for {reqname}')
+      if isinstance(listing,ResnetGraph):
+        query2rels[oql] = {rel.urn():[rel.dbid(),rel.count_refs()] for _,_,rel in listing.edges.data('relation')}
+      else:
+        query2rels[oql] = dict()
+    return query2rels
+
+
+  def update_cache(self,**kwargs)->ResnetGraph:
+    '''
+    incremental alternative to cache rebuild for caches made by oql_queries:
+      1. lists relation URNs and reference counts for every query in oql_queries
+      2. compares them with manifest saved by previous update. 
+      Without manifest relations from raw cache are considered up to date
+      3. downloads only new relations and relations with changed RelationNumberOfReferences
+      4. patches raw cache, re-simplifies only node pairs connected by new, changed and deleted relations
+      and replaces their edges in simplified cache RNEF and snapshot (see _patch_network).
+      New cache files replace old ones only after they are completely written
+    output:
+      updated self.network
+    '''
+    my_kwargs = dict(self.cache_kwargs)
+    my_kwargs.update(kwargs)
+    cache_name = my_kwargs.get('cache_name',DEFAULT_CACHE_NAME)
+    if my_kwargs.get('connect_nodes',False) or not self.my_oql_queries:
+      print(f'Incremental update is supported only for caches made by oql_queries. "{cache_name}" was not updated')
+      return self.network
+
+    start = time.time()
+    raw_dir = self.__path2rawdir(**my_kwargs)
+    raw_graph = ResnetGraph.fromRNEFdir(raw_dir,merge=False)
+    if not raw_graph:
+      print(f'Raw cache for "{cache_name}" was not found in {raw_dir}. "{cache_name}" was not updated')
+      return self.network
+    urn2rawrel = {urn:rel for _,_,urn,rel in raw_graph.edges(keys=True,data='relation')}
+
+    query2rels = self.__list_relations()
+    current, old = dict(), dict()
+    [current.update(rels) for rels in query2rels.values()]
+    path2manifest = self.__path2manifest(**my_kwargs)
+    try:
+      with open(path2manifest,'r') as f:
+        [old.update(rels) for rels in json.load(f).values()]
+    except FileNotFoundError:
+      print(f'Manifest {path2manifest} was not found. Relations in raw cache are considered up to date')
+      old = {urn:current.get(urn,[0,0]) for urn in urn2rawrel}
+    new_urns = set(current).difference(old)
+    deleted_urns = set(old).difference(current)
+    changed_urns = {urn for urn in set(current).intersection(old) if current[urn][1] != old[urn][1]}
+    print(f'"{cache_name}" has {len(new_urns)} new, {len(changed_urns)} changed and {len(deleted_urns)} deleted relations')
+
+    if new_urns or changed_urns or deleted_urns:
+      dbids = {current[urn][0] for urn in new_urns|changed_urns}
+      if dbids:
+        fetch_session = self._clone_session(connect2server=True,no_mess=self.no_mess)
+        fetch_session.oql_cache = None
+        update_graph = fetch_session.iterate_oql('SELECT Relation WHERE id = ({ids})',dbids,use_cache=False,
+                                                 request_name=f'Downloading new and changed relations for {cache_name}')
+      else:
+        update_graph = ResnetGraph()
+
+      stale_rels = [urn2rawrel[urn] for urn in deleted_urns|changed_urns if urn in urn2rawrel]
+      pairs = self._patch_network(raw_graph,stale_rels,update_graph,**my_kwargs)
+
+      # rewriting raw and simplified cache files from patched graphs.
+      # Files are dumped under temporary names and swapped in by os.replace after dump is complete
+      raw_file = os.path.join(raw_dir,cache_name+'_raw.rnef')
+      tmp_raw_file = self.__tmp_path(raw_file)
+      raw_graph.dump2rnef(tmp_raw_file,self.entProps,[],with_section_size=self.resnet_size)
+      os.replace(tmp_raw_file,raw_file)
+      [os.remove(f) for f in glob.glob(os.path.join(raw_dir,'*.rnef*')) if os.path.abspath(f) != os.path.abspath(raw_file)]
+
+      my_cache_file = self.__path2cache(**my_kwargs)
+      tmp_cache_file = self.__tmp_path(my_cache_file)
+      network_nodup = self.network.remove_undirected_duplicates()
+      network_nodup.dump2rnef(tmp_cache_file,self.entProps,self.relprops2rnef)
+      os.replace(tmp_cache_file,my_cache_file) # snapshot of previous cache file becomes invalid
+      self.__dump2snapshot(network_nodup,self.__path2snapshot(**my_kwargs),self.entProps,self.relprops2rnef,
+                           self.__snapshot_params(my_cache_file))
+      print(f'{len(pairs)} node pairs in "{cache_name}" were updated in {execution_time(start)}')
+    else:
+      print(f'"{cache_name}" is up to date')
+
+    with open(path2manifest,'w') as f:
+      json.dump(query2rels,f)
+    return self.network
+
+
+  def _patch_network(self,raw_graph:ResnetGraph,stale_rels:list[PSRelation],update_graph:ResnetGraph,**kwargs)->set[tuple[int,int]]:
+    '''
+    input:
+      raw_graph - raw cache graph. stale_rels are removed from it and update_graph is added to it
+      kwargs - simplify_graph() parameters used to make self.network
+    output:
+      node pairs connected by stale_rels and relations from update_graph
+    Updates:
+      self.network with simplified relations between affected node pairs.\n
+      simplify_graph merges relations between the same node pairs. refprop2rel and remove_version change
+      every relation and node independently. Re-simplifying only affected node pairs therefore makes
+      the same self.network as simplify_graph of entire raw_graph.\n
+      predict_effect4 uses all targets of a regulator. Patched network with predict_effect4 would differ from full rebuild,
+      therefore entire raw_graph is simplified again if predict_effect4 is specified
+    '''
+    cache_name = kwargs.get('cache_name',DEFAULT_CACHE_NAME)
+    pairs = {tuple(sorted(pair)) for rel in stale_rels+list(update_graph._psrels()) for pair in rel.get_regulators_targets()}
+    [raw_graph.remove_relation(rel) for rel in stale_rels]
+    raw_graph.compose_inplace(update_graph)
+
+    # simplify_graph merges references and sets Effect in relation objects.
+    # It gets relation copies to keep raw_graph relations as they are in database
+    if kwargs.get('predict_effect4',dict()):
+      full_graph = ResnetGraph.from_rels([rel.copy() for rel in raw_graph._psrels()])
+      full_graph.name = cache_name
+      self.network = self.simplify_graph(full_graph,**dict(kwargs))
+      self.network.name = cache_name
+      return pairs
+
+    # re-simplifying only node pairs connected by changed relations.
+    # Relations with more than two nodes add their other node pairs
+    while True:
+      affected_rels = {rel for u,v in pairs for rel in raw_graph._psrels4(u,v)+raw_graph._psrels4(v,u)}
+      affected_pairs = {tuple(sorted(pair)) for rel in affected_rels for pair in rel.get_regulators_targets()}
+      if affected_pairs.issubset(pairs): break
+      pairs.update(affected_pairs)
+    affected_graph = ResnetGraph.from_rels([rel.copy() for rel in affected_rels])
+    affected_graph.name = cache_name
+    simple_patch = self.simplify_graph(affected_graph,**dict(kwargs))
+
+    for u,v in pairs:
+      for r,t in [(u,v),(v,u)]:
+        if self.network.has_edge(r,t):
+          for urn in list(self.network[r][t]):
+            self.network.remove_edge(r,t,urn)
+            self.network.urn2rel.pop(urn,'')
+    self.network.compose_inplace(simple_patch)
+    self.network.name = cache_name
+    return pairs
+
+
+  @staticmethod
+  def __tmp_path(path:str)->str:
+    '''
+    output:
+      path to hidden file in the same directory as "path".
+      Hidden files are not found by glob patterns used to read cache files
+    '''
+    return os.path.join(os.path.dirname(path),'.'+os.path.basename(path))
+
+
   def add2raw(self,graph:ResnetGraph):
       self._dump2rnef(graph,self.network.name+'_raw','raw')
 
@@ -308,6 +524,8 @@ class APIcache(APISession):
       with_network.dump2rnef(path2cache,ent_props,rel_props)
       # keep with_section_size low to save on memory
       print(f'{cache_name} cache file was replaced')
+      path2snapshot = self.__path2snapshot(cache_name=cache_name)
+      self.__dump2snapshot(with_network,path2snapshot,ent_props,rel_props,self.__snapshot_params(path2cache))
 
       if self.example_node:
           example_cache = with_network.neighborhood({self.example_node})
@@ -401,3 +619,38 @@ class APIcache(APISession):
       json.dump(nodes,open(dump_path,'w'),indent=2,cls=PSObjectEncoder)
       print(f'Map was downloaded in {execution_time(start)}')
       return ResnetGraph._make_map(using_props,nodes,norm)
+
+
+  @staticmethod
+  def get_index(_4nodetypes:list,using_props:list,dump2file='mapfile',norm=True)->MappingIndex:
+    '''
+    output:
+      MappingIndex with same lookups as mapdic from APIcache.get_map()
+    reads index from CACHE_DIR/dump2file.mapindex or makes it from nodes in CACHE_DIR/dump2file.json or from database.
+    Index is made once and reused by other runs and processes
+    '''
+    index_path = os.path.join(CACHE_DIR,dump2file)
+    if index_path[-5:] == '.json': index_path = index_path[:-5]
+    try:
+      index = MappingIndex.load(index_path)
+      if index.using_props == list(using_props) and index.norm == norm:
+        return index
+      print(f'Mapping index in {index_path} was made for different properties and will be remade')
+    except (FileNotFoundError,ValueError) as e:
+      print(f'Cannot load mapping index: {e}')
+
+    start = time.time()
+    dump_path = index_path+'.json'
+    try:
+      print(f'Loading nodes for mapping index from {dump_path}')
+      nodes = [PSObject(n) for n in json.load(open(dump_path,'r'),cls=PSObjectDecoder)]
+    except FileNotFoundError:
+      session = APISession()
+      session.entProps = using_props
+      oql = f'SELECT Entity WHERE objectType = ({_4nodetypes})'
+      nodes = session.process_oql(oql,f'Loading {_4nodetypes}')._get_nodes()
+      json.dump(nodes,open(dump_path,'w'),indent=2,cls=PSObjectEncoder)
+    index = MappingIndex(using_props,nodes,norm)
+    print(f'Mapping index for {len(index)} entities was made in {execution_time(start)}')
+    index.save(index_path)
+    return index
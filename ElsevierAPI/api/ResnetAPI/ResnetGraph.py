@@ -2,7 +2,7 @@ import networkx as nx
 from networkx.exception import NetworkXError
 from ...utils.pandas.panda_tricks import df,np,pd
 from datetime import timedelta
-import os, math, time, torch,glob,csv
+import os, io, math, time, torch,glob,csv
 from typing import Generator
 from xml.dom import minidom
 from lxml import etree as et
@@ -10,14 +10,18 @@ from itertools import product,chain
 from typing import Optional
 from torch_geometric.data import HeteroData
 from collections import defaultdict,deque
-from concurrent.futures import ThreadPoolExecutor,as_completed
-from .NetworkxObjects import PSObject,PSRelation,len, DIRECT, INDIRECT, DBID,EFFECT
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from .NetworkxObjects import PSObject,PSRelation,len, DIRECT, INDIRECT, DBID,EFFECT,compact_props
 from .NetworkxObjects import REGULATORS,TARGETS,CHILDS,REFCOUNT,STATE,DIRECT_RELTYPES,OBJECT_TYPE
 from .references import Reference, pubmed_hyperlink, make_hyperlink
 from .references import PUBYEAR,TITLE,REFERENCE_PROPS,JOURNAL,INT_PROPS,PS_CITATION_INDEX,SENTENCE_PROPS,SENTENCE,AUTHORS
 from .RefStats import RefStats,IDENTIFIER_COLUMN
 from ...utils.utils import execution_time, execution_time2,list2str,unpack,normalize
 from ..EmbioPSG_API.postgres import PostgreSQL
+from . import snapshot
+from .rnef_writer import open_rnef,compression4,RNEF_EXTENSIONS
+from .mapping_index import MappingIndex
 
 
 RESNET = 'resnet'
@@ -34,6 +38,14 @@ SENTENCE_PROPS_SET = set(SENTENCE_PROPS+['TextRef'])
 
 RNEF_DISCLAIMER = str('Disclaimer: please refer to our Terms and Conditions on authorized use of Elsevier data. https://www.elsevier.com/legal/elsevier-website-terms-and-conditions?dgcid=RN_AGCM_Sourced_300005028')
 MAX_RNEF_THREADS = 4
+MAX_RNEF_PROCESSES = os.cpu_count() or 1
+RNEF_RANGE_SIZE = 100000000 # bytes of RNEF file parsed by one worker process
+# RNEF files are parsed in worker processes only if their total size in bytes is larger.
+# Unpickling parsing results in parent process takes about 2/3 of parsing time, therefore worker processes are faster
+# only when several byte ranges are parsed at the same time
+RNEF_PROCESSES_MIN_SIZE = 3*RNEF_RANGE_SIZE
+CSR_RANKING_MIN_SOURCES = 50 # regulator ranking switches from BFS to batched BFS on sparse adjacency matrix
+BFS_BATCH_CELLS = 2**26 # max size of boolean (sources x nodes) matrix of visited nodes in batched BFS
 
 
 CLINVAR_PMIDS = [['10447503'],['10592272'],['10612825'],['11125122'],['26619011'],
@@ -41,15 +53,91 @@ CLINVAR_PMIDS = [['10447503'],['10592272'],['10612825'],['11125122'],['26619011'
                       ['26467025'],['24728327']]
 
 
+class RelationIndex:
+  '''
+  secondary index of ResnetGraph edges for relation queries by relation type and effect:\n
+  {(ObjTypeName,Effect):{regulator_uid:{target_uid:{rel_urn}}}}\n
+  version - PSRelation.type_effect_version at index creation. 
+  Index is stale after ObjTypeName or Effect of any relation was changed
+  '''
+  def __init__(self):
+    self.type_effect2adj = dict()
+    self.version = PSRelation.type_effect_version
+
+
+  def is_stale(self)->bool:
+    return self.version != PSRelation.type_effect_version
+
+
+  @staticmethod
+  def key(rel:PSRelation)->tuple[str,str]:
+    return rel.objtype(),rel.effect()
+
+
+  def add(self,regulator_uid:int,target_uid:int,rel:PSRelation,rel_urn:str):
+    adj = self.type_effect2adj.setdefault(self.key(rel),dict())
+    adj.setdefault(regulator_uid,dict()).setdefault(target_uid,set()).add(rel_urn)
+
+
+  def remove(self,regulator_uid:int,target_uid:int,rel:PSRelation,rel_urn:str):
+    try:
+      adj = self.type_effect2adj[self.key(rel)]
+      urns = adj[regulator_uid][target_uid]
+      urns.discard(rel_urn)
+      if not urns:
+        del adj[regulator_uid][target_uid]
+        if not adj[regulator_uid]:
+          del adj[regulator_uid]
+    except KeyError:
+      return
+
+
+  def adjacencies(self,rel_types:list=[],effects:list=[])->list[dict[int,dict[int,set[str]]]]:
+    '''
+    output:
+      adjacency dicts for all (ObjTypeName,Effect) matching rel_types and effects. Empty rel_types or effects match any value
+    '''
+    return [adj for (rel_type,effect),adj in self.type_effect2adj.items() 
+            if (not rel_types or rel_type in rel_types) and (not effects or effect in effects)]
+
+
+  def urns4(self,regulator_uid:int,target_uid:int,rel_types:list=[],effects:list=[])->set[str]:
+    urns = set()
+    for adj in self.adjacencies(rel_types,effects):
+      urns.update(adj.get(regulator_uid,dict()).get(target_uid,set()))
+    return urns
+
+
+  def connected(self,regulator_uids:set,target_uids:set,rel_types:list=[],effects:list=[])->bool:
+    for adj in self.adjacencies(rel_types,effects):
+      for regulator_uid in regulator_uids.intersection(adj):
+        if not target_uids.isdisjoint(adj[regulator_uid]):
+          return True
+    return False
+
+
+  def pairs(self,regulator_uids:set,target_uids:set,rel_types:list=[],effects:list=[]):
+    '''
+    output:
+      generator of (regulator_uid,target_uid,{rel_urn}) for indexed edges between regulator_uids and target_uids
+    '''
+    for adj in self.adjacencies(rel_types,effects):
+      for regulator_uid in regulator_uids.intersection(adj):
+        targets = adj[regulator_uid]
+        for target_uid in target_uids.intersection(targets):
+          yield regulator_uid,target_uid,targets[target_uid]
+
+
 class ResnetGraph (nx.MultiDiGraph):
   pass
 
   def __init__(self, *args, **kwargs):
+      self.relation_index = None # optional RelationIndex created by index_relations()
       super().__init__(*args, **kwargs)
       self.urn2rel = dict() #lookup for combining relations in database graph and to_rnef graph
 
   def copy(self)->'ResnetGraph':
-      cp = ResnetGraph(super().copy())
+      cp = super().copy() # networkx copy makes graph of self.__class__
       cp.urn2rel = dict(self.urn2rel)
       return cp
 
@@ -90,12 +178,72 @@ class ResnetGraph (nx.MultiDiGraph):
     uid_pairs = rel.get_regulators_targets(edge_duplication)
     if uid_pairs:
       rel_urn = rel.urn(refresh_urn)
+      if self.relation_index is not None:
+        for r,t in uid_pairs:
+          if self.has_edge(r,t,rel_urn): # edge is replaced by new relation
+            self.relation_index.remove(r,t,self[r][t][rel_urn]['relation'],rel_urn)
+          self.relation_index.add(r,t,rel,rel_urn)
       [self.add_edge(uids[0],uids[1],
                      relation=rel,weight=rel.count_refs(),key=rel_urn) 
                      for uids in uid_pairs]   
       self.urn2rel[rel_urn] = rel
 
 
+  def index_relations(self):
+      '''
+      creates self.relation_index used by relation_exist, find_relations, get_rels_between.\n
+      Index is maintained by add_rel, remove_relation, remove_edge, remove_node(s).\n
+      Other networkx methods that add or remove edges drop the index.\n
+      Index is also dropped when ObjTypeName or Effect of any relation is assigned (rel[EFFECT] = ..., PSRelation.set_effect, PSRelation.flip_effect).
+      Call index_relations() again after editing ObjTypeName or Effect value lists in place
+      '''
+      self.relation_index = RelationIndex()
+      for r,t,urn,rel in self.edges(keys=True,data='relation'):
+          self.relation_index.add(r,t,rel,urn)
+
+
+  def __index(self,rel_types:list|None,effects:list|None)->RelationIndex|None:
+      '''
+      output:
+        self.relation_index for queries filtered by rel_types or effects if index is still valid.\n
+        None for unfiltered queries answered faster from graph adjacency or if index is stale. Stale index is dropped
+      '''
+      if self.relation_index is not None and self.relation_index.is_stale():
+          self.relation_index = None
+      return self.relation_index if rel_types or effects else None
+
+
+  def remove_edge(self, u, v, key=None):
+      if self.relation_index is not None and self.has_edge(u,v,key):
+          my_key = next(reversed(self._succ[u][v])) if key is None else key # networkx removes last added edge if key is None
+          self.relation_index.remove(u,v,self._succ[u][v][my_key]['relation'],my_key)
+      super().remove_edge(u,v,key)
+
+
+  def remove_edges_from(self, ebunch):
+      self.relation_index = None
+      super().remove_edges_from(ebunch)
+
+
+  def add_edges_from(self, ebunch_to_add, **attr):
+      self.relation_index = None
+      return super().add_edges_from(ebunch_to_add, **attr)
+
+
+  def remove_node(self, n):
+      if self.relation_index is not None and n in self:
+          for r,t,urn,rel in list(self.in_edges(n,keys=True,data='relation'))+list(self.out_edges(n,keys=True,data='relation')):
+              self.relation_index.remove(r,t,rel,urn)
+      super().remove_node(n)
+
+
+  def remove_nodes_from(self, nodes):
+      if self.relation_index is None:
+          super().remove_nodes_from(nodes)
+      else:
+          [self.remove_node(n) for n in list(nodes) if n in self]
+
+
   def add_psobj(self,node:PSObject):
       node_uid = node.uid()
       if node_uid in self.nodes():
@@ -243,7 +391,22 @@ class ResnetGraph (nx.MultiDiGraph):
       return composed_graph
     else:
       return self.copy()
-  
+
+
+  def compose_inplace(self,other:"ResnetGraph")->"ResnetGraph":
+    '''
+    in-place version of ResnetGraph.compose() that does not copy self.\n
+    Use to accumulate many graphs from database: cost is proportional to the size of "other"
+    output:
+      self with nodes and edges from "other", other graph attributes take precedent
+    '''
+    if other:
+      self.graph.update(other.graph)
+      self.add_nodes_from(other.nodes(data=True))
+      self.add_edges_from(other.edges(keys=True,data=True))
+      self.urn2rel.update(other.urn2rel)
+    return self
+
 
   def clone_node(self,n:PSObject,replace_with:PSObject,flip_effect=0,set_reltype=''):
     '''
@@ -454,6 +617,195 @@ class ResnetGraph (nx.MultiDiGraph):
 
     return regulator_rank
 
+
+  def _adjacency(self,reverse=False)->tuple[list[int],sparse.csr_matrix]:
+    '''
+    output:
+      node uids, binary CSR adjacency matrix with rows and columns in the order of node uids.\n
+      matrix[i,j] = 1 if graph has edge uids[i]->uids[j], or uids[j]->uids[i] if reverse\n
+      parallel edges are collapsed like in self.adj and self.pred
+    '''
+    uids = list(self.nodes())
+    uid2idx = {uid:i for i,uid in enumerate(uids)}
+    neighbors = self._pred if reverse else self._succ # raw adjacency dicts are faster than AtlasView
+    degrees = np.fromiter((len(neighbors[uid]) for uid in uids),dtype=np.int64,count=len(uids))
+    indptr = np.concatenate(([0],np.cumsum(degrees)))
+    indices = np.fromiter((uid2idx[n] for uid in uids for n in neighbors[uid]),dtype=np.int64,count=int(indptr[-1]))
+    matrix = sparse.csr_matrix((np.ones(len(indices),dtype=np.float32),indices,indptr),shape=(len(uids),len(uids)))
+    return uids, matrix
+
+
+  @staticmethod
+  def _first_visits(adjacency:sparse.csr_matrix,sources:np.ndarray,max_distance:int):
+    '''
+    batched BFS from all "sources" by expanding sparse frontier matrix with rows for every source
+    output:
+      generator of (distance, source_positions, node_idxs) for nodes visited first time at "distance"\n
+      from sources[source_positions]. distance = 0 is yielded for sources
+    '''
+    node_count = adjacency.shape[0]
+    batch_size = max(1,min(len(sources),BFS_BATCH_CELLS//max(node_count,1)))
+    for start in range(0,len(sources),batch_size):
+      batch = sources[start:start+batch_size]
+      positions = np.arange(len(batch))
+      visited = np.zeros((len(batch),node_count),dtype=bool)
+      visited[positions,batch] = True
+      yield 0,start+positions,batch
+      frontier = sparse.csr_matrix((np.ones(len(batch),dtype=np.float32),(positions,batch)),shape=visited.shape)
+      for distance in range(1,max_distance+1):
+        rows,cols = (frontier @ adjacency).nonzero()
+        new = ~visited[rows,cols]
+        rows,cols = rows[new],cols[new]
+        if not len(rows): break
+        visited[rows,cols] = True
+        yield distance,start+rows,cols
+        frontier = sparse.csr_matrix((np.ones(len(rows),dtype=np.float32),(rows,cols)),shape=visited.shape)
+
+
+  @staticmethod
+  def _ordered_visits(adjacency:sparse.csr_matrix,sources:np.ndarray,max_distance:int):
+    '''
+    same as _first_visits but node_idxs for every source come in the order of BFS queue 
+    with neighbors taken in the order of "adjacency" indices like in manual BFS over self.pred or self.adj
+    '''
+    node_count = adjacency.shape[0]
+    indptr, indices = adjacency.indptr.astype(np.int64), adjacency.indices.astype(np.int64)
+    batch_size = max(1,min(len(sources),BFS_BATCH_CELLS//max(node_count,1)))
+    for start in range(0,len(sources),batch_size):
+      batch = sources[start:start+batch_size]
+      rows = np.arange(len(batch))
+      visited = np.zeros((len(batch),node_count),dtype=bool)
+      visited[rows,batch] = True
+      yield 0,start+rows,batch
+      cols = batch
+      for distance in range(1,max_distance+1):
+        degrees = indptr[cols+1]-indptr[cols]
+        edge_count = int(degrees.sum())
+        if not edge_count: break
+        # frontier is expanded in the order of BFS queue keeping the order of neighbors of every frontier node
+        edge_pos = np.repeat(indptr[cols]-(np.cumsum(degrees)-degrees),degrees)+np.arange(edge_count)
+        rows,cols = np.repeat(rows,degrees),indices[edge_pos]
+        new = ~visited[rows,cols]
+        rows,cols = rows[new],cols[new]
+        first = np.sort(np.unique(rows*node_count+cols,return_index=True)[1])
+        rows,cols = rows[first],cols[first]
+        if not len(rows): break
+        visited[rows,cols] = True
+        yield distance,start+rows,cols
+
+
+  def rank_regulators4(self,regulators:list[PSObject],target_weights:dict[int,float]|list[dict[int,float]],max_distance: int = 5) -> dict[int,float]:
+    """
+    ranks many regulators like rank_regulator.\n
+    Uses batched BFS on sparse adjacency matrix if number of regulators is above CSR_RANKING_MIN_SOURCES
+    input:
+      target_weights = {node_uid:weight} for all regulators or list of {node_uid:weight} for every regulator in "regulators"
+    output:
+      {regulator_uid:rank}
+    """
+    weights4regulators = target_weights if isinstance(target_weights,list) else [target_weights]*len(regulators)
+    if len(regulators) < CSR_RANKING_MIN_SOURCES:
+      return {r.uid():self.rank_regulator(r,w,max_distance) for r,w in zip(regulators,weights4regulators)}
+
+    uids, adjacency = self._adjacency()
+    uid2idx = {uid:i for i,uid in enumerate(uids)}
+    regulator_ranks = {r.uid():0.0 for r in regulators}
+    in_graph = [(r.uid(),w) for r,w in zip(regulators,weights4regulators) if r.uid() in uid2idx]
+    if not in_graph: return regulator_ranks
+
+    # target weights are looked up by key = regulator_position*node_count+target_idx
+    node_count = len(uids)
+    keys, values = list(), list()
+    for pos,(_,weights) in enumerate(in_graph):
+      for target_uid, weight in weights.items():
+        if target_uid in uid2idx:
+          keys.append(pos*node_count+uid2idx[target_uid])
+          values.append(weight)
+    keys, values = np.array(keys,dtype=np.int64), np.array(values,dtype=np.float64)
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+
+    ranks = np.zeros(len(in_graph))
+    if len(keys):
+      sources = np.array([uid2idx[uid] for uid,_ in in_graph],dtype=np.int64)
+      for distance,positions,node_idxs in self._first_visits(adjacency,sources,max_distance):
+        if not distance: continue
+        visit_keys = positions*node_count+node_idxs
+        found = np.minimum(np.searchsorted(keys,visit_keys),len(keys)-1)
+        is_target = keys[found] == visit_keys
+        ranks += np.bincount(positions[is_target],weights=values[found[is_target]],minlength=len(in_graph))/(distance*distance)
+
+    regulator_ranks.update({uid:float(rank) for (uid,_),rank in zip(in_graph,ranks)})
+    return regulator_ranks
+
+
+  def rank_regulators4pairs(self,regulators:list[PSObject],target_weights:dict[int,float],
+                            pair_weights:sparse.csr_matrix,pair_target_uids:list[int],max_distance: int = 5) -> dict[int,float]:
+    """
+    ranks many regulators like rank_regulators4 with individual target weights for every regulator
+    without making {node_uid:weight} dictionary for every regulator.
+    Ranks are identical to rank_regulator with {node_uid:weight} made for every regulator
+    input:
+      target_weights = {node_uid:weight} shared by all regulators
+      pair_weights - sparse matrix [regulators x pair_target_uids] with weights replacing "target_weights" for stored regulator-target pairs
+    output:
+      {regulator_uid:rank}
+    """
+    pair_weights = sparse.csr_matrix(pair_weights)
+    if len(regulators) < CSR_RANKING_MIN_SOURCES:
+      weights4regulators = list()
+      for row in range(len(regulators)):
+        weights = dict(target_weights)
+        start,end = pair_weights.indptr[row],pair_weights.indptr[row+1]
+        weights.update({pair_target_uids[col]:float(w) for col,w in zip(pair_weights.indices[start:end].tolist(),pair_weights.data[start:end])})
+        weights4regulators.append(weights)
+      return self.rank_regulators4(regulators,weights4regulators,max_distance)
+
+    uids, adjacency = self._adjacency()
+    uid2idx = {uid:i for i,uid in enumerate(uids)}
+    regulator_ranks = {r.uid():0.0 for r in regulators}
+    in_graph = np.array([i for i,r in enumerate(regulators) if r.uid() in uid2idx],dtype=np.int64)
+    if not len(in_graph): return regulator_ranks
+
+    node_count = len(uids)
+    node_weights = np.zeros(node_count)
+    is_weighted = np.zeros(node_count,dtype=bool)
+    for target_uid, weight in target_weights.items():
+      if target_uid in uid2idx:
+        node_weights[uid2idx[target_uid]] = weight
+        is_weighted[uid2idx[target_uid]] = True
+
+    # pair weights are looked up by key = regulator_position*node_count+target_idx
+    target_idxs = np.array([uid2idx.get(uid,-1) for uid in pair_target_uids],dtype=np.int64)
+    pairs = pair_weights[in_graph].tocoo()
+    pair_idxs = target_idxs[pairs.col] if len(target_idxs) else np.zeros(0,dtype=np.int64)
+    in_graph_pair = pair_idxs >= 0
+    keys = pairs.row[in_graph_pair].astype(np.int64)*node_count+pair_idxs[in_graph_pair]
+    values = pairs.data[in_graph_pair].astype(np.float64)
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    is_weighted[pair_idxs[in_graph_pair]] = True
+
+    ranks = np.zeros(len(in_graph))
+    if is_weighted.any():
+      sources = np.array([uid2idx[regulators[i].uid()] for i in in_graph],dtype=np.int64)
+      for distance,positions,node_idxs in self._ordered_visits(adjacency,sources,max_distance):
+        if not distance: continue
+        is_target = is_weighted[node_idxs]
+        positions,node_idxs = positions[is_target],node_idxs[is_target]
+        weights = node_weights[node_idxs]
+        if len(keys):
+          visit_keys = positions*node_count+node_idxs
+          found = np.minimum(np.searchsorted(keys,visit_keys),len(keys)-1)
+          is_pair = keys[found] == visit_keys
+          weights[is_pair] = values[found[is_pair]]
+        # np.add.at adds weight/distance^2 of every target one by one in BFS order 
+        # to sum floats in the same order as rank_regulator and get identical ranks
+        np.add.at(ranks,positions,weights/(distance*distance))
+
+    regulator_ranks.update({regulators[i].uid():float(rank) for i,rank in zip(in_graph.tolist(),ranks)})
+    return regulator_ranks
+
   '''
   def rank_regulatorOLD(self, regulator:PSObject, target_weights:dict, max_distance=5):
       """
@@ -482,8 +834,14 @@ class ResnetGraph (nx.MultiDiGraph):
 
   def rank_regulators(self, node_weights: dict[int, float], add2prop: str, max_distance: int = 5) -> dict:
     """
-    Optimized regulator ranking using manual BFS to avoid heavy NetworkX object creation.
+    Optimized regulator ranking using manual BFS to avoid heavy NetworkX object creation.\n
+    Uses batched BFS on sparse adjacency matrix if number of weighted nodes is above CSR_RANKING_MIN_SOURCES
     """
+    if len(node_weights) >= CSR_RANKING_MIN_SOURCES:
+      regulator_ranks = self.__rank_regulators_csr(node_weights,max_distance)
+      nx.set_node_attributes(self, regulator_ranks, add2prop)
+      return regulator_ranks
+
     regulator_ranks = defaultdict(float)
     upstream_edges = set()
 
@@ -529,6 +887,50 @@ class ResnetGraph (nx.MultiDiGraph):
     #print(sortdict(regulator_ranks, by_key=False, reverse=True, return_top=25))
     return dict(regulator_ranks)
 
+
+  def __rank_regulators_csr(self, node_weights: dict[int, float], max_distance: int = 5) -> dict[int,float]:
+    """
+    rank_regulators on sparse adjacency matrix: BFS from all weighted nodes runs as batched frontier expansion.\n
+    Network adjustment boosts regulators in the order they were ranked by manual BFS in rank_regulators
+    because boosted ranks of regulators are used to boost regulators ranked after them
+    """
+    uids, upstream = self._adjacency(reverse=True)
+    uid2idx = {uid:i for i,uid in enumerate(uids)}
+    sources = [(uid2idx[uid],w) for uid,w in node_weights.items() if uid in uid2idx]
+    if not sources: return dict()
+    source_idxs = np.array([i for i,_ in sources],dtype=np.int64)
+    source_weights = np.array([w for _,w in sources],dtype=np.float64)
+
+    ranks = np.zeros(len(uids))
+    is_ranked = np.zeros(len(uids),dtype=bool)
+    is_expanded = np.zeros(len(uids),dtype=bool) # nodes with all incoming edges in upstream_edges
+    # first_visit = (source position,distance,visiting order) of the first visit by manual BFS encoded into int64
+    first_visit = np.full(len(uids),np.iinfo(np.int64).max,dtype=np.int64)
+    for distance,positions,node_idxs in self._ordered_visits(upstream,source_idxs,max_distance):
+      if distance < max_distance:
+        is_expanded[node_idxs] = True
+      if distance:
+        is_ranked[node_idxs] = True
+        ranks += np.bincount(node_idxs,weights=source_weights[positions]/(distance*distance),minlength=len(uids))
+        visit = ((positions*(max_distance+1)+distance)*BFS_BATCH_CELLS)+np.arange(len(node_idxs))
+        np.minimum.at(first_visit,node_idxs,visit)
+
+    # network adjustment: regulator gets half of current ranks of its targets not expanded by BFS
+    is_counted = is_ranked & ~is_expanded
+    has_counted_targets = (upstream.T.tocsr() @ is_counted.astype(np.float32)) > 0
+    to_boost = np.flatnonzero(is_ranked & has_counted_targets)
+    to_boost = to_boost[np.argsort(first_visit[to_boost],kind='stable')]
+    rank_list, is_counted = ranks.tolist(), is_counted.tolist()
+    for i in to_boost.tolist():
+      neighborhood_weight = 0.0
+      for target_uid in self._succ[uids[i]]:
+        target_idx = uid2idx[target_uid]
+        if is_counted[target_idx]:
+          neighborhood_weight += rank_list[target_idx]
+      if neighborhood_weight > 0:
+        rank_list[i] += 0.5*neighborhood_weight
+    return {uids[i]:rank_list[i] for i in np.flatnonzero(is_ranked).tolist()}
+
   '''
   def rank_regulatorsOLD(self,node_weights:dict[int,float],add2prop:str,max_distance=5):
       """
@@ -638,7 +1040,12 @@ class ResnetGraph (nx.MultiDiGraph):
       weight_prop, val2weight = next(iter(relpval2weight.items()))
 
     graph_references = set()
-    relid2refs = postgres.load_refs() if postgres else {}
+    if postgres:
+      # references for relations not submitted by Neo4j queries are fetched in one bulk request
+      relation_ids = [ids[0] for _,_,rel in self.edges.data('relation') if (ids := rel.get('RelationID'))]
+      relid2refs = postgres.load_refs(relation_ids)
+    else:
+      relid2refs = {}
     if val2weight:
       for _, _, rel in self.edges.data('relation'):
         graph_references.update(rel.refs(relid2refs=relid2refs))
@@ -652,33 +1059,6 @@ class ResnetGraph (nx.MultiDiGraph):
     return graph_references
 
 
-  def load_referencesOLD(self,relpval2weight:dict[str,dict[str,float]]=dict(),weight_name='relweight',
-                      postgres:PostgreSQL=None)->set[Reference]:
-    """
-    input:
-      relpval2weight = {property_name:{prop_value:weight}}, 
-      where property_name - PSRelation property used to assign weight to references (usually property_name = OBJECT_TYPE)
-    output:
-        graph references annotated with 'weight_name' property with values specified in 'relpval2weight'
-    """
-    graph_references = set()
-    relid2refs = postgres.load_refs() if postgres else dict()
-
-    if relpval2weight:
-      assert(len(relpval2weight) == 1)
-      weight_by_property,using_value2weight = next(iter(relpval2weight.items()))
-    else:
-      weight_by_property = None
-      using_value2weight = None
-      
-    for r,t,rel in self.iterate():
-      graph_references.update(rel.refs(relid2refs=relid2refs))
-      if using_value2weight:
-        rel.set_weight2ref(weight_by_property,using_value2weight,weight_name)
-
-    return graph_references
-
-
   def add_node_weight2ref(self,regurn2weight:dict,tarurn2weight:dict,weight_name='nodeweight'):
       '''
       input:
@@ -1103,6 +1483,30 @@ class ResnetGraph (nx.MultiDiGraph):
   def clear_resnetgraph(self):
       super().clear()
       self.urn2rel.clear()
+      self.relation_index = None
+
+
+  def compact(self)->'ResnetGraph':
+      '''
+      opt-in compact storage for large graphs. Use after graph is loaded.\n
+      node and relation property names are interned, common values are shared via STRING_POOL,
+      relations share one PSObject instance per node that also shares property values with self.nodes
+      output:
+        self
+      '''
+      start = time.time()
+      uid2node = dict()
+      for uid, attrs in self.nodes(data=True):
+        compact_props(attrs)
+        uid2node[uid] = PSObject(attrs)
+
+      compacted = set()
+      for r,t,rel in self.edges.data('relation'):
+        if id(rel) not in compacted:
+          rel.compact(uid2node)
+          compacted.add(id(rel))
+      print(f'Graph with {self.number_of_nodes()} nodes and {len(compacted)} relations was compacted in {execution_time(start)}')
+      return self
 
 
 ######################   GET GET GET   ######################################
@@ -1435,6 +1839,15 @@ class ResnetGraph (nx.MultiDiGraph):
 
   
   def __find_relations(self, reg_uid, targ_uid, rel_types:list=[], with_effects:list=[], mechanism:list=[], any_direction=False):
+      index = self.__index(rel_types,with_effects)
+      if index is not None:
+          my_rels = [self[reg_uid][targ_uid][urn]['relation'] for urn in index.urns4(reg_uid,targ_uid,rel_types,with_effects)]
+          if any_direction:
+              my_rels += [self[targ_uid][reg_uid][urn]['relation'] for urn in index.urns4(targ_uid,reg_uid,rel_types,with_effects)]
+          if mechanism:
+              my_rels = [x for x in my_rels if x.mechanism() in mechanism]
+          return my_rels
+
       my_rels = self._psrels4(reg_uid, targ_uid)
       if any_direction:
           my_rels = my_rels + self._psrels4(targ_uid, reg_uid)
@@ -1469,16 +1882,36 @@ class ResnetGraph (nx.MultiDiGraph):
       return False
 
 
+  def __connected_pairs(self,uids1,uids2,any_direction=False)->set[tuple[int,int]]:
+      '''
+      output:
+        {(uid1,uid2)} from uids1 x uids2 connected by edge uid1->uid2 or also by edge uid2->uid1 if any_direction.\n
+        Pairs are found by intersecting uids2 with graph adjacency of every uid1 instead of checking every pair in uids1 x uids2
+      '''
+      uids2 = set(uids2)
+      pairs = set()
+      for uid1 in set(uids1):
+          if uid1 not in self: continue
+          pairs.update((uid1,uid2) for uid2 in uids2.intersection(self._succ[uid1]))
+          if any_direction:
+              pairs.update((uid1,uid2) for uid2 in uids2.intersection(self._pred[uid1]))
+      return pairs
+
+
   def relation_exist(self,between_psobjects1:list,and_psobjects2:list,with_reltypes=list(),with_effects=list(),mechanism=list(),any_direction=False):
       uids1 = self.uids(between_psobjects1)
       uids2 = self.uids(and_psobjects2)
-      for node_id1 in uids1:
-          for node_id2 in uids2:
-              my_rels = self.__find_relations(node_id1,node_id2,with_reltypes,with_effects,mechanism,any_direction)
-              if my_rels:
-                  return True
-              else:
-                  continue
+      index = self.__index(with_reltypes,with_effects)
+      if index is not None and not mechanism:
+          uids1, uids2 = set(uids1), set(uids2)
+          if index.connected(uids1,uids2,with_reltypes,with_effects):
+              return True
+          return any_direction and index.connected(uids2,uids1,with_reltypes,with_effects)
+
+      for node_id1, node_id2 in self.__connected_pairs(uids1,uids2,any_direction):
+          my_rels = self.__find_relations(node_id1,node_id2,with_reltypes,with_effects,mechanism,any_direction)
+          if my_rels:
+              return True
 
       return False
 
@@ -1490,9 +1923,21 @@ class ResnetGraph (nx.MultiDiGraph):
       Empty set if no relation exists between_uids and_uids  
       '''
       my_rels = set()
-      for node_uid1 in between_uids:
-          for node_uid2 in and_uids:
-              my_rels.update(self.__find_relations(node_uid1,node_uid2,with_reltypes,with_effects,mechanism,any_direction))
+      index = self.__index(with_reltypes,with_effects)
+      if index is not None:
+          # index returns only relations with_reltypes,with_effects
+          uids1, uids2 = set(between_uids), set(and_uids)
+          edges = list(index.pairs(uids1,uids2,with_reltypes,with_effects))
+          if any_direction:
+              edges += index.pairs(uids2,uids1,with_reltypes,with_effects)
+          for r,t,urns in edges:
+              my_rels.update(self._succ[r][t][urn]['relation'] for urn in urns)
+          if mechanism:
+              my_rels = {x for x in my_rels if x.mechanism() in mechanism}
+          return my_rels
+
+      for node_uid1,node_uid2 in self.__connected_pairs(between_uids,and_uids,any_direction):
+          my_rels.update(self.__find_relations(node_uid1,node_uid2,with_reltypes,with_effects,mechanism,any_direction))
         
       return my_rels
 
@@ -1562,6 +2007,43 @@ class ResnetGraph (nx.MultiDiGraph):
       return 0
 
 
+  def effect_vote_matrix(self,regulators:list[PSObject],targets:list[PSObject],any_direction=False)->sparse.csr_matrix:
+      '''
+      Return
+      ------
+      sparse int8 matrix [regulators x targets] with effect_vote(regulator,target,any_direction) for every pair.\n
+      Graph edges are visited once for all pairs. Pairs with unknown consensus Effect have no stored value
+      '''
+      reg2row = {r.uid():i for i,r in enumerate(regulators)}
+      tar2col = {t.uid():j for j,t in enumerate(targets)}
+      pair2counters = defaultdict(lambda: (set(),set())) # {(row,col):(positive_counter,negative_counter)}
+
+      def add2vote(row,col,rel:PSRelation,effect:str):
+          counter = pair2counters[(row,col)][0 if effect == 'positive' else 1]
+          refs = rel.refs()
+          counter.update(refs) if refs else counter.add(rel)
+
+      for r,t,rel in self.edges.data('relation'):
+          effect = rel.effect()
+          if effect == 'unknown': continue
+          row,col = reg2row.get(r),tar2col.get(t)
+          if row is not None and col is not None:
+              add2vote(row,col,rel,effect)
+          if any_direction:
+              row,col = reg2row.get(t),tar2col.get(r)
+              if row is not None and col is not None:
+                  add2vote(row,col,rel,effect)
+
+      rows,cols,votes = list(),list(),list()
+      for (row,col),(positive_counter,negative_counter) in pair2counters.items():
+          vote = (len(positive_counter) > len(negative_counter)) - (len(positive_counter) < len(negative_counter))
+          if vote:
+              rows.append(row)
+              cols.append(col)
+              votes.append(vote)
+      return sparse.csr_matrix((np.array(votes,dtype=np.int8),(rows,cols)),shape=(len(regulators),len(targets)))
+
+
   def net_regulator_effect(self,regulator:PSObject,targets:list,vote_effect_by_ref=False):
       '''
       Input: targets - [PSObject]
@@ -2313,10 +2795,19 @@ class ResnetGraph (nx.MultiDiGraph):
     return
 
 
-  def to_rnefstr(self,ent_props:list,rel_props:list,add_rel_props:dict={},add_pathway_props:dict={},delete_nodes=False):
+  def to_resnet(self,ent_props:list,rel_props:list,add_rel_props:dict={},add_pathway_props:dict={},delete_nodes=False)->et._Element:
+    '''
+    output:
+      <resnet> element with graph nodes and relations for streaming into RNEF file
+    '''
     resnet_attr = {'refonly':'true'} if delete_nodes else dict()
     resnet = et.Element('resnet',resnet_attr,nsmap=None)
     self.__2resnet(resnet,ent_props,rel_props,add_rel_props,add_pathway_props,delete_nodes)
+    return resnet
+
+
+  def to_rnefstr(self,ent_props:list,rel_props:list,add_rel_props:dict={},add_pathway_props:dict={},delete_nodes=False):
+    resnet = self.to_resnet(ent_props,rel_props,add_rel_props,add_pathway_props,delete_nodes)
     xml_str = et.tostring(resnet)
     return xml_str
 
@@ -2422,6 +2913,27 @@ class ResnetGraph (nx.MultiDiGraph):
     return
 
 
+  def dump2snapshot(self,path:str,ent_props:list=[],rel_props:list=[],params:dict=dict(),no_mess=False):
+    '''
+    input:
+      ent_props,rel_props - properties to keep in snapshot. All properties are kept if empty.
+      References are kept if rel_props is empty or has reference properties like in dump2rnef
+      params - parameters stored in snapshot header to check if snapshot is valid by snapshot.is_valid()
+    Dumps:
+      graph into binary snapshot file that can be loaded by ResnetGraph.fromSnapshot() 
+    Raises TypeError if graph has property values that cannot be saved in snapshot. No file is written in this case
+    '''
+    start = time.time()
+    writer = snapshot.SnapshotWriter()
+    uid2idx = writer.add_nodes(list(self.nodes(data=True)),ent_props)
+    unique_rels = list({r.urn():r for _,_,r in self.edges.data('relation')}.values())
+    with_refs = not rel_props or bool(set(REFERENCE_PROPS).intersection(rel_props))
+    writer.add_rels(unique_rels,uid2idx,rel_props,with_refs)
+    writer.write(path,self.name,params)
+    if not no_mess:
+      print(f'Graph "{self.name}" with {self.number_of_nodes()} nodes and {len(unique_rels)} relations was saved into {path} snapshot in {execution_time(start)}')
+
+
   def add_row2(self,to_df:df,from_relation_types:list,between_node_id,and_node_id,from_properties:list,cell_sep=';'):
       """
       Input
@@ -2573,7 +3085,7 @@ class ResnetGraph (nx.MultiDiGraph):
       rels = set()
       if not no_mess:
           print ('\nLoading graph from file %s' % rnef_file,flush=True)
-      with open(rnef_file, "rb") as f:
+      with open_rnef(rnef_file) as f:
         context = et.iterparse(f, tag="resnet")
         for action, elem in context:
           resnet_nodes,resnet_rels = ResnetGraph._parse_nodes_controls(elem,prop2values,only_relprops,only4objs,match_ends)
@@ -2594,7 +3106,7 @@ class ResnetGraph (nx.MultiDiGraph):
       '''
       if not no_mess:
         print ('\nLoading graph from file %s' % rnef_file,flush=True)
-      with open(rnef_file, "rb") as f:
+      with open_rnef(rnef_file) as f:
         context = et.iterparse(f, tag="resnet")
         for action, elem in context:
           yield ResnetGraph._parse_nodes_controls(elem,prop2values,only_relprops,only4objs,match_ends)
@@ -2604,6 +3116,118 @@ class ResnetGraph (nx.MultiDiGraph):
         del context
 
 
+  @staticmethod
+  def _resnet_offset(f,from_pos:int,file_size:int)->int:
+      '''
+      output:
+        offset of the first <resnet> tag in file f at or after from_pos, file_size if tag is not found
+      '''
+      block_size = 1048576
+      f.seek(from_pos)
+      pos = from_pos
+      tail = b''
+      while pos < file_size:
+        block = f.read(block_size)
+        if not block: break
+        data = tail + block
+        i = data.find(b'<resnet')
+        while 0 <= i < len(data)-7:
+          if data[i+7] in b' >/\t\r\n':
+            return pos - len(tail) + i
+          i = data.find(b'<resnet',i+1)
+        tail = data[-8:] # tag may be split between blocks
+        pos += len(block)
+      return file_size
+
+
+  @staticmethod
+  def _rnef_ranges(rnef_file:str,range_size:int=RNEF_RANGE_SIZE)->tuple[bytes,list[tuple[int,int]]]:
+      '''
+      output:
+        xml_declaration, [(start,end)] - byte ranges of rnef_file aligned on <resnet> boundaries
+        compressed file is not split and has one range (0,-1)
+      '''
+      if compression4(rnef_file): return b'',[(0,-1)]
+      file_size = os.path.getsize(rnef_file)
+      with open(rnef_file,'rb') as f:
+        first = ResnetGraph._resnet_offset(f,0,file_size)
+        if first == file_size: return b'',[]
+        f.seek(0)
+        header = f.read(min(first,4096))
+        declaration = header[:header.find(b'?>')+2] if header.startswith(b'<?xml') else b''
+        starts = [first]
+        for pos in range(first+range_size,file_size,range_size):
+          start = ResnetGraph._resnet_offset(f,max(pos,starts[-1]+1),file_size)
+          if start < file_size:
+            starts.append(start)
+      ends = starts[1:]+[file_size]
+      return declaration, list(zip(starts,ends))
+
+
+  @staticmethod
+  def _read_rnef_range(rnef_file:str,start:int,end:int,declaration:bytes=b'',prop2values:dict=dict(),
+                       only_relprops:set=set(),match_ends=0)->tuple[list[PSObject],list[PSRelation]]:
+      '''
+      parses <resnet> sections from byte range of rnef_file made by ResnetGraph._rnef_ranges().\n
+      Executed in worker process by ResnetGraph.read_rnef_parallel()
+      end < 0 - parses whole compressed file
+      '''
+      if end < 0:
+        nodes,rels = ResnetGraph.__read_rnef(rnef_file,prop2values,set(only_relprops),True,dict(),match_ends)
+        return list(nodes),list(rels)
+
+      with open(rnef_file,'rb') as f:
+        f.seek(start)
+        data = f.read(end-start)
+      last_resnet_end = data.rfind(b'</resnet>')
+      if last_resnet_end < 0: return [],[]
+      xml = declaration+b'<batch>'+data[:last_resnet_end+9]+b'</batch>'
+      del data
+
+      nodes = set()
+      rels = set()
+      only4objs = dict() # shares nodes between <resnet> sections like ResnetGraph.__read_rnef
+      context = et.iterparse(io.BytesIO(xml), tag="resnet")
+      for action, elem in context:
+        resnet_nodes,resnet_rels = ResnetGraph._parse_nodes_controls(elem,prop2values,set(only_relprops),only4objs,match_ends)
+        nodes.update(resnet_nodes)
+        rels.update(resnet_rels)
+        elem.clear()
+      del context
+      return list(nodes),list(rels)
+
+
+  @staticmethod
+  def read_rnef_parallel(flist:list[str],prop2values:dict=dict(),only_relprops:set=set(),match_ends=0,
+                         max_processes:int=MAX_RNEF_PROCESSES,range_size:int=RNEF_RANGE_SIZE):
+      '''
+      input:
+        flist - RNEF files. Files larger than "range_size" are split into byte ranges aligned on <resnet> boundaries
+        prop2values={prop_name:[values]} - filter to load relations only for nodes with desired properties
+      output:
+        generator of (nodes,rels) parsed by worker processes from every byte range in the order of ranges in flist
+      '''
+      tasks = list()
+      for rnef_file in flist:
+        declaration, ranges = ResnetGraph._rnef_ranges(rnef_file,range_size)
+        tasks += [(rnef_file,start,end,declaration) for start,end in ranges]
+      if not tasks: return
+
+      with ProcessPoolExecutor(max_workers=max(1,min(max_processes,len(tasks)))) as e:
+        futures = [e.submit(ResnetGraph._read_rnef_range,f,start,end,declaration,prop2values,only_relprops,match_ends) 
+                   for f,start,end,declaration in tasks]
+        # results are yielded in submission order to merge duplicate relations the same way as serial parsing
+        for future in futures:
+          yield future.result()
+
+
+  def __add_rnef_ranges(self,flist:list[str],prop2values:dict=dict(),only_relprops:set=set(),match_ends=0,
+                        merge=True,edge_duplication=True,max_processes:int=MAX_RNEF_PROCESSES):
+      for nodes,rels in self.read_rnef_parallel(flist,prop2values,only_relprops,match_ends,max_processes):
+        self.add_psobjs(nodes,merge)
+        self.__add_psrels(rels,add_nodes=False,merge=merge,edge_duplication=edge_duplication)
+
+
   @classmethod
   def from_resnet(cls,resnet:et._Element,
                 prop2values:dict=dict(),only_relprops:set=set(),
@@ -2628,22 +3252,30 @@ class ResnetGraph (nx.MultiDiGraph):
                 prop2values:dict=dict(),only_relprops:set=set(),
                 merge=False,no_mess=False,
                 only4objs:dict[str,PSObject]=dict(),on_both_ends=True,
-                edge_duplication=True)->"ResnetGraph":
+                edge_duplication=True,max_processes:int=MAX_RNEF_PROCESSES)->"ResnetGraph":
       '''
       Input
       -----
       set merge=True if graph loaded from multiple RNEF files with multiple <resnet> sections
       prop2values={prop_name:[values]} - filter to load relations only for nodes with desired properties
+      files larger than RNEF_PROCESSES_MIN_SIZE are parsed by "max_processes" worker processes unless "only4objs" is specified.
+      On Windows scripts loading such files must run under if __name__ == '__main__': or set max_processes=1
+      gzip and zstd compressed files are decompressed while parsing
 
       Raises FileNotFoundError if "rnef_file" is not found
       '''
       try:
           start = time.time()
           g = ResnetGraph()
-          nodes,rels = g.__read_rnef(rnef_file,prop2values,only_relprops,no_mess,only4objs,on_both_ends)
+          if max_processes > 1 and not only4objs and not compression4(rnef_file) and os.path.getsize(rnef_file) > RNEF_PROCESSES_MIN_SIZE:
+            if not no_mess:
+              print (f'\nLoading graph from file {rnef_file} using {max_processes} processes',flush=True)
+            g.__add_rnef_ranges([rnef_file],prop2values,only_relprops,on_both_ends,merge,edge_duplication,max_processes)
+          else:
+            nodes,rels = g.__read_rnef(rnef_file,prop2values,only_relprops,no_mess,only4objs,on_both_ends)
+            g.add_psobjs(nodes,merge)
+            g.__add_psrels(rels,add_nodes=False,merge=merge,edge_duplication=edge_duplication)
           g.name = f'from {rnef_file}'
-          g.add_psobjs(nodes,merge)
-          g.__add_psrels(rels,add_nodes=False,merge=merge,edge_duplication=edge_duplication)
 
           if not no_mess:
               print('File %s with %d edges and %d nodes was loaded in %s' 
@@ -2653,24 +3285,44 @@ class ResnetGraph (nx.MultiDiGraph):
           raise FileNotFoundError
 
 
+  @classmethod
+  def fromSnapshot(cls,path:str,edge_duplication=True,no_mess=False)->"ResnetGraph":
+      '''
+      loads graph saved by ResnetGraph.dump2snapshot()
+      Raises FileNotFoundError if "path" is not found, ValueError if snapshot version is not supported
+      '''
+      start = time.time()
+      name,_,nodes,rels = snapshot.read(path)
+      g = ResnetGraph()
+      g.add_psobjs(nodes,merge=False)
+      g.__add_psrels(rels,add_nodes=False,merge=False,edge_duplication=edge_duplication)
+      g.name = name
+      if not no_mess:
+        print(f'Graph "{name}" with {g.number_of_nodes()} nodes and {g.number_of_edges()} edges was loaded from {path} snapshot in {execution_time(start)}')
+      return g
+
+
   @classmethod
   def fromRNEFflist(cls,flist:list[str],prop2values:dict=dict(),
-                  only_relprops:set=set(),merge=True,edge_duplication=True)->"ResnetGraph":
+                  only_relprops:set=set(),merge=True,edge_duplication=True,
+                  max_processes:int=MAX_RNEF_PROCESSES)->"ResnetGraph":
       '''
       input:
         set merge=True if graph loaded form multiple RNEF files with multiple <resnet> sections
         prop2values={prop_name:[values]} - filter to load relations only for nodes with desired properties
+        files are parsed by "max_processes" worker processes if their total size is larger than RNEF_PROCESSES_MIN_SIZE.
+        Files larger than RNEF_RANGE_SIZE are split between processes.
+        On Windows scripts loading such files must run under if __name__ == '__main__': or set max_processes=1.
+        Smaller files are parsed in current process
       '''
-      #max_workers = min(32,len(flist),(os.cpu_count() or 1) + 4) now is default in Python > 3.8
       combo_g = ResnetGraph()
-      with ThreadPoolExecutor(thread_name_prefix='readRNEFdir') as e:
-        futures = list()
-        [futures.append(e.submit(combo_g.__read_rnef,f,prop2values,only_relprops,True)) for f in flist]
-        for f in as_completed(futures):
-          nodes,rels = f.result()
+      if max_processes > 1 and sum(os.path.getsize(f) for f in flist) > RNEF_PROCESSES_MIN_SIZE:
+        combo_g.__add_rnef_ranges(flist,prop2values,only_relprops,0,merge,edge_duplication,max_processes)
+      else:
+        for f in flist:
+          nodes,rels = combo_g.__read_rnef(f,prop2values,only_relprops,True,dict())
           combo_g.add_psobjs(nodes,merge)
           combo_g.__add_psrels(rels,add_nodes=False,merge=merge,edge_duplication=edge_duplication)
-        e.shutdown()    
       return combo_g
 
 
@@ -2696,7 +3348,9 @@ class ResnetGraph (nx.MultiDiGraph):
       Raises FileNotFoundError if "rnef_file" is not found
       '''
       start = time.time()
-      listing = glob.glob(os.path.join(path2dir, '*.rnef'))+glob.glob(os.path.join(path2dir, '**/*.rnef'),recursive=include_subdirs)
+      listing = list()
+      for ext in RNEF_EXTENSIONS:
+        listing += glob.glob(os.path.join(path2dir, '*'+ext))+glob.glob(os.path.join(path2dir, '**/*'+ext),recursive=include_subdirs)
       combo_g = ResnetGraph()
       if listing:
           combo_g = ResnetGraph.fromRNEFflist(listing,prop2values,only_relprops,merge)
@@ -3149,6 +3803,32 @@ class ResnetGraph (nx.MultiDiGraph):
       self.__add_rel(best_rel,refresh_urn=True,edge_duplication=edge_duplication)
 
 
+  def __simplified(self,ranks:list[list[str]])->'ResnetGraph':
+    '''
+    output:
+      graph where parallel relations between every pair of nodes are merged into one by __set_bestrel
+    Only node pairs with parallel edges are visited in the order of self.edges().
+    All edges are visited if those pairs have relations with more than two nodes
+    because such relations can make parallel edges between any of their nodes
+    '''
+    def unordered(u,v):
+      return (u,v) if u <= v else (v,u)
+
+    parallel_pairs = {unordered(u,v) for u,nbrs in self._adj.items() for v,keydict in nbrs.items() if len(keydict) > 1}
+    visits = [(u,v) for u,nbrs in self._adj.items() for v in nbrs if unordered(u,v) in parallel_pairs]
+    def is_multinode(rel:PSRelation):
+      return len({n.uid() for nodes in rel.Nodes.values() for n in nodes}) > 2
+    if any(is_multinode(rel) for u,v in visits for rel in self._psrels4(u,v)):
+      visits = [(u,v) for u,nbrs in self._adj.items() for v in nbrs]
+
+    simple_g = self.copy()
+    for ruid, tuid in visits:
+      reg2target_rels = simple_g._psrels4(ruid,tuid)
+      if len(reg2target_rels) > 1: # need simplification
+        simple_g.__set_bestrel(reg2target_rels,ranks,edge_duplication=False)
+    return simple_g
+
+
   def simplify(self, rel_type_rank:list[str]=[]):
     """
     input:
@@ -3170,12 +3850,7 @@ class ResnetGraph (nx.MultiDiGraph):
 
     print(f'Simplifying {self.name} graph')
     ranks = [rel_type_rank] if rel_type_rank else []
-    simple_g = self.copy()
-    for ruid, tuid in self.edges():
-      reg2target_rels = simple_g._psrels4(ruid,tuid)
-      if len(reg2target_rels) > 1: # need simplification
-        simple_g.__set_bestrel(reg2target_rels,ranks,edge_duplication=False)
-        
+    simple_g = self.__simplified(ranks)
     print('%d redundant edges in graph "%s" were removed by simplification' % 
           (self.number_of_edges()-simple_g.number_of_edges(),self.name))
     return simple_g
@@ -3214,14 +3889,7 @@ class ResnetGraph (nx.MultiDiGraph):
       ] if not ranks else ranks
 
       print(f'Curating {self.name}')
-      curated_g = self.copy()
-      for ruid, tuid in self.edges():
-        # if regulator_uid ==PSObject.urn2uid('urn:agi-cas:106266-06-2'):
-        #     if  target_uid == PSObject.urn2uid('urn:agi-llid:3351'):
-        #         print('')
-        reg2target_rels = curated_g._psrels4(ruid,tuid)
-        if len(reg2target_rels) > 1: # need simplification
-          curated_g.__set_bestrel(reg2target_rels,curation_rules,edge_duplication=False)
+      curated_g = self.__simplified(curation_rules)
               
       print('%d redundant edges in graph "%s" were removed by simplification' % 
           (self.number_of_edges()-curated_g.number_of_edges(),self.name))
@@ -3451,7 +4119,13 @@ class ResnetGraph (nx.MultiDiGraph):
     effects_set = set(with_effect) if with_effect else None
 
     my_rels = set()
+    index = self.__index(by_relation_types,with_effect)
     def collect_edges(sources, targets):
+      if index is not None:
+        for u,v,urns in index.pairs(sources,targets,by_relation_types,with_effect):
+          my_rels.update(self[u][v][urn]['relation'] for urn in urns)
+        return
+
       for u in sources:
         if u not in self: 
           continue 
@@ -3856,7 +4530,60 @@ class ResnetGraph (nx.MultiDiGraph):
 
 
 ############################# EMBEDDING EMBEDDING EMBEDDING #######################################
-  def rn2tensor(self,node_stats: Optional[dict[str,int]]=None,node_features: Optional[list[list[int]]]=None,
+  def __edge_arrays(self,uid2pos:dict[int,int],reltype2id:dict[str,int]):
+      '''
+      Input
+      -----
+      uid2pos - {node uid:node position}\n
+      reltype2id - {reltype:type id}. Relation types missing in reltype2id are added with next type id
+
+      Return
+      ------
+      regulator positions, target positions, edge weights = reference counts, relation type ids, effect signs\n
+      as contiguous NumPy arrays with one element per edge.
+      ClinicalTrial relations have effect sign -1 because they do not have Effect in Resnet
+      '''
+      reg_pos,tar_pos,weights,type_ids,signs = list(),list(),list(),list(),list()
+      for r,t,rel in self.edges.data('relation'):
+          if not isinstance(rel,PSRelation): continue
+          reltype = rel.objtype()
+          reg_pos.append(uid2pos[r])
+          tar_pos.append(uid2pos[t])
+          weights.append(rel.count_refs())
+          type_ids.append(reltype2id.setdefault(reltype,len(reltype2id)))
+          signs.append(-1 if reltype == 'ClinicalTrial' else rel.effect_sign())
+
+      return (np.array(reg_pos,dtype=np.int64),np.array(tar_pos,dtype=np.int64),np.array(weights,dtype=np.int64),
+              np.array(type_ids,dtype=np.int64),np.array(signs,dtype=np.int8))
+
+
+  @staticmethod
+  def signed_edges(reg_pos:np.ndarray,tar_pos:np.ndarray,signs:np.ndarray,
+                   active_idx:np.ndarray,repressed_idx:np.ndarray)->tuple[np.ndarray,np.ndarray,np.ndarray]:
+      '''
+      Input
+      -----
+      reg_pos,tar_pos,signs - regulator position, target position and effect sign of every edge\n
+      active_idx,repressed_idx - indexes of active and repressed states for every node position
+
+      Return
+      ------
+      regulator state indexes, target state indexes, source edge of every signed edge.\n
+      Edges with positive sign are expanded into active->active, repressed->repressed edges,\n
+      edges with negative sign into active->repressed, repressed->active edges,\n
+      edges with unknown sign into all four state combinations
+      '''
+      copies = np.where(signs == 0,4,2)
+      edge_pos = np.repeat(np.arange(len(signs),dtype=np.int64),copies)
+      # position of signed edge among copies of its source edge
+      copy_pos = np.arange(len(edge_pos),dtype=np.int64) - np.repeat(np.cumsum(copies)-copies,copies)
+      reg_state = copy_pos % 2
+      tar_state = reg_state ^ np.where(signs[edge_pos] < 0,1,copy_pos//2)
+      state_idx = np.stack([active_idx,repressed_idx])
+      return state_idx[reg_state,reg_pos[edge_pos]],state_idx[tar_state,tar_pos[edge_pos]],edge_pos
+
+
+  def rn2tensor(self,node_stats: Optional[dict[str,int]]=None,node_features: Optional[np.ndarray]=None,
                 edge_stats: Optional[dict[str,int]]=None,idx2objs: Optional[dict[int,PSObject]]=None):
       '''
       Input
@@ -3867,11 +4594,12 @@ class ResnetGraph (nx.MultiDiGraph):
 
       Return
       ------
-      {index:PSobject} - dictionary of indexed graph nodes 
-      node_features - [[0,1,0,0]...[1,0,0,0]] - 1-hot encoded node types. feature index = index of objtype in node_stats
-      edges - [r,t,w,[0,1,0,0]] - regulator index, target index, edge weight, 1-hot encoded edge types\n
-      node_stats - {objtype:counts}, sorted by count in descending order
-      edge_stats - {reltype:counts}, sorted by count in descending order, edge feature index = index of reltype in edge_stats
+      {index:PSobject} - dictionary of indexed graph nodes. Every node has active and repressed state with different indexes 
+      node_features - int8 array of 1-hot encoded node types, one row per node index. feature index = index of objtype in node_stats
+      edges - {'edge_index':int64 array [[r...],[t...]], 'edge_weight':int64 array, 'edge_type':int64 array, 'edge_sign':int8 array}\n
+      edge_type = index of reltype in edge_stats. All arrays are contiguous and can be passed to torch.from_numpy without copying\n
+      node_stats - {objtype:counts}, sorted by count in ascending order
+      edge_stats - {reltype:counts}, edge feature index = index of reltype in edge_stats
       '''
       if node_stats is None:
           node_stats = self.__node_stats() 
@@ -3885,68 +4613,40 @@ class ResnetGraph (nx.MultiDiGraph):
       else:
           idx2objs = dict()
 
-      def objidx(obj:PSObject):
+      def stateidx(state_urn:str,make_state):
           try:
-              return urn2idx[obj.urn()]
+              return urn2idx[state_urn]
           except KeyError:
               newidx = len(urn2idx)
-              urn2idx[obj.urn()] = newidx
-              idx2objs[newidx] = obj
+              urn2idx[state_urn] = newidx
+              idx2objs[newidx] = make_state()
               return newidx
+
+      # state objects are copied once per node, not for every edge
+      nodes = self._get_nodes()
+      uid2pos = dict()
+      active_idx = np.empty(len(nodes),dtype=np.int64)
+      repressed_idx = np.empty(len(nodes),dtype=np.int64)
+      for pos,n in enumerate(nodes):
+          uid2pos[n.uid()] = pos
+          active_idx[pos] = stateidx(n.active_urn(),n.make_active)
+          repressed_idx[pos] = stateidx(n.repressed_urn(),n.make_repressed)
       
       if node_features is None:
-          node_features_dict = list(node_stats.keys())
-          nodes = self._get_nodes()
-          node_features = [[]]*2*len(nodes)
-          for n in nodes:
-              nobjtype = n.objtype()
-              n_features = [0]*len(node_features_dict)
-              objtype_idx = node_features_dict.index(nobjtype)
-              n_features[objtype_idx] = 1
-
-              active_newidx = objidx(n.make_active())
-              node_features[active_newidx] = n_features
-              repressed_newidx = objidx(n.make_repressed())
-              node_features[repressed_newidx] = n_features
+          objtype2id = {t:i for i,t in enumerate(node_stats.keys())}
+          objtype_ids = np.fromiter((objtype2id[n.objtype()] for n in nodes),dtype=np.int64,count=len(nodes))
+          node_features = np.zeros((len(urn2idx),len(objtype2id)),dtype=np.int8)
+          node_features[active_idx,objtype_ids] = 1
+          node_features[repressed_idx,objtype_ids] = 1
       
-      edge_features_dict = list(edge_stats.keys())
-      edge_list = list()
-      for r,t,e in self.edges.data(True):
-          regulator = self._get_node(r)
-          target = self._get_node(t)
-          r_active_idx = objidx(regulator.make_active())
-          r_repressed_idx = objidx(regulator.make_repressed())
-          t_active_idx = objidx(target.make_active())
-          t_repressed_idx = objidx(target.make_repressed())
-          
-          psrel = e['relation']
-          if isinstance(psrel,PSRelation):
-              reltype = psrel.objtype()
-              if reltype == 'ClinicalTrial':
-                  effect_sign = -1 # hacking ClinicalTrial that do not have Effect sign in Resnet
-              else:
-                  effect_sign = psrel.effect_sign()
-
-              relweight = psrel.count_refs()
-
-              reltype = psrel.objtype()
-              e_features = [0]*len(edge_features_dict)
-              reltype_idx = edge_features_dict.index(reltype)
-              e_features[reltype_idx] = 1
-
-              if effect_sign > 0:
-                  edge_list.append([r_active_idx,t_active_idx,relweight,e_features])
-                  edge_list.append([r_repressed_idx,t_repressed_idx,relweight,e_features])
-              elif effect_sign < 0:
-                  edge_list.append([r_active_idx,t_repressed_idx,relweight,e_features])
-                  edge_list.append([r_repressed_idx,t_active_idx,relweight,e_features])
-              else:
-                  edge_list.append([r_active_idx,t_active_idx,relweight,e_features])
-                  edge_list.append([r_repressed_idx,t_repressed_idx,relweight,e_features])
-                  edge_list.append([r_active_idx,t_repressed_idx,relweight,e_features])
-                  edge_list.append([r_repressed_idx,t_active_idx,relweight,e_features])
-              
-      return edge_list,node_features,idx2objs,node_stats,edge_stats
+      reltype2id = {t:i for i,t in enumerate(edge_stats.keys())}
+      reg_pos,tar_pos,weights,type_ids,signs = self.__edge_arrays(uid2pos,reltype2id)
+      regs,tars,edge_pos = self.signed_edges(reg_pos,tar_pos,signs,active_idx,repressed_idx)
+      edges = {'edge_index':np.stack([regs,tars]),
+               'edge_weight':weights[edge_pos],
+               'edge_type':type_ids[edge_pos],
+               'edge_sign':signs[edge_pos]}
+      return edges,node_features,idx2objs,node_stats,edge_stats
   
   
   def rn2hd4dp(self)->tuple[HeteroData,dict[int,PSObject]]:
@@ -3963,117 +4663,71 @@ class ResnetGraph (nx.MultiDiGraph):
       all other [SmallMol,Regulation,Disease] edges have label = 0
       '''
       node_stats = self.__node_stats()
-      # assigning indexes to objects
-      urn2idx = dict()
+      node_types = list(node_stats.keys())
+      objtype2id = {t:i for i,t in enumerate(node_types)}
+      nodes = self._get_nodes()
+      uid2pos = {n.uid():pos for pos,n in enumerate(nodes)}
+      objtype_ids = np.fromiter((objtype2id[n.objtype()] for n in nodes),dtype=np.int64,count=len(nodes))
+
+      reltype2id = {'Regulation':0,'ClinicalTrial':1}
+      reg_pos,tar_pos,weights,rel_ids,signs = self.__edge_arrays(uid2pos,reltype2id)
+      reltypes = list(reltype2id.keys())
+      new_rel_ids = np.where(rel_ids == reltype2id['ClinicalTrial'],reltype2id['Regulation'],rel_ids)
+
+      # only nodes connected by edges are indexed. Active state index = 2*rank, repressed = 2*rank+1
+      connected = np.zeros(len(nodes),dtype=bool)
+      connected[reg_pos] = True
+      connected[tar_pos] = True
+      rank = np.cumsum(connected)-1
+      active_idx = 2*rank
+      repressed_idx = active_idx+1
       idx2objs = dict()
-      def objidx(obj:PSObject):
-          try:
-              return urn2idx[obj.urn()]
-          except KeyError:
-              newidx = len(urn2idx)
-              urn2idx[obj.urn()] = newidx
-              idx2objs[newidx] = obj
-              return newidx
-          
-      def efsign(rel:PSRelation):# hacking ClinicalTrial that do not have Effect sign in Resnet
-          return -1 if rel.objtype() == 'ClinicalTrial' else rel.effect_sign()
-
-      # initializing urn2idx to count total number of nodes with different states
-      for r,t,rel in self.edges.data(data='relation'):
-          regulator = self._get_node(r)
-          target = self._get_node(t)
-          assert(isinstance(rel,PSRelation))
-          effect_sign = efsign(rel)
-          if effect_sign > 0:
-              objidx(regulator.make_active())
-              objidx(target.make_active())
-          elif effect_sign < 0:
-              objidx(regulator.make_active())
-              objidx(target.make_repressed())
-          else:
-              objidx(regulator.make_active())
-              objidx(target.make_active())
-              objidx(regulator.make_repressed())
-              objidx(target.make_repressed())
-          
-      # collecting edge data into {triple_type:list} dicts
-      edges_reg = defaultdict(list)
-      edges_tar = defaultdict(list)
-      edge_weights = defaultdict(list)
-      edge_labels = defaultdict(list)
-
-      for r,t,rel in self.edges.data(data='relation'):
-          regulator = self._get_node(r)
-          target = self._get_node(t)
-          rtype = regulator.objtype()
-          ttype = target.objtype()
-          r_active_idx = objidx(regulator.make_active())
-          r_repressed_idx = objidx(regulator.make_repressed())
-          t_active_idx = objidx(target.make_active())
-          t_repressed_idx = objidx(target.make_repressed())
+      for pos in np.flatnonzero(connected).tolist():
+          n = nodes[pos]
+          idx2objs[2*int(rank[pos])] = n.make_active()
+          idx2objs[2*int(rank[pos])+1] = n.make_repressed()
+
+      # triple types are numbered in order of their first edge
+      rtype_ids = objtype_ids[reg_pos]
+      ttype_ids = objtype_ids[tar_pos]
+      triple_keys = (rtype_ids*len(reltypes) + new_rel_ids)*len(node_types) + ttype_ids
+      _,first_edge,triple_ids = np.unique(triple_keys,return_index=True,return_inverse=True)
+      triple_order = np.argsort(first_edge,kind='stable')
+      triple_rank = np.empty(len(triple_order),dtype=np.int64)
+      triple_rank[triple_order] = np.arange(len(triple_order))
+      triple_ids = triple_rank[triple_ids.reshape(-1)]
+
+      regs,tars,edge_pos = self.signed_edges(reg_pos,tar_pos,signs,active_idx,repressed_idx)
+      # grouping signed edges by triple type
+      order = np.argsort(triple_ids[edge_pos],kind='stable')
+      edge_pos = edge_pos[order]
+      regs = regs[order]
+      tars = tars[order]
+      bounds = np.concatenate([[0],np.cumsum(np.bincount(triple_ids[edge_pos],minlength=len(triple_order)))])
 
-          assert(isinstance(rel,PSRelation))
-          effect_sign = efsign(rel)
-          if effect_sign > 0:
-              new_edges = [[r_active_idx,r_repressed_idx], [t_active_idx,t_repressed_idx]]
-          elif effect_sign < 0:
-                  new_edges = [[r_active_idx,r_repressed_idx], [t_repressed_idx,t_active_idx]]
-          else:
-              new_edges = [[r_active_idx,r_active_idx,r_repressed_idx,r_repressed_idx], [t_active_idx,t_repressed_idx,t_active_idx,t_repressed_idx]]
+      # normalizing edge_weight:
+      edge_weights = weights[edge_pos].astype(np.float32)
+      edge_weights /= max(float(np.linalg.norm(edge_weights)),1e-12)
 
-          reltype = rel.objtype()
-          new_reltype = 'Regulation' if reltype == 'ClinicalTrial' else reltype
-          triple_type = (rtype,new_reltype,ttype)
-          edges_reg[triple_type] += new_edges[0]
-          edges_tar[triple_type] += new_edges[1]
-
-          relweight = rel.count_refs()
-          new_edges_count = len(new_edges[0])
-          edge_weights[triple_type] += [relweight]*new_edges_count
-          
-          if rtype == 'SmallMol' and ttype == 'Disease':
-              if reltype == 'ClinicalTrial':
-                  edge_labels[triple_type] += [1]*new_edges_count
-              else:
-                  if reltype == 'Regulation':  
-                      if effect_sign > 0:# negative edges are drug-disease toxicities
-                          edge_labels[triple_type] += [-1]*new_edges_count
-                      else:# all other drug-disease pairs are for testing
-                          edge_labels[triple_type] += [0]*new_edges_count
+      # negative edges are drug-disease toxicities, all other drug-disease pairs are for testing
+      edge_labels = np.where(rel_ids[edge_pos] == reltype2id['ClinicalTrial'],1,np.where(signs[edge_pos] > 0,-1,0))
+      smallmol_id = objtype2id.get('SmallMol',-1)
+      disease_id = objtype2id.get('Disease',-1)
 
       # creating HeteroData to return
       data = HeteroData()
-      number_of_nodes = len(urn2idx)
-      node_types = list(node_stats.keys())
+      state_objtype_ids = np.repeat(objtype_ids[connected],2)
       for nt in node_types:
-          data[nt].x = [0]*number_of_nodes
-
-      for idx,obj in idx2objs.items():
-          data[obj.objtype()].x[idx] = 1
-
-      triple_types = list(edges_reg.keys())
-      for triple_type in triple_types:
-          #regulator, relation, target = triple_type
-          edges = torch.tensor([edges_reg[triple_type],edges_tar[triple_type]])
-          edge_weight = torch.from_numpy(np.asarray(edge_weights[triple_type]))
-
-          data[triple_type].edge_index = edges
-          data[triple_type].edge_weight = edge_weight
-          if triple_type in edge_labels.keys():
-              edge_label = torch.from_numpy(np.asarray(edge_labels[triple_type]))
-              data[triple_type].edge_label = edge_label
-      
-      # normalizing edge_weight:
-      all_edge_weights = torch.cat([data[tt].edge_weight for tt in triple_types], dim=0)
-      all_edge_weights = all_edge_weights.to(torch.float32)
-      normalized_weights = torch.nn.functional.normalize(all_edge_weights, p=2, dim=0)
-      split_index = [0]+[data[tt].edge_index.shape[1] for tt in triple_types]
-      split_intervals = torch.cumsum(torch.tensor(split_index), dim=0)
+          data[nt].x = torch.from_numpy((state_objtype_ids == objtype2id[nt]).astype(np.int64))
 
-      for i in range(0,len(triple_types)):
-          triple_type = triple_types[i]
-          start, end = split_intervals[i], split_intervals[i+1]
-          data[triple_type].edge_weight = normalized_weights[start:end]
+      for i,triple_pos in enumerate(first_edge[triple_order].tolist()):
+          start, end = int(bounds[i]),int(bounds[i+1])
+          rtype_id,rel_id,ttype_id = int(rtype_ids[triple_pos]),int(new_rel_ids[triple_pos]),int(ttype_ids[triple_pos])
+          triple_type = (node_types[rtype_id],reltypes[rel_id],node_types[ttype_id])
+          data[triple_type].edge_index = torch.from_numpy(np.stack([regs[start:end],tars[start:end]]))
+          data[triple_type].edge_weight = torch.from_numpy(edge_weights[start:end])
+          if rtype_id == smallmol_id and ttype_id == disease_id and rel_id == reltype2id['Regulation']:
+              data[triple_type].edge_label = torch.from_numpy(edge_labels[start:end])
 
       return data, idx2objs
 
@@ -4180,12 +4834,33 @@ class ResnetGraph (nx.MultiDiGraph):
     return self._get_nodes(),df.from_pd(relations_pd),df.from_pd(refset_pd),df(ref_dicts)
   
 
-  def rn2neo4jDump(self,save2dir:str,sep='|'):
+  def rn2neo4jDump(self,save2dir:str,sep='|')->dict[str,list[str]]:
+    '''
+    offline alternative to nx2neo4j.load_graph_bulk.
+    Writes node and relationship files for "neo4j-admin database import full"
+    output:
+      {'nodes':[node files],'relationships':[relationship files]}
+    '''
     nodopG = self.remove_undirected_duplicates()
-    nodes_df,relations_df = nodopG.neo4j_df()
+    nodes,relations_df,refset_df,_ = nodopG.neo4j_dfs()
     extension = '.txt' if sep== '|' else '.tsv' if sep== '\t' else '.csv'
-    #nodes_df.to_csv(save2dir+f'{self.name}Nodes.neo4j'+extension,sep=sep,index=False,quoting=csv.QUOTE_MINIMAL)
-    relations_df.to_csv(save2dir+f'{self.name}Relations.neo4j'+extension,sep=sep,index=False,quoting=csv.QUOTE_MINIMAL)
+    nodes_df = pd.DataFrame([{':ID':n.urn(),'Name':n.name(),'Description':n.get('Description',[''])[0],':LABEL':n.objtype()} 
+                             for n in nodes],columns=[':ID','Name','Description',':LABEL'])
+    ref_ids = relations_df.loc[relations_df[':TYPE'] == 'BelongsTo',':START_ID'].unique()
+    refs_df = pd.DataFrame({':ID':ref_ids,':LABEL':'Reference'})
+
+    files = {'nodes':list(),'relationships':list()}
+    for file_type,fname,table in [('nodes','Nodes',nodes_df),('nodes','RefSets',refset_df),('nodes','References',refs_df),
+                                  ('relationships','Relations',relations_df)]:
+      if file_type == 'nodes':
+        table = table.drop_duplicates(subset=[':ID'])
+      path = os.path.join(save2dir,f'{self.name}{fname}.neo4j'+extension)
+      table.to_csv(path,sep=sep,index=False,quoting=csv.QUOTE_MINIMAL)
+      files[file_type].append(path)
+
+    print(f'neo4j-admin import files were written to {save2dir}. Import them with:')
+    print(f"neo4j-admin database import full --delimiter='{sep}' "+' '.join(f'--{t}={p}' for t,paths in files.items() for p in paths))
+    return files
 
 
   @staticmethod
@@ -4225,6 +4900,15 @@ class ResnetGraph (nx.MultiDiGraph):
     '''
     nodes = from_nodes if from_nodes else self._get_nodes()
     return self._make_map(using_props,nodes)
+
+
+  def make_index(self,using_props:list, from_nodes:list=[],norm=True)->MappingIndex:
+    '''
+    output:
+      MappingIndex with same lookups as self.make_map(using_props,from_nodes)
+    '''
+    nodes = from_nodes if from_nodes else self._get_nodes()
+    return MappingIndex(using_props,nodes,norm)
   
     '''
     output:
@@ -4,9 +4,9 @@ from .ResnetGraph import REFCOUNT, ResnetGraph, nx, EFFECT,NUMBER_OF_TARGETS,PRO
 from ...utils.pandas.panda_tricks import df, ExcelWriter
 from .Drugs4Disease import Drugs4Targets
 from .Drugs4Disease import ANTAGONIST_TARGETS_WS,AGONIST_TARGETS_WS,RANK,DRUG2TARGET_REGULATOR_SCORE,PHARMAPENDIUM_ID
-from .Zeep2Experiment import Experiment, Sample, ENSEMBL_ID,HAS_PVALUE
+from .Zeep2Experiment import Experiment, Sample, ENSEMBL_ID,HAS_PVALUE,mannwhitneyu4sets
 from ...utils.utils import Tee,execution_time
-from scipy.stats._mannwhitneyu import mannwhitneyu
+from scipy import sparse
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor
 
@@ -15,6 +15,7 @@ PPERNET = 'protein_expression_regulatory_network'
 DPERNET = 'drug-protein expression regulatory network'
 ACTIVATION_IN = 'activation in '
 EXPRESSION = ['Expression','PromoterBinding']
+SAMPLE_BATCH = 64 # number of samples scored together by SNEA.regulome_activity()
 
 
 class SNEA(APIcache):
@@ -258,8 +259,79 @@ class SNEA(APIcache):
     return regulator_activation_score, regulome_values, effect_target_counter
 
 
-  def __regulators4sample(self,sample:Sample,regulomes:dict,
-                          from_graph=ResnetGraph(),target_annotation_prefix='')->set[int]:
+  @staticmethod
+  def regulome_matrix(regulomes:dict[int,list[PSObject]],according2:ResnetGraph)->tuple[list[int],list[PSObject],sparse.csr_matrix,sparse.csr_matrix]:
+    '''
+    input:
+      regulomes = {regulator_uid:[PSObject]} made by ResnetGraph.regulome_dict()
+    output:
+      regulator_uids, targets,
+      sign matrix regulators x targets with effect sign of the first relation from regulator to target,
+      regulome matrix regulators x targets with 1 for every target of regulator
+    '''
+    regulator_uids = list(regulomes.keys())
+    target_uid2idx = dict()
+    targets = list()
+    rows, cols, signs = list(), list(), list()
+    for row, (regulator_uid,regulome) in enumerate(regulomes.items()):
+      for target in regulome:
+        target_uid = target.uid()
+        col = target_uid2idx.get(target_uid)
+        if col is None:
+          col = target_uid2idx[target_uid] = len(targets)
+          targets.append(target)
+        rows.append(row)
+        cols.append(col)
+        rels = according2._psrels4(regulator_uid,target_uid)
+        signs.append(rels[0].effect_sign() if rels else 0)
+
+    shape = (len(regulator_uids),len(targets))
+    sign_matrix = sparse.csr_matrix((np.array(signs,dtype=float),(rows,cols)),shape=shape)
+    sign_matrix.eliminate_zeros() # relations with unknown effect do not contribute to activation score
+    regulome_matrix = sparse.csr_matrix((np.ones(len(rows)),(rows,cols)),shape=shape)
+    return regulator_uids, targets, sign_matrix, regulome_matrix
+
+
+  def __sample_arrays(self,samples:list[Sample],targets:list[PSObject])->tuple[np.ndarray,np.ndarray,np.ndarray]:
+    '''
+    output:
+      target values, target p-values, annotated - arrays targets x samples
+    '''
+    values = np.full((len(targets),len(samples)),np.nan)
+    pvalues = np.full((len(targets),len(samples)),np.nan)
+    annotated = np.zeros((len(targets),len(samples)),dtype=bool)
+    for col, sample in enumerate(samples):
+      annotated_with_sample = self.experiment.name4annotation(sample)
+      for row, target in enumerate(targets):
+        if annotated_with_sample in target:
+          values[row,col], pvalues[row,col] = target[annotated_with_sample][0]
+          annotated[row,col] = True
+    return values, pvalues, annotated
+
+
+  def regulome_activity(self,samples:list[Sample],sign_matrix:sparse.csr_matrix,regulome_matrix:sparse.csr_matrix,
+                        targets:list[PSObject])->tuple[np.ndarray,np.ndarray,np.ndarray,np.ndarray,np.ndarray]:
+    '''
+    batched version of SNEA.activity() for all regulators in "sign_matrix" and all "samples"
+    output:
+      regulator_activation_score, effect_target_counter, regulome_size - arrays regulators x samples,
+      target values, annotated - arrays targets x samples
+    '''
+    values, pvalues, annotated = self.__sample_arrays(samples,targets)
+    with np.errstate(invalid='ignore'):
+      significant = annotated & ((pvalues < 0.05) | (np.isnan(pvalues) & (np.abs(values) >= 1.0)))
+    effect_values = np.where(significant,values,0.0)
+    activation_score = np.asarray(sign_matrix @ effect_values)
+    effect_target_counter = np.asarray(abs(sign_matrix) @ significant.astype(float))
+    regulome_size = np.asarray(regulome_matrix @ annotated.astype(float))
+
+    has_score = (regulome_size >= self.min_subnet_size) & (effect_target_counter > 0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+      activation_score = np.where(has_score,activation_score/np.sqrt(effect_target_counter),np.nan)
+    return activation_score, effect_target_counter, regulome_size, values, annotated
+
+
+  def __regulators4samples(self,samples:list[Sample],regulomes:dict,from_graph=ResnetGraph())->dict[str,set[int]]:
       '''
       Input
       -----
@@ -268,52 +340,43 @@ class SNEA(APIcache):
 
       Return
       ------
-      [uids] - uids of regulators 
-      regulators in self.Graph are annotated with SNEA activation score and p-value calculated from "sample" 
+      {sample_name:[uids]} - uids of regulators 
+      regulators in self.Graph are annotated with SNEA activation score and p-value calculated from every sample 
+      regulator x target sign matrix is made once and samples are scored in batches of SAMPLE_BATCH
       '''
       my_graph = from_graph if from_graph else self.Graph
-      sample_annotation_name = target_annotation_prefix+self.experiment.name4annotation(sample)
-
-      sample_start = time.time()
-      abs_sample_distribution = sample.data['value'].abs()
-      abs_sample_distribution = abs_sample_distribution.dropna(how='all')
-      sample_regulator_uids = set()
-      
-      for regulator_uid, targets in regulomes.items():
-          regulator_activation_score,subnetwork_values,effect_target_counter = self.activity(sample,
-                                          regulator_uid,targets,my_graph)
-
-          if not subnetwork_values: continue
-          sub_pd = df.from_dict({'value':subnetwork_values})
-          abs_sub_pd = sub_pd['value'].abs()
-
-          if regulator_activation_score > 0 or regulator_activation_score == np.nan:
-              mw_stats,mv_pvalue = mannwhitneyu(x=abs_sub_pd, y=abs_sample_distribution, alternative = 'greater')
-          else:
-              mw_stats,mv_pvalue = mannwhitneyu(x=abs_sub_pd, y=abs_sample_distribution, alternative = 'less')
-          """
-          # alternative hypothesis: abs_sample_distribution is less than abs_sub_pd
-          'two-sided': the distributions are not equal, i.e. F(u) ≠ G(u) for at least one u.
-          'less': the distribution underlying x is stochastically less than the distribution underlying y, i.e. F(u) > G(u) for all u.
-          'greater': the distribution underlying x is stochastically greater than the distribution underlying y, i.e. F(u) < G(u) for all u.
-          One-sided alternative hypothesis tests median from one group can be greater or lesser than other group.
-          """
-      #    if from_graph._get_node(regulator_uid).name() == 'FOXM1':
-      #        print('')
-          if mv_pvalue <= self.subnet_pvalue_cutoff:
-              new_prop_name = self.__sample_annotation(sample)
-              prp_value = [float(regulator_activation_score),float(mv_pvalue),int(effect_target_counter)]
-              nx.set_node_attributes(my_graph, {regulator_uid:{new_prop_name:prp_value}})
-              sample_regulator_uids.add(regulator_uid)
-
-      sample_time = execution_time(sample_start)
-      print('Found %d regulators with pvalue < %.2f in %s'
-              % (len(sample_regulator_uids),self.subnet_pvalue_cutoff,sample_time),flush=True)
-
-      return sample_regulator_uids # must return uids and not PSObjects here 
-
-
-  def expression_regulators(self,regulomes=dict(),from_graph=ResnetGraph(),prefix4target_annotation=''):
+      regulator_uids, targets, sign_matrix, regulome_matrix = self.regulome_matrix(regulomes,my_graph)
+      sample2regulators = dict()
+      for batch_start in range(0,len(samples),SAMPLE_BATCH):
+        batch = samples[batch_start:batch_start+SAMPLE_BATCH]
+        activation_scores, effect_target_counters, regulome_sizes, values, annotated = self.regulome_activity(batch,sign_matrix,regulome_matrix,targets)
+        for col, sample in enumerate(batch):
+          print('Finding regulators for %s sample (%d out of %d)' % (sample['Name'][0],batch_start+col+1,len(samples)))
+          sample_start = time.time()
+          abs_sample_distribution = sample.data['value'].abs()
+          abs_sample_distribution = abs_sample_distribution.dropna(how='all').to_numpy(dtype=float)
+          regulator_activation_scores = activation_scores[:,col]
+          target_values = np.where(annotated[:,col],np.abs(values[:,col]),np.nan)
+          has_nan_value = np.asarray(regulome_matrix @ (annotated[:,col] & np.isnan(values[:,col])).astype(float)) > 0
+          mv_pvalues = mannwhitneyu4sets(abs_sample_distribution,target_values,regulome_matrix,regulator_activation_scores > 0)
+          mv_pvalues[has_nan_value] = np.nan # mannwhitneyu propagates NaN in regulome values
+
+          new_prop_name = self.__sample_annotation(sample)
+          sample_regulator_uids = set()
+          for row in np.flatnonzero(mv_pvalues <= self.subnet_pvalue_cutoff):
+            regulator_uid = regulator_uids[row]
+            prp_value = [float(regulator_activation_scores[row]),float(mv_pvalues[row]),int(effect_target_counters[row,col])]
+            nx.set_node_attributes(my_graph, {regulator_uid:{new_prop_name:prp_value}})
+            sample_regulator_uids.add(regulator_uid)
+
+          sample_time = execution_time(sample_start)
+          print('Found %d regulators with pvalue < %.2f in %s'
+                  % (len(sample_regulator_uids),self.subnet_pvalue_cutoff,sample_time),flush=True)
+          sample2regulators[sample.name()] = sample_regulator_uids # must return uids and not PSObjects here 
+      return sample2regulators
+
+
+  def expression_regulators(self,regulomes=dict(),from_graph=ResnetGraph()):
       """
       input:
         samples from self.__my_sample_names__
@@ -329,10 +392,7 @@ class SNEA(APIcache):
       samples = self.experiment.get_samples(self.__my_sample_names__)
       my_regulomes = regulomes if regulomes else my_graph.regulome_dict(PROTEIN_TYPES,min_size=2)
 
-      for counter, sample in enumerate(samples):
-          print('Finding regulators for %s sample (%d out of %d)' % (sample['Name'][0],counter+1,len(samples)))
-          sample_regulators_uids = self.__regulators4sample(sample,my_regulomes,my_graph,prefix4target_annotation)
-          self.__regulators__[sample.name()] = sample_regulators_uids
+      self.__regulators__.update(self.__regulators4samples(samples,my_regulomes,my_graph))
 
       print('SNEA execution time: %s' % execution_time(start_time))
       return
@@ -431,15 +491,16 @@ class SNEA(APIcache):
     print('Finding drugs inhibiting differential expression for each sample')
     all_drugs = set()
     drug2proteins_regulomes = DPERNET4experiment.regulome_dict(['SmallMol'],min_size=2)
-    for sample in self.__my_samples():
-      drugs4sample = list() 
-      for drug_uid,targets in drug2proteins_regulomes.items():
-        drug_activation_score = self.activity(sample,drug_uid,targets,DPERNET4experiment)[0]
-        if drug_activation_score < 0:
-          drugs4sample.append(DPERNET4experiment._get_node(drug_uid))
-      
-      self.__sample2drugs__[sample.name()] = drugs4sample
-      all_drugs.update(drugs4sample)
+    drug_uids, targets, sign_matrix, regulome_matrix = self.regulome_matrix(drug2proteins_regulomes,DPERNET4experiment)
+    samples = self.__my_samples()
+    for batch_start in range(0,len(samples),SAMPLE_BATCH):
+      batch = samples[batch_start:batch_start+SAMPLE_BATCH]
+      drug_activation_scores = self.regulome_activity(batch,sign_matrix,regulome_matrix,targets)[0]
+      for col, sample in enumerate(batch):
+        with np.errstate(invalid='ignore'):
+          drugs4sample = [DPERNET4experiment._get_node(drug_uids[row]) for row in np.flatnonzero(drug_activation_scores[:,col] < 0)]
+        self.__sample2drugs__[sample.name()] = drugs4sample
+        all_drugs.update(drugs4sample)
     # to make sure all ranked targets are in self.Graph which is required by Drugs4Targets::load_target_ranks() 
     return all_drugs
 
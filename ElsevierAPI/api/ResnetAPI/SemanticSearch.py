@@ -1,4 +1,5 @@
-import time,math
+import time,math,os
+from concurrent.futures import ProcessPoolExecutor
 from .PathwayStudioGOQL import OQL
 from ..ResnetAPI.references import Reference, NODEWEIGHT, RELWEIGHT
 from ...utils.pandas.panda_tricks import np, pd, df,MAX_TAB_LENGTH
@@ -25,6 +26,53 @@ INPUT_WOKSHEET = 'Input'
 PHENOTYPE_WORKSHEET = 'Phenotype'
 TARGET_WEIGHT = 'target weight' # default name for the target node weight for relation reference count 
 REGULATOR_WEIGHT = 'regulator weight' # default name for the regulator node weight for relation reference count 
+LINK_PROCESSES_MIN_EDGES = 500000 # rows are linked to concepts in worker processes if connection graph has more edges
+LINK_PROCESSES_MIN_ROWS = 2000
+MAX_LINK_PROCESSES = os.cpu_count() or 1
+
+
+def _link_rows(rows:list[tuple],linker:dict)->tuple[list[tuple],set[int]]:
+  '''
+  input:
+    rows - [(df_index,[entity uids],number_of_children)]
+    linker - data prepared by SemanticSearch.__linker()
+  output:
+    [(df_index,linked concepts count,refcount,weighted refcount)] for rows linked to concepts, {ref_idx} for all references in linked rows
+  '''
+  node2rels = linker['node2rels']
+  all_refs = set()
+  results = list()
+  for idx, row_uids, number_of_children in rows:
+    if linker['linked'].isdisjoint(row_uids):
+      continue
+    row_rels = set()
+    [row_rels.update(node2rels.get(uid,[])) for uid in row_uids]
+    connected_nodes = set()
+    row_refs = set()
+    for rel_idx in row_rels:
+      connected_nodes.update(linker['rel_nodes'][rel_idx])
+      row_refs.update(linker['rel_refs'][rel_idx])
+
+    linked_concepts_count = len(connected_nodes.intersection(linker['concepts']))
+    ref_weights = [linker['ref_weight'][i] for i in row_refs]
+    scopus_score = max((linker['ref_score'][i] for i in row_refs),default=0.0)
+    row_score = float(sum(ref_weights)) * (1 + scopus_score/100)
+    connected_entities_count = len(connected_nodes.intersection(row_uids))
+    corrected_row_score = row_score * (1+connected_entities_count/number_of_children)  # boost by multiple component connectivity
+    corrected_row_score /= math.sqrt(number_of_children) # normalize by number of entity components
+    results.append((idx,linked_concepts_count,len(row_refs),corrected_row_score))
+    all_refs.update(row_refs)
+  return results, all_refs
+
+
+def _init_link_worker(linker:dict):
+  global _LINKER
+  _LINKER = linker
+
+
+def _link_rows_worker(rows:list[tuple]):
+  return _link_rows(rows,_LINKER)
+
 
 
 class SemanticSearch (APISession):
@@ -121,6 +169,7 @@ class SemanticSearch (APISession):
         new_session.add_rel_props([EFFECT])
       
       new_session.neo4j = self.neo4j
+      new_session.oql_cache = self.oql_cache
       # cloning is done to avoid adding irrelevant references to self.Graph to avoid in PS_Bibliography worksheet
       # therefore new_session.add2self is set to false
       return new_session
@@ -659,6 +708,70 @@ class SemanticSearch (APISession):
       return in_df
 
 
+  def __linker(self,connection_graph:ResnetGraph,concepts:list[PSObject])->dict:
+    '''
+    one pass over "connection_graph" to prepare data for _link_rows():
+      node2rels - {node_uid:[rel_idx]} for relations connecting node with concepts in any direction
+      linked - {node_uid} linked to concepts by self.__connect_by_rels__ with self.__rel_effect__ in self.__rel_dir__
+      rel_nodes - [{node_uid}] nodes connected by relation
+      rel_refs - [[ref_idx]] relation references
+      ref_weight, ref_score - [float] reference weight and 'Relation score' for ref_idx
+    loads:
+      references with NODEWEIGHT and RELWEIGHT like ResnetGraph.load_references and ResnetGraph.add_node_weight2ref.\n
+      Reference.set_weight keeps maximum weight, therefore reference weight is the maximum over all relations linking concepts in "connection_graph".
+      Before batching, weights were set on subgraph of every row and reference weight in a row depended on rows linked before it
+    '''
+    concepts_uids = set(ResnetGraph.uids(concepts))
+    rel_types, rel_effects = set(self.__connect_by_rels__), set(self.__rel_effect__)
+    node2rels = defaultdict(set)
+    linked = set()
+    rel2idx = dict()
+    for r, t, rel in connection_graph.edges.data('relation'):
+      is_concept_r, is_concept_t = r in concepts_uids, t in concepts_uids
+      if not (is_concept_r or is_concept_t): continue
+      rel_idx = rel2idx.setdefault(rel,len(rel2idx))
+      if is_concept_t: node2rels[r].add(rel_idx)
+      if is_concept_r: node2rels[t].add(rel_idx)
+      if (not rel_types or rel.objtype() in rel_types) and (not rel_effects or rel.effect() in rel_effects):
+        if is_concept_t and self.__rel_dir__ != '<': linked.add(r)
+        if is_concept_r and self.__rel_dir__ != '>': linked.add(t)
+
+    if self.postgres():
+      # references are fetched only for relations linking concepts
+      relation_ids = [ids[0] for rel in rel2idx if (ids := rel.get('RelationID'))]
+      relid2refs = self.postgres().load_refs(relation_ids)
+    else:
+      relid2refs = dict()
+    weight_prop, val2weight = next(iter(self.relprop2weight.items())) if self.relprop2weight else (None,None)
+    if self.ConceptsHaveWeights:
+      regulatorurn2weight = {o.urn():o.get_prop(REGULATOR_WEIGHT) for o in concepts}
+      targeturn2weight = {o.urn():o.get_prop(TARGET_WEIGHT) for o in concepts}
+      uid2urn = {uid:urns[0] for uid,urns in connection_graph.nodes(data='URN')}
+
+    ref2idx = dict()
+    rel_nodes, rel_refs = list(), list()
+    for rel in rel2idx:
+      pairs = rel.get_regulators_targets()
+      rel_nodes.append({uid for pair in pairs for uid in pair})
+      rel_refs.append([ref2idx.setdefault(ref,len(ref2idx)) for ref in rel.refs(relid2refs=relid2refs)])
+      if val2weight:
+        rel.set_weight2ref(weight_prop,val2weight,RELWEIGHT)
+      if self.ConceptsHaveWeights:
+        for r,t in pairs:
+          rel._set_weight2ref(regulatorurn2weight.get(uid2urn[r],0.0)+targeturn2weight.get(uid2urn[t],0.0),NODEWEIGHT)
+
+    ref_weight, ref_score = list(), list()
+    for ref in ref2idx:
+      weight = 1.0
+      if self.ConceptsHaveWeights: weight += ref.get_weight(NODEWEIGHT)
+      if self.relprop2weight: weight += ref.get_weight(RELWEIGHT)
+      ref_weight.append(weight)
+      ref_score.append(ref.get('Relation score',[0.0])[0])
+
+    return {'node2rels':{uid:list(rels) for uid,rels in node2rels.items()},'linked':linked,'concepts':concepts_uids,
+            'rel_nodes':rel_nodes,'rel_refs':rel_refs,'ref_weight':ref_weight,'ref_score':ref_score}
+
+
   def __link2concept(self,ConceptName:str,concepts:list[PSObject],to_entities:df|pd.DataFrame,
                      how2connect)->tuple[ResnetGraph,df]:
     """
@@ -701,67 +814,43 @@ class SemanticSearch (APISession):
         pass
 
     linked_row_count = 0
-    #linked_entities = set()
     start_time  = time.time()
     id_type = 'URN' if self.useNeo4j() else DBID
     connection_graph = self.connect(my_df,concepts, how2connect)
     if connection_graph.number_of_edges()>0:
       self.__annotate_rels(connection_graph, ConceptName)
-      ref_counter = set()
-      for idx in my_df.index:
-        entities_ids = set(my_df.at[idx,self.__temp_id_col__])
-        row_has_connection = False
-        row_entities = connection_graph.psobj_with_ids(entities_ids,id_type)
-        if row_entities:
-          if self.__rel_dir__ =='>':
-            row_has_connection = connection_graph.relation_exist(row_entities,concepts,
-                                          self.__connect_by_rels__,self.__rel_effect__,[],False)
-          elif self.__rel_dir__ =='<':
-            row_has_connection = connection_graph.relation_exist(concepts,row_entities,
-                                          self.__connect_by_rels__,self.__rel_effect__,[],False)
-          else:
-            row_has_connection = connection_graph.relation_exist(concepts,row_entities,
-                                          self.__connect_by_rels__,self.__rel_effect__,[],True)
+      linker = self.__linker(connection_graph,concepts)
+      id2uids = defaultdict(list) # nodes are matched by their first id like in ResnetGraph.psobj_with_ids
+      for uid, ids in connection_graph.nodes(data=id_type):
+        if ids: id2uids[ids[0]].append(uid)
 
-        if not row_has_connection:
-          continue
+      rows = list()
+      for idx in my_df.index:
+        entities_ids = list(my_df.at[idx,self.__temp_id_col__])
+        row_uids = set()
+        [row_uids.update(id2uids.get(i,[])) for i in set(entities_ids)]
+        if row_uids:
+          rows.append((idx,row_uids,len(entities_ids)))
+
+      if connection_graph.number_of_edges() >= LINK_PROCESSES_MIN_EDGES and len(rows) >= LINK_PROCESSES_MIN_ROWS:
+        chunk_size = math.ceil(len(rows)/(4*MAX_LINK_PROCESSES))
+        print(f'Linking {len(rows)} rows to "{ConceptName}" in {MAX_LINK_PROCESSES} processes')
+        with ProcessPoolExecutor(MAX_LINK_PROCESSES,initializer=_init_link_worker,initargs=(linker,)) as e:
+          chunks = e.map(_link_rows_worker,[rows[i:i+chunk_size] for i in range(0,len(rows),chunk_size)])
+          row_results, ref_counter = list(), set()
+          for chunk_results, chunk_refs in chunks:
+            row_results += chunk_results
+            ref_counter.update(chunk_refs)
+      else:
+        row_results, ref_counter = _link_rows(rows,linker)
 
-        row_subgraph = connection_graph.get_subgraph(row_entities, concepts)
-        connected_concepts_uids = [c for c in row_subgraph.nodes() if row_subgraph.degree(c) and c in concepts_uids]
-        my_df.at[idx,linked_count_column] = len(connected_concepts_uids) # used to calculate concept incidence at normalization step
+      for idx,linked_concepts_count,refcount,corrected_row_score in row_results:
+        my_df.at[idx,linked_count_column] = linked_concepts_count # used to calculate concept incidence at normalization step
         #it measures the occurence of concepts linked to row entities among all input concepts
-        references = list(row_subgraph.load_references(self.relprop2weight,postgres=self.postgres()))
-        # placeholder for possible future use of Scopus citation index:
-        # references = [self.RefStats.citation_index(r) for r in references]
-        ref_weights = [1.0]*len(references)
- 
-        if self.ConceptsHaveWeights: # add ref_nodeweights to ref_weights
-        # assumes concepts are annotated by REGULATOR_WEIGHT and/or TARGET_WEIGHT
-        # currently does not differentiate between regulators and targets because concepts can be upstream and downstream from entities
-          regulatorurn2weight = {o.urn():o.get_prop(REGULATOR_WEIGHT) for o in concepts}
-          targeturn2weight = {o.urn():o.get_prop(TARGET_WEIGHT) for o in concepts}
-          row_subgraph.add_node_weight2ref(regulatorurn2weight,targeturn2weight)
-          ref_nodeweights = [r.get_weight(NODEWEIGHT) for r in references]       
-          ref_weights = [x + y for x, y in zip(ref_weights, ref_nodeweights)]
-        
-        if self.relprop2weight:# add ref_relweights to ref_weights
-          ref_relweights = [r.get_weight(RELWEIGHT) for r in references]    
-          ref_weights = [x + y for x, y in zip(ref_weights, ref_relweights)]
-
-        scopus_score = max([x.get('Relation score',[0.0])[0] for x in references])
-        row_score = float(sum(ref_weights)) * (1 + scopus_score/100)
-
-        number_of_children = len(list(my_df.at[idx,self.__temp_id_col__]))
-        entities_uids = ResnetGraph.uids(row_entities)
-        connected_entities_count = len([c for c in row_subgraph.nodes() if row_subgraph.degree(c) and c in entities_uids])
-        corrected_row_score = row_score * (1+connected_entities_count/number_of_children)  # boost by multiple component connectivity
-        corrected_row_score /= math.sqrt(number_of_children) # normalize by number of entity components
         # correction by the number of connected concepts is done by self.normalize function
         my_df.at[idx,weighted_refcount_column] = corrected_row_score
-        my_df.at[idx,refcount_column] = len(references)
-        
-        ref_counter.update(references)
-        linked_row_count += 1
+        my_df.at[idx,refcount_column] = refcount
+      linked_row_count = len(row_results)
 
       effecStr = ','.join(self.__rel_effect__) if len(self.__rel_effect__)>0 else 'all'
       relTypeStr = ','.join(self.__connect_by_rels__) if len(self.__connect_by_rels__)>0 else 'all'
@@ -4,10 +4,71 @@ from .ResnetGraph import ResnetGraph,PSObject
 from ...utils.pandas.panda_tricks import df, pd,np
 from  .PathwayStudioZeepAPI import DataModel
 import scipy.stats as stats
+from scipy import sparse
+from scipy.special import ndtr
 from datetime import timedelta
 
 HAS_PVALUE = 'hasPvalue'
 ENSEMBL_ID = 'Ensembl ID'
+MWU_EXACT_MAX = 8 # mannwhitneyu uses exact distribution for smaller samples without ties
+
+
+def mannwhitneyu4sets(sample_values:np.ndarray,member_values:np.ndarray,membership:sparse.csr_matrix,
+                      greater:np.ndarray|bool=True)->np.ndarray:
+    '''
+    input:
+      sample_values - absolute values of sample distribution without NaN
+      member_values - absolute values of set members, NaN for members without value in sample
+      membership - sets x members matrix with nonzero value for every set member
+      greater - alternative hypothesis for every set: True if "greater", "less" otherwise
+    output:
+      p-values of stats.mannwhitneyu(set values,sample_values) for every set in "membership"
+      Sets without values have p-value NaN
+    '''
+    y = np.sort(sample_values)
+    n2 = len(y)
+    set_count = membership.shape[0]
+    greater = np.broadcast_to(greater,(set_count,))
+    valid = ~np.isnan(member_values)
+    left = np.searchsorted(y,member_values,'left')
+    y_ties = np.searchsorted(y,member_values,'right')-left
+    # U1 is the sum of member contributions: number of sample values smaller than member value + 1/2 of equal values
+    contribution = np.where(valid,left+0.5*y_ties,0.0)
+
+    pairs = membership.tocoo()
+    pair_valid = valid[pairs.col]
+    sets, members = pairs.row[pair_valid], pairs.col[pair_valid]
+    n1 = np.bincount(sets,minlength=set_count).astype(float)
+    U1 = np.bincount(sets,weights=contribution[members],minlength=set_count)
+
+    # tie correction for every set combined with sample distribution
+    _,y_counts = np.unique(y,return_counts=True)
+    y_tie_term = float(np.sum(y_counts**3.0-y_counts))
+    x = member_values[members]
+    order = np.lexsort((x,sets))
+    x, x_sets, x_members = x[order], sets[order], members[order]
+    run_starts = np.flatnonzero(np.r_[True,(x[1:] != x[:-1]) | (x_sets[1:] != x_sets[:-1])]) if len(x) else np.zeros(0,dtype=int)
+    run_lengths = np.diff(np.r_[run_starts,len(x)]).astype(float)
+    run_y_ties = y_ties[x_members[run_starts]].astype(float)
+    tie_change = (run_y_ties+run_lengths)**3-(run_y_ties+run_lengths)-(run_y_ties**3-run_y_ties)
+    tie_term = y_tie_term+np.bincount(x_sets[run_starts],weights=tie_change,minlength=set_count)
+
+    U = np.where(greater,U1,n1*n2-U1)
+    n = n1+n2
+    with np.errstate(invalid='ignore',divide='ignore'):
+        s = np.sqrt(n1*n2/12*((n+1)-tie_term/(n*(n-1))))
+        z = (U-n1*n2/2-0.5)/s
+    pvalues = np.clip(ndtr(-z),0.0,1.0)
+    pvalues[n1 == 0] = np.nan
+
+    # mannwhitneyu uses exact distribution for small sets without ties
+    exact = (n1 > 0) & ((n1 <= MWU_EXACT_MAX) | (n2 <= MWU_EXACT_MAX)) & (tie_term == 0)
+    for set_idx in np.flatnonzero(exact):
+        set_values = member_values[membership[set_idx].indices]
+        alternative = 'greater' if greater[set_idx] else 'less'
+        pvalues[set_idx] = stats.mannwhitneyu(x=set_values[~np.isnan(set_values)],y=y,alternative=alternative)[1]
+    return pvalues
+
 
 class Sample(PSObject):
 
@@ -68,6 +129,24 @@ class Sample(PSObject):
         return (oddsratio, ft_pvalue)
 
 
+    def fisher_exact4sets(self, de_counts:np.ndarray, measured_counts:np.ndarray, difexp_pval_cutoff=0.05):
+        """
+        batched version of Sample.fisher_exact for sets with "de_counts" differentially expressed members out of "measured_counts"
+        returns oddsratios, ft_pvalues arrays. Test is done once for every unique pair of counts
+        """
+        try:
+            de_sample_count = self['DEcount']
+        except KeyError:
+            de_sample_count = len(self.data.loc[(self.data['pvalue'] <= difexp_pval_cutoff)])
+            self['DEcount'] = de_sample_count
+
+        nonde_sample_count = len(self.data) - de_sample_count
+        count_pairs, inverse = np.unique(np.column_stack((de_counts,measured_counts-de_counts)).astype(int),axis=0,return_inverse=True)
+        results = np.array([stats.fisher_exact([[de, nonde], [de_sample_count, nonde_sample_count]]) for de,nonde in count_pairs],dtype=float).reshape(-1,2)
+        inverse = inverse.reshape(-1)
+        return results[inverse,0], results[inverse,1]
+
+
 class Experiment(PSObject):
     pass
     
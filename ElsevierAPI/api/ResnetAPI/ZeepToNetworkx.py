@@ -68,7 +68,12 @@ class PSNetworx(DataModel):
                 self.dbid2relation[dbid] = rel
             
         
-    def _load_graph(self, zeep_relations, zeep_objects, add2self=True, merge_data=False):
+    def _zeep2graph(self, zeep_relations, zeep_objects)->tuple[ResnetGraph,dict[int,PSRelation]]:
+        '''
+        output:
+          new ResnetGraph, {dbid:PSRelation} for relations in new graph\n
+          does not change self.Graph and can be called from multiple threads
+        '''
         new_graph = ResnetGraph()
         # loading entities and their properties
         id2psobj = self._zeep2psobj(zeep_objects)
@@ -125,15 +130,26 @@ class PSNetworx(DataModel):
                     
             [rel.refs() for rel in new_relations.values()]
             [new_graph.add_rel(rel,merge=False) for rel in new_relations.values()]
-            
+
+        return new_graph, new_relations
+
+
+    def _add2graph(self, new_graph:ResnetGraph, new_relations:dict[int,PSRelation], merge_data=False):
+        '''
+        adds graph made by _zeep2graph to self.Graph
+        '''
+        if merge_data:
+            self.Graph.add_graph(new_graph,merge=True)
+            self.__psrel2dict(new_relations)
+        else:
+            self.Graph = self.Graph.compose(new_graph)
+            self.dbid2relation.update(new_relations)
+
+
+    def _load_graph(self, zeep_relations, zeep_objects, add2self=True, merge_data=False):
+        new_graph, new_relations = self._zeep2graph(zeep_relations, zeep_objects)
         if add2self:
-            if merge_data:
-                self.Graph.add_graph(new_graph,merge=True)
-                self.__psrel2dict(new_relations)
-            else:
-                self.Graph = self.Graph.compose(new_graph)
-                self.dbid2relation.update(new_relations)
-        
+            self._add2graph(new_graph,new_relations,merge_data)
         return new_graph
 
 
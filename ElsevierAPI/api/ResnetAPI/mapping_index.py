@@ -0,0 +1,206 @@
+'''
+Reusable index mapping property values to database entities.
+Replaces {objtype:{propname:{propval:PSObject}}} dictionaries made by ResnetGraph._make_map.\n
+Property values are lowercased and normalized once when entities are added to index.
+Every (objtype,propname) map keeps {value:entity id}, where entity id is position of entity in MappingIndex.objects.
+Values shared by several entities keep ids of all entities in MappingIndex.shared.\n
+Index is saved to disk with pickle and can be loaded by other runs and processes instead of rebuilding it from entities
+'''
+import os,gc,pickle,time
+from .NetworkxObjects import PSObject
+from ...utils.utils import normalize,execution_time
+
+INDEX_EXTENSION = '.mapindex'
+INDEX_VERSION = 1
+NOT_FOUND = -1
+
+
+class MappingIndex:
+  '''
+  lookups return same entity as {objtype:{propname:{propval:PSObject}}} made by ResnetGraph._make_map from the same entities
+  '''
+  def __init__(self,using_props:list[str],from_nodes:list[PSObject]=[],norm=True):
+    '''
+    input:
+      norm - if True index also has normalize(value) keys for every lowercase value
+    '''
+    self.using_props = list(using_props)
+    self.norm = norm
+    self.objects = list() # [PSObject], entity id = position in list
+    self.maps = dict() # {(objtype,propname):{value:entity id}}
+    self.shared = dict() # {(objtype,propname):{value:[entity ids]}} for values of several entities
+    if from_nodes:
+      self.add(from_nodes)
+
+
+  def __len__(self):
+    return len(self.objects)
+
+
+  def __set(self,map_key:tuple[str,str],value:str,entity_id:int):
+    value2id = self.maps[map_key]
+    old_id = value2id.get(value,NOT_FOUND)
+    if old_id != NOT_FOUND and old_id != entity_id:
+      value2ids = self.shared.setdefault(map_key,dict()).setdefault(value,[old_id])
+      if entity_id not in value2ids:
+        value2ids.append(entity_id)
+    value2id[value] = entity_id
+
+
+  def add(self,nodes:list[PSObject]):
+    '''
+    adds "nodes" to index. Later nodes replace earlier nodes with the same value like in ResnetGraph._make_map.\n
+    Normalized values of earlier nodes can be taken by values of new nodes,
+    therefore if norm is True index is rebuilt from all entities to get same lookups as one ResnetGraph._make_map
+    '''
+    if self.norm and self.objects:
+      nodes = self.objects + list(nodes)
+      self.objects, self.maps, self.shared = list(), dict(), dict()
+
+    added_values = dict() # {(objtype,propname):[lowercase values]}
+    for n in nodes:
+      if 'protein:prophash' in n.urn(): continue
+      entity_id = len(self.objects)
+      self.objects.append(n)
+      objtype = n.objtype()
+      for prop in self.using_props:
+        vals = n.get_props(prop)
+        if not vals: continue
+        map_key = (objtype,prop)
+        self.maps.setdefault(map_key,dict())
+        for v in vals:
+          v = str(v).lower()
+          self.__set(map_key,v,entity_id)
+          added_values.setdefault(map_key,list()).append(v)
+
+    if self.norm:
+      for map_key,values in added_values.items():
+        value2id = self.maps[map_key]
+        owners = {v:value2id[v] for v in values}
+        for v,entity_id in owners.items():
+          self.__set(map_key,normalize(v),entity_id)
+    return self
+
+
+  def objtypes(self)->set[str]:
+    return {objtype for objtype,_ in self.maps.keys()}
+
+
+  def id4(self,objtype:str,prop:str,value:str,normalize_value=True)->int:
+    '''
+    output:
+      id of entity with "value" of "prop" in lowercase or in normalized form, NOT_FOUND if value is not in index
+    '''
+    value2id = self.maps.get((objtype,prop))
+    if value2id is None:
+      return NOT_FOUND
+    value = str(value)
+    entity_id = value2id.get(value.lower(),NOT_FOUND)
+    if entity_id == NOT_FOUND and normalize_value:
+      entity_id = value2id.get(normalize(value),NOT_FOUND)
+    return entity_id
+
+
+  def ids4(self,objtype:str,prop:str,values:list[str],normalize_values=True)->list[int]:
+    '''
+    output:
+      entity ids for every value in "values", NOT_FOUND for missing values
+    '''
+    value2id = self.maps.get((objtype,prop))
+    if value2id is None:
+      return [NOT_FOUND]*len(values)
+    values = [str(v) for v in values]
+    lowercase_ids = [value2id.get(v.lower(),NOT_FOUND) for v in values]
+    if not normalize_values:
+      return lowercase_ids
+    return [i if i != NOT_FOUND else value2id.get(normalize(v),NOT_FOUND) for i,v in zip(lowercase_ids,values)]
+
+
+  def get(self,objtype:str,prop:str,value:str,normalize_value=True)->PSObject|None:
+    entity_id = self.id4(objtype,prop,value,normalize_value)
+    return None if entity_id == NOT_FOUND else self.objects[entity_id]
+
+
+  def values2objs(self,values:list[str],props:list[str],objtypes:list[str]=[])->dict[str,list[PSObject]]:
+    '''
+    input:
+      objtypes - if empty "values" are searched in all object types
+    output:
+      {value:[PSObject]} for values found in "props" of entities with "objtypes"
+    '''
+    value2ids = dict()
+    values = list(values)
+    for objtype in (objtypes if objtypes else sorted(self.objtypes())):
+      for prop in props:
+        map_key = (objtype,prop)
+        value2id = self.maps.get(map_key)
+        if value2id is None: continue
+        shared = self.shared.get(map_key,dict())
+        for value in values:
+          lower = str(value).lower()
+          key = lower if lower in value2id else normalize(str(value))
+          if key in value2id:
+            ids = value2ids.setdefault(value,list())
+            ids += [i for i in shared.get(key,[value2id[key]]) if i not in ids]
+    return {value:[self.objects[i] for i in ids] for value,ids in value2ids.items()}
+
+
+  def remap(self,psobj:PSObject,map_by:list[str],normalize_propvalues=True)->bool:
+    '''
+    same as PSObject.remap with {objtype:{propname:{propval:PSObject}}} dictionary
+    output:
+      if URN is remapped psobj['URN'] = [newURN,oldURN] and psobj is flagged by 'was_mapped' property
+    '''
+    objtype = psobj.objtype()
+    for prop in map_by:
+      for val in psobj.get_props(prop):
+        entity_id = self.id4(objtype,prop,str(val),normalize_propvalues)
+        if entity_id != NOT_FOUND:
+          new_urn = self.objects[entity_id].urn()
+          old_urn = psobj.urn()
+          if new_urn != old_urn:
+            psobj['URN'] = [new_urn,old_urn]
+          psobj['was_mapped'] = [True]
+          return True
+    return False
+
+
+  def save(self,path:str):
+    '''
+    writes index to temporary file first to not corrupt index read by other processes
+    '''
+    if not path.endswith(INDEX_EXTENSION):
+      path += INDEX_EXTENSION
+    start = time.time()
+    dump = {'version':INDEX_VERSION,'using_props':self.using_props,'norm':self.norm,
+            'objects':self.objects,'maps':self.maps,'shared':self.shared}
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path,'wb') as f:
+      pickle.dump(dump,f,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path,path)
+    print(f'Mapping index with {len(self.objects)} entities was saved to {path} in {execution_time(start)}')
+
+
+  @classmethod
+  def load(cls,path:str)->"MappingIndex":
+    '''
+    raises FileNotFoundError if index does not exist and ValueError if index was made by other version of MappingIndex
+    '''
+    if not path.endswith(INDEX_EXTENSION):
+      path += INDEX_EXTENSION
+    start = time.time()
+    gc_enabled = gc.isenabled()
+    gc.disable() # garbage collection triggered by millions of new containers makes unpickling several times slower
+    try:
+      with open(path,'rb') as f:
+        dump = pickle.load(f)
+    finally:
+      if gc_enabled: gc.enable()
+    if dump.get('version') != INDEX_VERSION:
+      raise ValueError(f'{path} was made by different version of MappingIndex')
+    index = cls(dump['using_props'],norm=dump['norm'])
+    index.objects = dump['objects']
+    index.maps = dump['maps']
+    index.shared = dump['shared']
+    print(f'Mapping index with {len(index.objects)} entities was loaded from {path} in {execution_time(start)}')
+    return index
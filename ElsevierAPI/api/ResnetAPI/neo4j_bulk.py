@@ -0,0 +1,121 @@
+'''
+Bulk loading of ResnetGraph into Neo4j used by nx2neo4j.load_graph_bulk.\n
+Nodes are grouped by label and relations by (type,regulator label,target label).\n
+Every group is sent as parameterized "UNWIND $rows" statements with NEO4J_BATCH rows instead of one statement per node or relation.\n
+Failed batches are retried NEO4J_RETRIES times with exponential backoff
+'''
+import time
+from collections import defaultdict
+from neo4j.exceptions import Neo4jError,ServiceUnavailable,SessionExpired
+from .ResnetGraph import ResnetGraph,PSObject,PSRelation
+from ...utils.utils import execution_time
+
+
+NEO4J_BATCH = 10000 # rows per UNWIND statement
+NEO4J_RETRIES = 3
+NEO4J_BACKOFF = 2.0 # seconds before first retry, doubled for every next retry
+ENT_PROPS = ['URN','Name','Description']
+REL_PROPS = ['Name','Effect','Mechanism','Source','TextRef']
+
+
+def _label(name:str)->str:
+  return '`'+name.replace('`','``')+'`'
+
+
+def node_rows(nodes:list[PSObject])->dict[str,list[dict]]:
+  '''
+  output:
+    {label:[{prop:value}]}
+  '''
+  label2rows = defaultdict(list)
+  for n in nodes:
+    label2rows[n.objtype()].append({k:v[0] for k,v in n.items() if k in ENT_PROPS and v})
+  return dict(label2rows)
+
+
+def relation_rows(resnet:ResnetGraph)->dict[tuple[str,str,str],list[dict]]:
+  '''
+  output:
+    {(relation type,regulator label,target label):[{'r':regulator URN,'t':target URN,'props':{prop:value}}]}
+  '''
+  key2rows = defaultdict(list)
+  for r,t,rel in resnet.iterate():
+    assert isinstance(rel,PSRelation)
+    props = {k.replace(':',' '):v[0] for k,v in rel.items() if k in REL_PROPS and v}
+    props['RefCount'] = rel.count_refs()
+    props['AbstractCount'] = rel.count_refs(count_abstracts=True)
+    key2rows[(rel.objtype(),r.objtype(),t.objtype())].append({'r':r.urn(),'t':t.urn(),'props':props})
+  return dict(key2rows)
+
+
+def node_cypher(label:str)->str:
+  # MERGE keeps nodes already present in database
+  return f'UNWIND $rows AS row MERGE (n:{_label(label)} {{URN:row.URN}}) SET n += row'
+
+
+def relation_cypher(reltype:str,regulator_label:str,target_label:str)->str:
+  return (f'UNWIND $rows AS row MATCH (a:{_label(regulator_label)} {{URN:row.r}}) '
+          f'MATCH (b:{_label(target_label)} {{URN:row.t}}) '
+          f'CREATE (a)-[r:{_label(reltype)}]->(b) SET r = row.props')
+
+
+def index_cypher(label:str)->str:
+  return f'CREATE INDEX IF NOT EXISTS FOR (n:{_label(label)}) ON (n.URN)'
+
+
+def run_batches(session_factory,cypher:str,rows:list[dict],batch_size=NEO4J_BATCH,retries=NEO4J_RETRIES)->tuple[int,int]:
+  '''
+  input:
+    session_factory - function returning neo4j.Session
+  output:
+    loaded rows, failed rows
+  '''
+  loaded,failed = 0,0
+  with session_factory() as session:
+    for i in range(0,len(rows),batch_size):
+      batch = rows[i:i+batch_size]
+      for attempt in range(retries+1):
+        try:
+          session.execute_write(lambda tx: tx.run(cypher,rows=batch).consume())
+          loaded += len(batch)
+          break
+        except (Neo4jError,ServiceUnavailable,SessionExpired) as e:
+          if attempt == retries:
+            print(f'Batch of {len(batch)} rows failed after {retries} retries: {e}')
+            failed += len(batch)
+          else:
+            time.sleep(NEO4J_BACKOFF*2**attempt)
+  return loaded,failed
+
+
+def load_graph(session_factory,resnet:ResnetGraph,batch_size=NEO4J_BATCH,retries=NEO4J_RETRIES)->tuple[int,int]:
+  '''
+  input:
+    session_factory - function returning neo4j.Session
+  output:
+    number of loaded nodes, number of loaded relations
+  '''
+  start = time.time()
+  label2rows = node_rows(resnet._get_nodes())
+  with session_factory() as session:
+    for label in label2rows:
+      session.run(index_cypher(label)).consume()
+
+  node_count = 0
+  for label,rows in label2rows.items():
+    label_start = time.time()
+    loaded,failed = run_batches(session_factory,node_cypher(label),rows,batch_size,retries)
+    node_count += loaded
+    print(f'{loaded} {label} nodes were loaded in {execution_time(label_start)} ({loaded/max(time.time()-label_start,1e-6):.0f} nodes/s), {failed} failed')
+
+  rel_start = time.time()
+  rel_count = 0
+  for (reltype,regulator_label,target_label),rows in relation_rows(resnet).items():
+    loaded,failed = run_batches(session_factory,relation_cypher(reltype,regulator_label,target_label),rows,batch_size,retries)
+    rel_count += loaded
+    if failed:
+      print(f'{failed} {regulator_label}-{reltype}->{target_label} relations failed to load')
+  rel_time = max(time.time()-rel_start,1e-6)
+  print(f'{rel_count} relations were loaded in {execution_time(rel_start)} ({rel_count/rel_time:.0f} relations/s)')
+  print(f'Graph with {node_count} nodes and {rel_count} relations was loaded into Neo4j in {execution_time(start)}')
+  return node_count,rel_count
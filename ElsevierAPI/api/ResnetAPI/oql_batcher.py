@@ -0,0 +1,183 @@
+'''
+Adaptive batching of GOQL queries iterating long lists of identifiers used by APISession.__iterate__ and __iterate2__.\n
+OQLbatcher cuts identifier lists into chunks right before sending them to server.
+ChunkSizer chooses chunk size from seconds and results per identifier observed in finished chunks
+to keep every request close to OQL_TARGET_SECONDS and OQL_TARGET_RESULTS.\n
+Chunks run in worker threads with one reusable session per thread.
+run_chunk must not accumulate results in session to keep cost of every chunk independent from number of chunks run by session.
+Number of GOQL requests running at once in all sessions of the process is limited by OQL_BUDGET.\n
+Chunks failed with transport error, timeout or connection error are split in half and sent again.
+Server faults, such as errors in GOQL query, are raised immediately
+'''
+import time,threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from zeep import exceptions
+import requests.exceptions as req_exceptions
+from .ResnetGraph import ResnetGraph
+from ...utils.utils import execution_time
+
+
+OQL_CONNECTIONS = 25 # same as MAX_SESSIONS. By default sessions_max=200 in Oracle
+OQL_MAX_IDS = 1000 # max number of identifiers in one GOQL list
+OQL_MIN_IDS = 10 # chunks with less identifiers are not split after failure
+OQL_TARGET_SECONDS = 30.0
+OQL_TARGET_RESULTS = 20000 # 20 result pages
+OQL_EWMA = 0.3 # weight of the last chunk in seconds and results per identifier
+OQL_BUDGET = threading.BoundedSemaphore(OQL_CONNECTIONS)
+
+
+class ChunkSizer:
+  '''
+  thread-safe estimator of chunk size
+  '''
+  def __init__(self,first_size:int,max_size=OQL_MAX_IDS,min_size=OQL_MIN_IDS,
+               target_seconds=OQL_TARGET_SECONDS,target_results=OQL_TARGET_RESULTS):
+    self.max_size = max(1,min(max_size,OQL_MAX_IDS))
+    self.min_size = min(min_size,self.max_size)
+    self.first_size = max(self.min_size,min(first_size,self.max_size))
+    self.target_seconds = target_seconds
+    self.target_results = target_results
+    self.seconds_per_id = 0.0
+    self.results_per_id = 0.0
+    self.observations = 0
+    self.lock = threading.Lock()
+
+
+  def observe(self,id_count:int,seconds:float,result_count:int):
+    with self.lock:
+      seconds_per_id = seconds/id_count
+      results_per_id = result_count/id_count
+      if self.observations:
+        self.seconds_per_id += OQL_EWMA*(seconds_per_id-self.seconds_per_id)
+        self.results_per_id += OQL_EWMA*(results_per_id-self.results_per_id)
+      else:
+        self.seconds_per_id = seconds_per_id
+        self.results_per_id = results_per_id
+      self.observations += 1
+
+
+  def failed(self,id_count:int):
+    '''
+    chunks as large as failed chunk are not sent again
+    '''
+    with self.lock:
+      self.max_size = max(self.min_size,min(self.max_size,id_count//2))
+
+
+  def size(self)->int:
+    with self.lock:
+      if not self.observations:
+        return min(self.first_size,self.max_size)
+      size = self.target_seconds/max(self.seconds_per_id,1e-6)
+      if self.results_per_id > 0.0:
+        size = min(size,self.target_results/self.results_per_id)
+      return int(max(self.min_size,min(size,self.max_size)))
+
+
+class OQLbatcher:
+  '''
+  runs GOQL query templates with "{ids}" placeholder for lists of identifiers
+  '''
+  def __init__(self,session_factory,max_workers:int,sizer:ChunkSizer,budget=OQL_BUDGET):
+    '''
+    input:
+      session_factory - function returning new APISession. Every worker thread uses one session
+    '''
+    self.session_factory = session_factory
+    self.max_workers = max(1,max_workers)
+    self.sizer = sizer
+    self.budget = budget
+    self.sessions = list() # sessions created by worker threads
+    self.__local = threading.local()
+    self.__lock = threading.Lock()
+
+
+  def __session(self):
+    try:
+      return self.__local.session
+    except AttributeError:
+      session = self.session_factory()
+      self.__local.session = session
+      with self.__lock:
+        self.sessions.append(session)
+      return session
+
+
+  def __run_chunk(self,run_chunk,template:str,ids:list,chunk_name:str):
+    session = self.__session()
+    with self.budget:
+      start = time.time()
+      graph = run_chunk(session,template,ids,chunk_name)
+      seconds = time.time()-start
+    result_count = graph.number_of_nodes()+graph.number_of_edges() if isinstance(graph,ResnetGraph) else 0
+    self.sizer.observe(len(ids),seconds,result_count)
+    return graph
+
+
+  def run(self,jobs:list[tuple[str,list]],run_chunk,request_name='',merge=True)->ResnetGraph:
+    '''
+    input:
+      jobs - [(template,ids)], template has "{ids}" placeholder for chunk of ids
+      run_chunk - function(session,template,ids_chunk,chunk_name) returning ResnetGraph or None
+      merge - if True graphs returned by run_chunk are merged in place into one graph
+    output:
+      merged graph
+    '''
+    queue = deque((template,list(ids)) for template,ids in jobs if ids)
+    id_count = sum(len(ids) for _,ids in queue)
+    entire_graph = ResnetGraph()
+    future2chunk = dict()
+    done_ids = 0
+    chunk_count = 0
+    report_every = max(1,id_count//10)
+    next_report = report_every
+    start = time.time()
+
+    def next_chunk():
+      template,ids = queue[0]
+      size = self.sizer.size()
+      if len(ids) <= size:
+        queue.popleft()
+        return template,ids
+      queue[0] = (template,ids[size:])
+      return template,ids[:size]
+
+    with ThreadPoolExecutor(self.max_workers,thread_name_prefix=request_name[:30]) as e:
+      def submit():
+        nonlocal chunk_count
+        while queue and len(future2chunk) < self.max_workers:
+          template,ids = next_chunk()
+          chunk_count += 1
+          chunk_name = f'Chunk #{chunk_count} with {len(ids)} ids for "{request_name}"'
+          future2chunk[e.submit(self.__run_chunk,run_chunk,template,ids,chunk_name)] = (template,ids)
+
+      submit()
+      try:
+        while future2chunk:
+          done,_ = wait(future2chunk,return_when=FIRST_COMPLETED)
+          for future in done:
+            template,ids = future2chunk.pop(future)
+            try:
+              graph = future.result()
+            except (exceptions.TransportError,req_exceptions.Timeout,req_exceptions.ConnectionError) as error:
+              if len(ids) <= self.sizer.min_size:
+                raise error
+              print(f'Chunk with {len(ids)} ids for "{request_name}" failed with "{error}". Will retry it in two halves',flush=True)
+              self.sizer.failed(len(ids))
+              half = len(ids)//2
+              queue.appendleft((template,ids[half:]))
+              queue.appendleft((template,ids[:half]))
+              continue
+
+            if merge and isinstance(graph,ResnetGraph):
+              entire_graph.compose_inplace(graph)
+            done_ids += len(ids)
+            if done_ids >= next_report or (not queue and not future2chunk):
+              next_report += report_every
+              print(f'"{request_name}": {done_ids} of {id_count} ids processed in {execution_time(start)} by {chunk_count} chunks, next chunk size {self.sizer.size()}',flush=True)
+          submit()
+      except BaseException:
+        [f.cancel() for f in future2chunk]
+        raise
+    return entire_graph
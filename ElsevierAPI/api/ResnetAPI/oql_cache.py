@@ -0,0 +1,140 @@
+'''
+Persistent on-disk cache for results of OQL queries used by APISession.process_oql.\n
+Cache key is md5 of database URL, normalized OQL query, retrieved entity and relation properties and type of returned objects.\n
+Query results are stored as graph snapshots (see snapshot.py) named <key>.rnsnap in cache directory.\n
+File modification time is the time of retrieval and is used to expire entries older than "ttl" seconds.\n
+File access time is updated on every cache hit and used to delete least recently used entries when cache size exceeds "max_size"
+'''
+import os,re,time,json,hashlib,threading
+from .ResnetGraph import ResnetGraph,PSRelation
+from .snapshot import SNAPSHOT_EXT
+
+
+OQL_CACHE_TTL = 30*24*3600 # seconds. Database is updated monthly
+OQL_CACHE_SIZE = 2*1024**3 # bytes
+OQL_CACHE_EVICT2 = 0.8 # eviction deletes least recently used entries until cache size is below OQL_CACHE_EVICT2*max_size
+QUOTED = re.compile(r"('[^']*'|\"[^\"]*\")")
+WHITESPACE = re.compile(r'\s+')
+
+
+class OQLcache:
+  '''
+  thread-safe cache shared by APISession and its clones
+  '''
+  def __init__(self,cache_dir:str,ttl:int=OQL_CACHE_TTL,max_size:int=OQL_CACHE_SIZE):
+    self.cache_dir = cache_dir
+    os.makedirs(cache_dir,exist_ok=True)
+    self.ttl = ttl
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.size = sum(e.stat().st_size for e in self.__entries())
+
+
+  def __entries(self):
+    return [e for e in os.scandir(self.cache_dir) if e.is_file() and e.name.endswith(SNAPSHOT_EXT)]
+
+
+  def __path(self,key:str):
+    return os.path.join(self.cache_dir,key+SNAPSHOT_EXT)
+
+
+  @staticmethod
+  def normalize(oql:str)->str:
+    '''
+    output:
+      oql with collapsed whitespace outside of quoted property values
+    '''
+    parts = QUOTED.split(oql.strip())
+    # odd parts are quoted values
+    return ''.join(p if i%2 else WHITESPACE.sub(' ',p) for i,p in enumerate(parts))
+
+
+  @staticmethod
+  def key(oql:str,ent_props:list[str],rel_props:list[str],get_links:bool,database:str='')->str:
+    '''
+    input:
+      database - server URL or other database identifier to separate results of sessions sharing cache directory
+    '''
+    spec = [database,OQLcache.normalize(oql),sorted(set(ent_props)),sorted(set(rel_props)),get_links]
+    return hashlib.md5(json.dumps(spec).encode('utf-8')).hexdigest()
+
+
+  def get(self,key:str)->ResnetGraph|None:
+    '''
+    output:
+      cached graph or None if key is not in cache or entry has expired
+    '''
+    path = self.__path(key)
+    try:
+      stat = os.stat(path)
+      if time.time()-stat.st_mtime > self.ttl:
+        self.__remove(path)
+        self.misses += 1
+        return None
+      graph = ResnetGraph.fromSnapshot(path,no_mess=True)
+      os.utime(path,(time.time(),stat.st_mtime)) # marks entry as recently used
+      self.hits += 1
+      return graph
+    except (FileNotFoundError,ValueError):
+      self.misses += 1
+      return None
+
+
+  def put(self,key:str,graph:ResnetGraph,oql:str):
+    path = self.__path(key)
+    try:
+      old_size = os.path.getsize(path) # overwritten entry
+    except FileNotFoundError:
+      old_size = 0
+    try:
+      graph.dump2snapshot(path,params={'oql':oql},no_mess=True)
+    except TypeError:
+      return # graphs with values not supported by snapshot are not cached to keep cache hits identical to database results
+    with self.lock:
+      self.size += os.path.getsize(path)-old_size
+    if self.size > self.max_size:
+      self.evict()
+
+
+  def __remove(self,path:str):
+    try:
+      size = os.path.getsize(path)
+      os.remove(path)
+      with self.lock:
+        self.size -= size
+    except FileNotFoundError:
+      pass
+
+
+  def evict(self):
+    '''
+    deletes expired entries and least recently used entries until cache size is below OQL_CACHE_EVICT2*max_size
+    '''
+    with self.lock:
+      entries = [(e.path,e.stat()) for e in self.__entries()]
+      entries.sort(key=lambda x:x[1].st_atime)
+      now = time.time()
+      cache_size = sum(s.st_size for _,s in entries)
+      for path,stat in entries:
+        if cache_size <= OQL_CACHE_EVICT2*self.max_size and now-stat.st_mtime <= self.ttl:
+          continue
+        try:
+          os.remove(path)
+          cache_size -= stat.st_size
+        except FileNotFoundError:
+          continue
+      self.size = cache_size
+
+
+  def clear(self):
+    with self.lock:
+      for e in self.__entries():
+        os.remove(e.path)
+      self.size = 0
+
+
+  @staticmethod
+  def dbid2rel(graph:ResnetGraph)->dict[int,PSRelation]:
+    return {r.dbid():r for _,_,r in graph.edges.data('relation')}
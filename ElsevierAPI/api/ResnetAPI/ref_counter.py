@@ -0,0 +1,158 @@
+'''
+Columnar store of reference statistics used by RefStats instead of {(id_type,identifier):(ref,count)} dictionary.\n
+Every (id_type,identifier) document key is interned into position of reference in RefCounter columns.
+Columns keep reference, its count and sum of its relevance scores.
+Bibliography strings and identifier hyperlinks are made once per reference when DataFrame is generated first time.\n
+RefCounters filled by cloned RefStats in worker threads are combined with RefCounter.merge()
+'''
+import numpy as np
+from .references import Reference,pubmed_hyperlink,make_hyperlink,pmc_hyperlink,pii_hyperlink,DOI_URL
+
+CLINICALTRIAL_URL = 'https://clinicaltrials.gov/ct2/show/'
+IDTYPE2HYPERLINK = {
+  'PMID': lambda identifier: pubmed_hyperlink([identifier],identifier),
+  'DOI': lambda identifier: make_hyperlink(identifier,DOI_URL),
+  'PMC': lambda identifier: pmc_hyperlink([identifier],identifier),
+  'PII': lambda identifier: pii_hyperlink(identifier,identifier),
+  'NCT ID': lambda identifier: make_hyperlink(identifier,CLINICALTRIAL_URL)
+}
+
+
+def identifier_hyperlink(id_type:str,identifier:str)->str:
+  '''
+  output:
+    Excel hyperlink for identifiers with id_type in IDTYPE2HYPERLINK, otherwise identifier
+  '''
+  make_link = IDTYPE2HYPERLINK.get(id_type)
+  return make_link(identifier) if make_link else identifier
+
+
+def log_scores(values:np.ndarray,scale=100.0)->np.ndarray:
+  '''
+  output:
+    log10("values") normalized between 0 and "scale". Values <= 0 get score 0
+  '''
+  scores = np.zeros(len(values),dtype=float)
+  positive = values > 0.0
+  if not positive.any():
+    return scores
+  logs = np.log10(values[positive])
+  min_log = logs.min()
+  maxmin = logs.max() - min_log
+  scores[positive] = scale*(logs-min_log)/maxmin if maxmin > 0.0 else scale
+  return scores
+
+
+class RefCounter:
+  '''
+  columns:
+    refs - [Reference], last reference added for document key
+    counts - [int], number of times document key was added
+    relevances - [float], sum of Reference.relevance() of all added references
+  '''
+  def __init__(self):
+    self.key2pos = dict() # {(id_type,identifier):position in columns}
+    self.refs = list()
+    self.counts = list()
+    self.relevances = list()
+    self.__biblios = dict() # {position:biblio_str} made by biblios()
+    self.__links = dict() # {position:identifier hyperlink} made by hyperlinks()
+
+
+  def __len__(self):
+    return len(self.refs)
+
+
+  def __contains__(self,doc_key:tuple[str,str]):
+    return doc_key in self.key2pos
+
+
+  def __add(self,doc_key:tuple[str,str],ref:Reference,count:int,relevance:float):
+    pos = self.key2pos.get(doc_key)
+    if pos is None:
+      self.key2pos[doc_key] = len(self.refs)
+      self.refs.append(ref)
+      self.counts.append(count)
+      self.relevances.append(relevance)
+    else:
+      if self.refs[pos] is not ref:
+        self.refs[pos] = ref
+        self.__biblios.pop(pos,None)
+      self.counts[pos] += count
+      self.relevances[pos] += relevance
+
+
+  def add(self,ref:Reference,count=1,relevance:float|None=None):
+    '''
+    input:
+      relevance - defaults to ref.relevance()
+    '''
+    self.__add(ref.get_doc_id(),ref,count,ref.relevance() if relevance is None else relevance)
+
+
+  def add_refs(self,refs:list[Reference]):
+    '''
+    adds every reference in "refs" with count 1 and its ref.relevance()
+    '''
+    [self.__add(ref.get_doc_id(),ref,1,ref.relevance()) for ref in refs]
+    return self
+
+
+  def merge(self,other:"RefCounter"):
+    '''
+    adds counts and relevances from "other". References from "other" replace references with the same document key
+    '''
+    [self.__add(doc_key,ref,count,relevance) for doc_key,ref,count,relevance in 
+     zip(other.key2pos.keys(),other.refs,other.counts,other.relevances)]
+    return self
+
+
+  def keys(self):
+    return self.key2pos.keys()
+
+
+  def values(self)->list[tuple[Reference,int]]:
+    return list(zip(self.refs,self.counts))
+
+
+  def items(self)->list[tuple[tuple[str,str],tuple[Reference,int]]]:
+    return list(zip(self.key2pos.keys(),zip(self.refs,self.counts)))
+
+
+  def references(self)->set[Reference]:
+    return set(self.refs)
+
+
+  def scores(self,use_relevance=True)->np.ndarray:
+    '''
+    output:
+      if use_relevance - log10(relevance*count) normalized between 0 and 100, otherwise counts
+    '''
+    counts = np.asarray(self.counts,dtype=np.int64)
+    if not use_relevance:
+      return counts
+    return log_scores(np.asarray(self.relevances,dtype=float)*counts)
+
+
+  def biblios(self)->list[str]:
+    if len(self.__biblios) < len(self.refs):
+      for pos,ref in enumerate(self.refs):
+        if pos not in self.__biblios:
+          self.__biblios[pos] = ref._biblio_tuple()[0]
+    return [self.__biblios[pos] for pos in range(len(self.refs))]
+
+
+  def id_types(self)->list[str]:
+    return [id_type for id_type,_ in self.key2pos.keys()]
+
+
+  def hyperlinks(self)->list[str]:
+    if len(self.__links) < len(self.refs):
+      for (id_type,identifier),pos in self.key2pos.items():
+        if pos not in self.__links:
+          self.__links[pos] = identifier_hyperlink(id_type,identifier)
+    return [self.__links[pos] for pos in range(len(self.refs))]
+
+
+  def pubyears(self)->list[int]:
+    return [ref.pubyear() for ref in self.refs]
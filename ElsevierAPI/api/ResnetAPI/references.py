@@ -179,6 +179,27 @@ class Reference(dict):
     # PropID:{Values} = defaultdict(set)
 
 
+  def __reduce__(self):
+    '''
+    makes Reference picklable to pass it between processes: 
+    self.snippets has lambda default_factory and is pickled as plain dict
+    '''
+    state = dict(self.__dict__)
+    state['snippets'] = {textref:dict(props) for textref,props in self.snippets.items()}
+    return (Reference._unpickle,(type(self),dict(self),state))
+
+
+  @staticmethod
+  def _unpickle(cls,props:dict,state:dict):
+    ref = cls.__new__(cls)
+    dict.update(ref,props)
+    snippets = state.pop('snippets')
+    ref.__dict__.update(state)
+    ref.snippets = defaultdict(lambda: defaultdict(set))
+    [ref.snippets[textref].update(props) for textref,props in snippets.items()]
+    return ref
+
+
   def copy_ref(self):
       '''
       Return
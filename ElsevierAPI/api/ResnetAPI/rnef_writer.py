@@ -0,0 +1,184 @@
+'''
+Streaming writer for RNEF dump files used by APISession.\n
+<resnet> sections are serialized by lxml.etree.xmlfile into RNEFwriter sink.\n
+Sink buffers serialized XML and passes it to background thread that compresses it and writes to disk.\n
+Dump files are compressed if their name ends with ".gz" (gzip) or ".zst" (zstd, requires zstandard package).\n
+Use open_rnef() to read compressed and uncompressed RNEF files transparently
+'''
+import os,gzip,queue,atexit,weakref,threading
+from contextlib import ExitStack
+from lxml import etree as et
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+
+GZIP,ZSTD = 'gzip','zstd'
+COMPRESSION2EXT = {'':'',GZIP:'.gz',ZSTD:'.zst'}
+RNEF_EXTENSIONS = ['.rnef'+ext for ext in COMPRESSION2EXT.values()]
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+RNEF_WRITE_BUFFER = 4*1024**2 # bytes passed to writer thread at once
+RNEF_WRITE_QUEUE = 16 # max number of buffers waiting for writer thread. Serialization blocks when queue is full
+OPEN_WRITERS = weakref.WeakSet()
+
+
+def compression4(path:str)->str:
+  '''
+  output:
+    compression of file from its magic number if file exists, from its extension otherwise
+  '''
+  try:
+    with open(path,'rb') as f:
+      magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC): return GZIP
+    if magic == ZSTD_MAGIC: return ZSTD
+    if magic: return ''
+  except FileNotFoundError:
+    pass
+  if path.endswith(COMPRESSION2EXT[GZIP]): return GZIP
+  if path.endswith(COMPRESSION2EXT[ZSTD]): return ZSTD
+  return ''
+
+
+def open_rnef(path:str,mode='rb'):
+  '''
+  input:
+    mode - 'rb','wb' or 'ab'
+  output:
+    binary file object that compresses or decompresses data according to compression4(path)
+  '''
+  compression = compression4(path)
+  if compression == GZIP:
+    return gzip.open(path,mode,compresslevel=6)
+  elif compression == ZSTD:
+    if zstandard is None:
+      raise ImportError(f'zstandard package is required to read or write {path}')
+    raw = open(path,mode)
+    if mode == 'rb':
+      # appended dump files consist of several zstd frames
+      return zstandard.ZstdDecompressor().stream_reader(raw,read_across_frames=True,closefd=True)
+    return zstandard.ZstdCompressor(level=3).stream_writer(raw,closefd=True)
+  return open(path,mode)
+
+
+def has_closing_batch_tag(path:str)->bool:
+  '''
+  output:
+    True if RNEF file ends with </batch>. Compressed files are decompressed to find their end
+  '''
+  tail = b''
+  try:
+    with open_rnef(path,'rb') as f:
+      if compression4(path):
+        while chunk := f.read(RNEF_WRITE_BUFFER):
+          tail = (tail+chunk)[-64:]
+      else:
+        f.seek(0,os.SEEK_END)
+        f.seek(max(0,f.tell()-64))
+        tail = f.read()
+  except FileNotFoundError:
+    return False # directory has no RNEF
+  return tail.rstrip().endswith(b'</batch>')
+
+
+class RNEFwriter:
+  '''
+  thread-safe sink for one RNEF dump file. New file is opened with <batch> element that is closed by RNEFwriter.close()
+  '''
+  def __init__(self,path:str,append=False):
+    '''
+    input:
+      append - continue writing into unfinished dump file without <batch> element
+    '''
+    self.path = path
+    append = append and os.path.exists(path)
+    # size of uncompressed XML written by writer. Compressed size is used for appended file
+    self.size = os.path.getsize(path) if append else 0
+    self.lock = threading.RLock()
+    self.__stream = open_rnef(path,'ab' if append else 'wb')
+    self.__buffer = bytearray()
+    self.__queue = queue.Queue(RNEF_WRITE_QUEUE)
+    self.__error = None
+    self.__thread = threading.Thread(target=self.__write2disk,name=f'RNEFwriter {os.path.basename(path)}',daemon=True)
+    self.__thread.start()
+    self.__xmlfile = ExitStack()
+    self.xf = None
+    if not append:
+      self.xf = self.__xmlfile.enter_context(et.xmlfile(self,encoding='utf-8',buffered=False))
+      self.__xmlfile.enter_context(self.xf.element('batch'))
+      self.xf.write('\n')
+    OPEN_WRITERS.add(self)
+
+
+  def __write2disk(self):
+    while (chunk := self.__queue.get()) is not None:
+      if self.__error is None:
+        try:
+          self.__stream.write(chunk)
+        except Exception as e:
+          self.__error = e
+    self.__stream.close()
+
+
+  def __flush(self):
+    if self.__error is not None:
+      raise self.__error
+    if self.__buffer:
+      self.__queue.put(bytes(self.__buffer))
+      self.__buffer.clear()
+
+
+  def write(self,data:bytes|str):
+    '''
+    sink interface for lxml.etree.xmlfile. Also used to write RNEF XML strings
+    '''
+    if isinstance(data,str):
+      data = data.encode('utf-8')
+    with self.lock:
+      self.__buffer += data
+      self.size += len(data)
+      if len(self.__buffer) >= RNEF_WRITE_BUFFER:
+        self.__flush()
+
+
+  def write_resnet(self,resnet:et._Element):
+    with self.lock:
+      if self.xf is None:
+        self.write(et.tostring(resnet,pretty_print=True))
+      else:
+        self.xf.write(resnet,pretty_print=True)
+
+
+  def close(self,close_batch=True):
+    '''
+    waits until all data is written to disk
+    input:
+      close_batch - if False <batch> element is left open to continue writing into file by next RNEFwriter
+    '''
+    with self.lock:
+      if self.__thread.is_alive():
+        if close_batch:
+          if self.xf is None:
+            self.write('</batch>')
+          else:
+            self.__xmlfile.close()
+        else:
+          self.__xmlfile.pop_all()
+        self.xf = None
+        try:
+          self.__flush()
+        finally:
+          self.__queue.put(None)
+          self.__thread.join()
+          OPEN_WRITERS.discard(self)
+      if self.__error is not None:
+        raise self.__error
+
+
+@atexit.register
+def _close_writers():
+  # writer thread is daemon. Data must be saved before interpreter exit
+  for writer in list(OPEN_WRITERS):
+    writer.close(close_batch=False)
@@ -0,0 +1,242 @@
+'''
+Versioned binary snapshot of ResnetGraph used by APIcache to avoid re-parsing RNEF.\n
+File layout: SNAPSHOT_MAGIC, version:uint32, header size:uint64, JSON header, 8-byte aligned numpy arrays.\n
+Header = {"name":graph name,"params":{},"arrays":{array_name:[offset,dtype,shape]}}\n
+All strings are interned into one UTF-8 blob. Tables store string ids.\n
+Property names, PropSet ids and values are stored with their type to load them back unchanged:\n
+  node_props [node_idx,prop_type,prop,type,value]
+  rel_props [rel_idx,prop_type,prop,type,value]
+  rel_nodes [rel_idx,node_idx,role]
+  propsets [rel_idx,propset_id_type,propset_id,prop_type,prop,type,value]
+  rel_refs [rel_idx,ref_idx]
+  ref_props [ref_idx,prop_type,prop,type,value]
+  ref_ids [ref_idx,id_type_type,id_type,type,value]
+  ref_snippets [ref_idx,textref,prop_type,prop,type,value]
+'''
+import os,json,mmap,struct,threading
+import numpy as np
+from .NetworkxObjects import PSObject,PSRelation,REGULATORS,TARGETS
+from .references import Reference,AUTHORS,_AUTHORS_
+
+
+SNAPSHOT_MAGIC = b'RNSNAP'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_EXT = '.rnsnap'
+# value types in property tables
+STR,INT,FLOAT,BOOL,NONE = 0,1,2,3,4
+REGULATOR_ROLE,TARGET_ROLE = 0,1
+INT64_MIN,INT64_MAX = -2**63,2**63-1
+TABLE_WIDTH = {'node_props':5,'rel_props':5,'rel_nodes':3,'propsets':7,'rel_refs':2,'ref_props':5,'ref_ids':5,'ref_snippets':6}
+
+
+class SnapshotWriter:
+  '''
+  converts graph nodes and relations into snapshot tables
+  '''
+  def __init__(self):
+    self.str2id = dict()
+    self.tables = {name:list() for name in TABLE_WIDTH}
+
+
+  def sid(self,s:str)->int:
+    try:
+      return self.str2id[s]
+    except KeyError:
+      new_id = len(self.str2id)
+      self.str2id[s] = new_id
+      return new_id
+
+
+  def value(self,v)->tuple[int,int]:
+    '''
+    output:
+      (type,value)
+    raises TypeError for values that cannot be saved in snapshot
+    '''
+    if isinstance(v,str):
+      return STR,self.sid(v)
+    elif v is None:
+      return NONE,0
+    elif isinstance(v,(bool,np.bool_)):
+      return BOOL,int(v)
+    elif isinstance(v,(int,np.integer)) and INT64_MIN <= v <= INT64_MAX:
+      return INT,int(v)
+    elif isinstance(v,(float,np.floating)):
+      return FLOAT,int(np.float64(v).view(np.int64))
+    raise TypeError(f'{type(v).__name__} values cannot be saved in graph snapshot')
+
+
+  def _add_props(self,table:str,row_prefix:list,props:dict,skip_props:set=set()):
+    rows = self.tables[table]
+    for prop_name, values in props.items():
+      if prop_name in skip_props: continue
+      prop = self.value(prop_name)
+      values = values if isinstance(values,(list,tuple,set)) else [values]
+      for v in values:
+        rows.append(row_prefix+[*prop,*self.value(v)])
+
+
+  def add_nodes(self,nodes:list[tuple[int,dict]],ent_props:list=[])->dict[int,int]:
+    '''
+    input:
+      nodes - [(uid,node attributes)]
+      ent_props - node properties to keep in addition to URN and ObjTypeName. All properties are kept if empty
+    output:
+      {uid:node_idx}
+    '''
+    keep = set(ent_props)|{'URN','ObjTypeName'} if ent_props else set()
+    uid2idx = dict()
+    for idx, (uid,node) in enumerate(nodes):
+      props = {k:v for k,v in node.items() if k in keep} if keep else node
+      self._add_props('node_props',[idx],props)
+      uid2idx[uid] = idx
+    return uid2idx
+
+
+  def add_rels(self,rels:list[PSRelation],uid2idx:dict[int,int],rel_props:list=[],with_refs=True):
+    '''
+    input:
+      rel_props - relation properties to keep in addition to URN and ObjTypeName. All properties are kept if empty
+    '''
+    keep = set(rel_props)|{'URN','ObjTypeName'} if rel_props else set()
+    ref2idx = dict() # {id(Reference):ref_idx} references can be shared by merged relations
+    for rel_idx, rel in enumerate(rels):
+      props = {k:v for k,v in rel.items() if k in keep} if keep else rel
+      self._add_props('rel_props',[rel_idx],props)
+      for role,nodes in [(REGULATOR_ROLE,rel.regulators()),(TARGET_ROLE,rel.targets())]:
+        self.tables['rel_nodes'] += [[rel_idx,uid2idx[n.uid()],role] for n in nodes]
+
+      if not with_refs: continue
+      for propset_id, propset in rel.PropSetToProps.items():
+        self._add_props('propsets',[rel_idx,*self.value(propset_id)],propset)
+
+      for ref in rel.references:
+        try:
+          ref_idx = ref2idx[id(ref)]
+        except KeyError:
+          ref_idx = len(ref2idx)
+          ref2idx[id(ref)] = ref_idx
+          ref_props = dict(ref)
+          if _AUTHORS_ in ref_props and AUTHORS not in ref_props:
+            ref_props[AUTHORS] = ref.author_list()
+          self._add_props('ref_props',[ref_idx],ref_props,skip_props={_AUTHORS_})
+          self._add_props('ref_ids',[ref_idx],ref.Identifiers)
+          for textref, snippet in ref.snippets.items():
+            self._add_props('ref_snippets',[ref_idx,self.sid(textref)],snippet)
+        self.tables['rel_refs'].append([rel_idx,ref_idx])
+
+
+  def write(self,path:str,name:str,params:dict):
+    strings = [s.encode('utf-8') for s in self.str2id] # dict preserves insertion order = string id
+    str_offsets = np.zeros(len(strings)+1,dtype=np.int64)
+    np.cumsum([len(s) for s in strings],out=str_offsets[1:])
+    arrays = {'str_offsets':str_offsets,'str_blob':np.frombuffer(b''.join(strings),dtype=np.uint8)}
+    for table, rows in self.tables.items():
+      arrays[table] = np.array(rows,dtype=np.int64).reshape(-1,TABLE_WIDTH[table])
+
+    # array offsets are calculated relative to the end of header
+    array_specs = dict()
+    offset = 0
+    for array_name, a in arrays.items():
+      array_specs[array_name] = [offset,a.dtype.str,list(a.shape)]
+      offset += (a.nbytes+7)//8*8
+    header = json.dumps({'name':name,'params':params,'arrays':array_specs}).encode('utf-8')
+    header += b' '*((-(len(SNAPSHOT_MAGIC)+12+len(header)))%8)
+
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp' # concurrent writers do not share temporary file
+    with open(tmp_path,'wb') as f:
+      f.write(SNAPSHOT_MAGIC+struct.pack('<IQ',SNAPSHOT_VERSION,len(header))+header)
+      for a in arrays.values():
+        f.write(a.tobytes())
+        f.write(b'\0'*((-a.nbytes)%8))
+    os.replace(tmp_path,path) # readers never see partially written snapshot
+
+
+def read_header(path:str)->tuple[dict,int]:
+  '''
+  output:
+    header, data_start
+  raises FileNotFoundError if path does not exist, ValueError if snapshot version is not supported
+  '''
+  with open(path,'rb') as f:
+    magic = f.read(len(SNAPSHOT_MAGIC))
+    version, header_size = struct.unpack('<IQ',f.read(12))
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+      raise ValueError(f'{path} is not a graph snapshot version {SNAPSHOT_VERSION}')
+    header = json.loads(f.read(header_size))
+  return header, len(SNAPSHOT_MAGIC)+12+header_size
+
+
+def is_valid(path:str,params:dict)->bool:
+  '''
+  output:
+    True if snapshot exists, has current version and was made with "params"
+  '''
+  try:
+    header,_ = read_header(path)
+    return header['params'] == params
+  except (FileNotFoundError,ValueError,struct.error,json.JSONDecodeError):
+    return False
+
+
+def _decode(typ:int,v:int,strings:list[str]):
+  if typ == STR: return strings[v]
+  elif typ == INT: return v
+  elif typ == FLOAT: return float(np.int64(v).view(np.float64))
+  elif typ == NONE: return None
+  else: return bool(v)
+
+
+def read(path:str)->tuple[str,dict,list[PSObject],list[PSRelation]]:
+  '''
+  reads snapshot using memory mapping.
+  Tables are converted into Python lists one at a time from mapped arrays without reading whole file into memory
+  output:
+    graph name, params, nodes, relations
+  '''
+  header,data_start = read_header(path)
+  with open(path,'rb') as f, mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+    def table(name:str)->list[list[int]]:
+      offset,dtype,shape = header['arrays'][name]
+      count = int(np.prod(shape))
+      if not count: return []
+      # tolist() copies mapped array. No numpy array is left pointing to mm when mm is closed
+      return np.frombuffer(mm,dtype=np.dtype(dtype),count=count,offset=data_start+offset).reshape(shape).tolist()
+
+    str_offsets = table('str_offsets')
+    blob_offset = data_start+header['arrays']['str_blob'][0]
+    strings = [mm[blob_offset+s:blob_offset+e].decode('utf-8') for s,e in zip(str_offsets,str_offsets[1:])]
+    del str_offsets
+
+    node_props = table('node_props')
+    nodes = [PSObject() for _ in range(1+max((r[0] for r in node_props),default=-1))]
+    for idx,ptyp,prop,typ,v in node_props:
+      nodes[idx][_decode(ptyp,prop,strings)].append(_decode(typ,v,strings))
+    del node_props
+
+    rel_props = table('rel_props')
+    rels = [PSRelation() for _ in range(1+max((r[0] for r in rel_props),default=-1))]
+    for idx,ptyp,prop,typ,v in rel_props:
+      rels[idx][_decode(ptyp,prop,strings)].append(_decode(typ,v,strings))
+    del rel_props
+    for rel_idx,node_idx,role in table('rel_nodes'):
+      rels[rel_idx].Nodes[TARGETS if role == TARGET_ROLE else REGULATORS].append(nodes[node_idx])
+    for rel_idx,ityp,propset_id,ptyp,prop,typ,v in table('propsets'):
+      rels[rel_idx].PropSetToProps[_decode(ityp,propset_id,strings)][_decode(ptyp,prop,strings)].append(_decode(typ,v,strings))
+
+    rel_refs = table('rel_refs')
+    refs = dict()
+    for _,ref_idx in rel_refs:
+      if ref_idx not in refs:
+        refs[ref_idx] = Reference('','')
+        refs[ref_idx].Identifiers.clear()
+    for ref_idx,ityp,id_type,typ,v in table('ref_ids'):
+      refs[ref_idx].Identifiers[_decode(ityp,id_type,strings)] = _decode(typ,v,strings)
+    for ref_idx,ptyp,prop,typ,v in table('ref_props'):
+      refs[ref_idx].setdefault(_decode(ptyp,prop,strings),[]).append(_decode(typ,v,strings))
+    for ref_idx,textref,ptyp,prop,typ,v in table('ref_snippets'):
+      refs[ref_idx].snippets[strings[textref]][_decode(ptyp,prop,strings)].add(_decode(typ,v,strings))
+    for rel_idx,ref_idx in rel_refs:
+      rels[rel_idx].references.append(refs[ref_idx])
+
+  return header['name'],header['params'],nodes,rels
@@ -1,9 +1,9 @@
-from ...utils.utils import load_api_config, greek2english,urlencode,json,multithread,execution_time
+from ...utils.utils import load_api_config, greek2english,urlencode,multithread,execution_time
 from ..ResnetAPI.references import Reference,DocMine, Author
 from ..ResnetAPI.references import AUTHORS,_AUTHORS_,GRANT_APPLICATION,JOURNAL,SENTENCE,RELEVANCE
 from scibite_toolkit.scibite_search import SBSRequestBuilder as s
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import re,threading,requests
+from .sbs_client import SBSclient,run,ENTITIES,SENTENCES,DOCUMENTS,SBS_RATE
+import re,threading,asyncio
 from time import sleep, time
 from datetime import datetime
 
@@ -17,6 +17,7 @@ DATASET2IDTYPE = {'Medline':'PMID',
 BM25SCORE = 'BM25score'
 MAX_SBS_SESSIONS = 3
 SBS_ID = 'sbs_id'
+ABS_QUERY = 'dataset = "medline" AND abstract ~ ({q})'
 
 
 class SBSRef(DocMine):
@@ -241,17 +242,25 @@ class SBSRef(DocMine):
 
 ####################### SBSapi ############# SBSapi ###################### SBSapi ##############
 class SBSapi():
-  def __init__(self,api_config:dict=dict()):
+  def __init__(self,api_config:dict=dict(),client:SBSclient|None=None):
+    '''
+    optional api_config keys:
+      "SBScache" - path to sqlite file with cached SBS responses
+      "SBSrate" - maximum number of requests per second, defaults to SBS_RATE
+    client - existing SBSclient to share connection pool, rate limit and response cache
+    '''
     self.APIconfig = api_config.copy() if api_config else load_api_config()
     self.term2id = dict() #contains dictionary of search terms to ontology IDs
     self.refCache = dict() # {ref_key:SBSRef}
     self.timestamp = datetime.now()
     self.SBSsearch = self.__get_token()
     self.multithread = True
+    self.client = client if client else SBSclient(self,rate=float(self.APIconfig.get('SBSrate',SBS_RATE)),
+                                                  cache_path=self.APIconfig.get('SBScache',''))
     
 
   def clone(self):
-    new_session = SBSapi(self.APIconfig)
+    new_session = SBSapi(self.APIconfig,self.client)
     new_session.term2id = self.term2id
     new_session.refCache = self.refCache
     return new_session
@@ -266,32 +275,28 @@ class SBSapi():
     return sbs
   
 
-  def token_refresh(self):
-    if (datetime.now() - self.timestamp).total_seconds() > 3000:
+  def token_refresh(self,force=False):
+    if force or (datetime.now() - self.timestamp).total_seconds() > 3000:
       self.SBSsearch = self.__get_token()
       print(f'SBS token was refreshed at {datetime.now()}')
   
 
   def __get_entities(self,search_term:str, in_vocab:str)->dict:
     options = {"limit": 1,"suggestPrefix":search_term,"includeVocabularies":[in_vocab]}
-    req = requests.get(self.SBSsearch.url + "/api/search/v1/entities", 
-                      params=options, headers=self.SBSsearch.headers,
-                      verify=self.SBSsearch.verify_request)
-    try:
-      return req.json()
-    except json.JSONDecodeError as e:
-      if req:
-        if req.status_code in [401,403]:
-          print(f'Response status: {req.status_code}')
-          self.token_refresh()
-          return self.__get_entities(search_term,in_vocab)
-        else:
-          print(f'Search for {search_term} in {in_vocab} produced invalid response: {e}')
-          return dict()
-      else:
-        return dict()
+    return self.client.get(ENTITIES,options)
     
 
+  async def __aget_id(self,search_term:str, in_vocabs:list=['GENETREE','EMTREE']):
+    for vocab in in_vocabs:
+      options = {"limit": 1,"suggestPrefix":search_term,"includeVocabularies":[vocab]}
+      response = await self.client.aget(ENTITIES,options)
+      data = response.get('data')
+      if data:
+        self.term2id[search_term] = str(data[0]['id'])
+        return
+    self.term2id[search_term] = f'"{search_term}"'
+
+
   def get_id(self,search_term:str, in_vocabs:list=['GENETREE','EMTREE'])->str:
     with threading.Lock():
       for vocab in in_vocabs:
@@ -315,13 +320,7 @@ class SBSapi():
         print(f'{search_term} is empty')
         return ''
     else:
-      if search_term.endswith('+'):
-        noplus_term = search_term.rstrip(' +')
-        expand = ' +'
-      else:
-        noplus_term = search_term
-        expand = ''
-
+      noplus_term,expand = self.__noplus(search_term)
       if noplus_term in self.term2id:
         return self.term2id[noplus_term]+expand
       else:
@@ -333,12 +332,31 @@ class SBSapi():
         return term_id + expand
   
 
+  @staticmethod
+  def __noplus(search_term:str)->tuple[str,str]:
+    '''
+    output:
+      search_term without + term expansion sign, term expansion sign
+    '''
+    if search_term.endswith('+'):
+      return search_term.rstrip(' +'),' +'
+    return search_term,''
+
+
   def __map2terms(self,terms:list[str],in_vocabs:list=['GENETREE','EMTREE']):
     '''
     handles search terms with quotes and with + signs at the end
     '''
     return list(filter(None,(map(lambda t: self.__search_term(t, in_vocabs),terms))))
   
+
+  async def __amap2terms(self,terms:list[str],in_vocabs:list=['GENETREE','EMTREE']):
+    '''
+    finds ontology IDs for all terms concurrently. Afterwards join2query does not send requests
+    '''
+    noplus_terms = {self.__noplus(t)[0] for t in terms if t and not (t[0] == '"' and t[-1] == '"')}
+    await asyncio.gather(*[self.__aget_id(t,in_vocabs) for t in noplus_terms if t not in self.term2id])
+  
   
   def add_refs(self,fetched_refs:list[SBSRef],from_sent=False)->list[SBSRef]:
     '''
@@ -346,23 +364,31 @@ class SBSapi():
       equivalent to fetched_refs [SBSRef] from self.refCache with updated bibliography and all sentences
     '''
     with threading.Lock(): # to prevent lock during multithreading
-      cache_equivalent_refs = set()
-      new_refs = []
-      for ref in fetched_refs:
-        ref_key = ref.key()
-        if ref_key in self.refCache:
-          exist_ref = self.refCache[ref_key]
-          exist_ref._merge(ref)
-          cache_equivalent_refs.add(exist_ref)
-        else:
-          self.refCache[ref_key] = ref
-          cache_equivalent_refs.add(ref)
-          new_refs.append(ref)
-
+      cache_equivalent_refs,new_refs = self.__add2cache(fetched_refs)
       if from_sent:
         self.sents2docs(new_refs)
       
-      return list(cache_equivalent_refs)
+      return cache_equivalent_refs
+  
+
+  def __add2cache(self,fetched_refs:list[SBSRef])->tuple[list[SBSRef],list[SBSRef]]:
+    '''
+    output:
+      equivalent to fetched_refs [SBSRef] from self.refCache, fetched_refs that were not in self.refCache
+    '''
+    cache_equivalent_refs = set()
+    new_refs = []
+    for ref in fetched_refs:
+      ref_key = ref.key()
+      if ref_key in self.refCache:
+        exist_ref = self.refCache[ref_key]
+        exist_ref._merge(ref)
+        cache_equivalent_refs.add(exist_ref)
+      else:
+        self.refCache[ref_key] = ref
+        cache_equivalent_refs.add(ref)
+        new_refs.append(ref)
+    return list(cache_equivalent_refs),new_refs
   
 
   def bm25_Relevance(self):
@@ -429,21 +455,7 @@ class SBSapi():
 
   def document_by_id2(self,docid:str,markup=False)->dict:
     options = {"markup": markup}
-    req = requests.get(self.SBSsearch.url + "/api/search/v1/documents/" + docid, params=options, 
-                       headers=self.SBSsearch.headers,verify=self.SBSsearch.verify_request)
-    try:
-      return req.json()
-    except json.JSONDecodeError as e:
-      if req:
-        if req.status_code in [401,403]:
-          print(f'Response status: {req.status_code}')
-          self.token_refresh()
-          return self.document_by_id2(docid,markup)
-        else:
-          print(f'Search for {docid} produced invalid response: {e}')
-          return dict()
-      else:
-        return dict()
+    return self.client.get(DOCUMENTS+'/'+docid,options)
       
 
   def __sent2doc(self,sent_ref:SBSRef):
@@ -451,8 +463,22 @@ class SBSapi():
     loads bibliography for sent_ref
     '''
     assert (not sent_ref.has_bibliography())
+    return self.__doc2ref(sent_ref,self.document_by_id2(sent_ref.sbsid()))
+  
+
+  async def __asent2doc(self,sent_ref:SBSRef):
+    assert (not sent_ref.has_bibliography())
+    doc = await self.client.aget(DOCUMENTS+'/'+sent_ref.sbsid(),{"markup": False})
+    return self.__doc2ref(sent_ref,doc)
+
+
+  def __doc2ref(self,sent_ref:SBSRef,doc:dict):
+    '''
+    merges bibliography from SBS document into sent_ref
+    output:
+      sent_ref if it is valid reference, None otherwise
+    '''
     senref_sbsid = sent_ref.sbsid()
-    doc = self.document_by_id2(senref_sbsid)
     if 'data' in doc:
       ref = SBSRef.from_doc(doc['data'])
       sent_ref._merge(ref)
@@ -483,22 +509,27 @@ class SBSapi():
     '''
     options = dict(kwargs)
     options["queries"] = query
-    req = requests.get(self.SBSsearch.url + "/api/search/v1/sentences/", params=options, 
-                        headers=self.SBSsearch.headers, verify=self.SBSsearch.verify_request)
-    try:
-      return req.json()
-    except json.JSONDecodeError as e:
-      if req:
-        if req.status_code in [401,403]:
-          print(f'Response status: {req.status_code}')
-          self.token_refresh()
-          return self.__get_sentences2__(query,**kwargs)
-        else:
-          print(f'{query} produced invalid response: {e}')
-          return dict()
+    return self.client.get(SENTENCES,options)
+
+
+  @staticmethod
+  def __sents2refs(json_response:dict)->tuple[int,list[SBSRef]]:
+    '''
+    output:
+      total sentence count, [SBSRef] where consecutive sentences from the same document are merged
+    '''
+    data = json_response['data']
+    if not data: # data may be empty
+      return 0,[]
+    sentence_count = json_response['pagination']['totalItems']
+    sent_refs = [SBSRef.from_sent(data[0])]
+    for i in range(1,len(data)):
+      new_ref = SBSRef.from_sent(data[i])
+      if sent_refs[-1] == new_ref: # sentence is from the same document
+        sent_refs[-1]._merge(new_ref)
       else:
-        print(f'{query} produced empty response')
-        return dict()
+        sent_refs.append(new_ref)
+    return sentence_count, sent_refs
 
 
   def _try2getsents(self,query:str,**kwargs)->tuple[int,list[SBSRef]]:
@@ -550,19 +581,7 @@ class SBSapi():
             json_response = self.__get_sentences2__(query,**my_kwargs)
             
         if 'data' in json_response:
-          data = json_response['data']
-          if data: # data may be empty
-            sentence_count = json_response['pagination']['totalItems']
-            sent_refs = [SBSRef.from_sent(json_response['data'][0])]
-            for i in range(1,len(data)):
-              new_ref = SBSRef.from_sent(json_response['data'][i])
-              if sent_refs[-1] == new_ref: # sentence is from the same document
-                sent_refs[-1]._merge(new_ref)
-              else:
-                sent_refs.append(new_ref)
-            return sentence_count, sent_refs
-          else:
-            return 0,[]
+          return self.__sents2refs(json_response)
         else:
           return 0,[]
       except Exception as ex:
@@ -586,6 +605,41 @@ class SBSapi():
       return sentence_count,self.add_refs(sent_refs,from_sent=True)
     else:
       return 0,[]
+  
+
+  async def __asearch_sents(self,query:str)->tuple[int,list[SBSRef]]:
+    '''
+    asynchronous search_sents. Bibliography of new references is loaded concurrently
+    '''
+    options = {'markup':False,'limit':100,'offset':0,'relevance_rank':1,'queries':query}
+    json_response = await self.client.aget(SENTENCES,options)
+    if 'data' in json_response:
+      sentence_count,sent_refs = self.__sents2refs(json_response)
+    else: # _try2getsents works around SBS bug by adjusting "limit" in consecutive requests
+      sentence_count,sent_refs = await asyncio.to_thread(self._try2getsents,query,limit=100)
+    cache_refs,new_refs = self.__add2cache(sent_refs)
+    await asyncio.gather(*[self.__asent2doc(r) for r in new_refs])
+    return sentence_count,cache_refs
+
+
+  async def __asentcooc(self,entity:str, and_concepts:list[str]|set[str],
+                        add2query:list[str]=[])->tuple[str,tuple[str,int,list[SBSRef]]]:
+    query,search_url = self.join2query(entity,and_concepts,add2query)
+    sentence_count,refs = await self.__asearch_sents(query) if query else (0,[])
+    return entity,(search_url,sentence_count,refs)
+
+
+  async def __asentcooc4list(self,entities:list[str], and_concepts:list[str]|set[str],
+                add2query:list[str]=[])->dict[str,tuple[str,int,list[SBSRef]]]:
+    '''
+    asynchronous __sentcooc4list sending all queries concurrently through self.client
+    '''
+    await self.__amap2terms(list(entities)+list(and_concepts)+list(add2query))
+    query,_ = self.join2query(entities[0],and_concepts,add2query)
+    print(f'Will find sentence co-occurrence for {len(entities)} entities')
+    print(f'Sample query for sentence co-occurrence: {query}\n')
+    results = await asyncio.gather(*[self.__asentcooc(e,and_concepts,add2query) for e in entities])
+    return dict(results)
 
 
   def __sentcooc4list(self,entities:list[str], and_concepts:list[str]|set[str],
@@ -616,20 +670,10 @@ class SBSapi():
     '''
     start = time()
     entity2rfks = dict()
+    if not entities:
+      return entity2rfks
     if self.multithread:
-      chunk_size = int(len(entities)/MAX_SBS_SESSIONS)
-      with ThreadPoolExecutor(max_workers=MAX_SBS_SESSIONS, thread_name_prefix='SBS') as e:
-        futures = list()
-        new_session = self.clone()
-        for chunk in range(0,len(entities),chunk_size):
-          fut_entities = entities[chunk:chunk+chunk_size]
-          future = e.submit(new_session.__sentcooc4list,fut_entities,link2concepts,add2query)
-          futures.append(future)
-        
-        for f in as_completed(futures):
-          results = f.result()
-          entity2rfks.update(results)
-        e.shutdown()
+      entity2rfks = run(self.__asentcooc4list(entities,link2concepts,add2query))
     else:
       entity2rfks = self.__sentcooc4list(entities,link2concepts,add2query)
 
@@ -647,6 +691,7 @@ class SBSapi():
       e2refs[entity] = (search_url,sentence_count,clean_refs)
 
     print(f'Found sentences in SBS with co-occurrence of {rows_counter} out of {len(entities)} entities with {len(link2concepts)} concepts in {execution_time(start)}')
+    print(f'{self.client.request_count} SBS requests were sent, {self.client.cache_hits} responses were taken from cache')
     return e2refs
 
 ################# DOCUMENT SEARCH ####################### DOCUMENT SEARCH ###############
@@ -660,22 +705,7 @@ class SBSapi():
     '''
     options = dict(kwargs)
     options["queries"] = query
-    req = requests.get(self.SBSsearch.url + "/api/search/v1/documents", params=options,
-                       headers=self.SBSsearch.headers, verify=self.SBSsearch.verify_request)
-    try:
-      return req.json()
-    except json.JSONDecodeError as e:
-      if req:
-        if req.status_code in [401,403]:
-          print(f'Response status: {req.status_code}')
-          self.token_refresh()
-          return self.get_docs2(query,**kwargs)
-        else:
-          print(f'invalid response {e} to "{query}"')
-          return dict()
-      else:
-        print(f'response to {query} is empty')
-        return dict()
+    return self.client.get(DOCUMENTS,options)
       
 
   def _try2getdocs(self,query='',**kwargs)->tuple[int,list[SBSRef]]:
@@ -734,12 +764,11 @@ class SBSapi():
     entity2abscount = dict()
     number_of_entities = len(entities)
     #abs_query = 'dataset = "medline" AND field = "abstract" AND content ~ ({q})'
-    abs_query = 'dataset = "medline" AND abstract ~ ({q})'
     for entity in entities:
       jq,_ = self.join2query(entity,concepts)
       if jq:
         limit = 100
-        query = abs_query.format(q=jq)
+        query = ABS_QUERY.format(q=jq)
         if entity == entities[0]:
           print(f'\nWill find abstract coocurence for {number_of_entities} entities')
           print(f'Sample query for abstract co-ocurence: {query}\n')
@@ -771,25 +800,58 @@ class SBSapi():
     return entity2abscount
   
 
+  async def __aabscooc(self,entity:str,concepts:list[str])->tuple[str,tuple[int,float]|None]:
+    '''
+    output:
+      entity,(abstract_count,abstract_relevance) or None if SBS returned no data
+    '''
+    jq,_ = self.join2query(entity,concepts)
+    if not jq:
+      return entity,(0,0.0)
+    
+    limit = 100
+    query = ABS_QUERY.format(q=jq)
+    kwargs = {'markup':False,'limit':limit,'offset':0,'maxSnippets':0,'fields':[],'queries':query}
+    json_response = await self.client.aget(DOCUMENTS,kwargs)
+    if not json_response or 'data' not in json_response:
+      print(f'No abstract co-occurrence for query {query}')
+      return entity,None
+    
+    data = json_response['data']
+    if not data:
+      return entity,(0,0.0)
+    
+    hit_count = int(json_response['pagination']['totalItems'])
+    abstract_relevance = sum([a['_score'] for a in data])
+    pages = await asyncio.gather(*[self.client.aget(DOCUMENTS,{**kwargs,'offset':offset}) for offset in range(limit,hit_count,limit)])
+    for json_response in pages:
+      if json_response and 'data' in json_response:
+        abstract_relevance += sum([a['_score'] for a in json_response['data']])
+    return entity,(hit_count,abstract_relevance)
+
+
+  async def __aabscooc4list(self,entities:list[str],concepts:list[str])->dict[str,tuple[int,float]]:
+    '''
+    asynchronous __abscooc4list sending all queries and result pages concurrently through self.client
+    '''
+    await self.__amap2terms(list(entities)+list(concepts))
+    jq,_ = self.join2query(entities[0],concepts)
+    print(f'\nWill find abstract coocurence for {len(entities)} entities')
+    print(f'Sample query for abstract co-ocurence: {ABS_QUERY.format(q=jq)}\n')
+    results = await asyncio.gather(*[self.__aabscooc(e,concepts) for e in entities])
+    return {entity:stat for entity,stat in results if stat is not None}
+
+
   def abscooc4list(self,entities:list[str],link2concepts:list[str]|set[str],)->dict[str,tuple[int,float]]:
     '''
     Entry function for RefStat.add_abs_cooc\n
     '''
     start = time()
     entity2stat = dict()
+    if not entities:
+      return entity2stat
     if self.multithread:
-      chunk_size = int(len(entities)/MAX_SBS_SESSIONS)
-      with ThreadPoolExecutor(max_workers=MAX_SBS_SESSIONS, thread_name_prefix='SBS') as e:
-        futures = list()
-        new_session = self.clone()
-        for chunk in range(0,len(entities),chunk_size):
-          fut_entities = entities[chunk:chunk+chunk_size]
-          future = e.submit(new_session.__abscooc4list,fut_entities,link2concepts)
-          futures.append(future)
-        
-        for f in as_completed(futures):
-          results = f.result()
-          entity2stat.update(results)
+      entity2stat = run(self.__aabscooc4list(entities,link2concepts))
     else:
       entity2stat = self.__abscooc4list(entities,link2concepts)
 
@@ -0,0 +1,249 @@
+'''
+Concurrent client for SciBite Search API used by SBSapi.\n
+All requests share one requests.Session with connection pool of SBS_CONNECTIONS connections
+and one TokenBucket limiting request rate to SBS_RATE requests per second.\n
+Asynchronous requests run in thread pool of SBS_CONNECTIONS threads; identical requests in flight are sent only once.\n
+Responses with data are stored in sqlite ResponseCache if SBSapi config has "SBScache" path
+'''
+import asyncio,json,sqlite3,threading,requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from time import sleep, time, monotonic
+
+ENTITIES = '/api/search/v1/entities'
+SENTENCES = '/api/search/v1/sentences/'
+DOCUMENTS = '/api/search/v1/documents'
+SBS_RATE = 10.0 # requests per second
+SBS_BURST = 20 # requests sent without waiting after idle period
+SBS_CONNECTIONS = 8
+SBS_RETRIES = 5
+SBS_BACKOFF = 2.0 # seconds before first retry, doubled for every next retry
+SBS_CACHE_DAYS = 30
+RETRY_STATUS = {429,500,502,503,504}
+TOKEN_STATUS = {401,403}
+
+
+class TokenBucket:
+  '''
+  thread-safe token bucket shared by synchronous and asynchronous requests
+  '''
+  def __init__(self,rate=SBS_RATE,capacity=SBS_BURST):
+    self.rate = float(rate)
+    self.capacity = float(capacity)
+    self.tokens = float(capacity)
+    self.updated = monotonic()
+    self.lock = threading.Lock()
+
+
+  def reserve(self)->float:
+    '''
+    takes one token
+    output:
+      seconds to wait before sending request
+    '''
+    with self.lock:
+      now = monotonic()
+      self.tokens = min(self.capacity,self.tokens+(now-self.updated)*self.rate)
+      self.updated = now
+      self.tokens -= 1.0
+      return 0.0 if self.tokens >= 0.0 else -self.tokens/self.rate
+
+
+  def pause(self,seconds:float):
+    '''
+    empties bucket for "seconds" when server responds with "Retry-After"
+    '''
+    with self.lock:
+      self.tokens = min(self.tokens,0.0)-seconds*self.rate
+
+
+  def wait(self):
+    delay = self.reserve()
+    if delay: sleep(delay)
+
+
+  async def acquire(self):
+    delay = self.reserve()
+    if delay: await asyncio.sleep(delay)
+
+
+class ResponseCache:
+  '''
+  persistent {request key:JSON response} storage in sqlite file
+  '''
+  def __init__(self,path:str,max_days=SBS_CACHE_DAYS):
+    self.path = path
+    self.max_age = max_days*86400
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path,check_same_thread=False)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, saved REAL, response TEXT)')
+    self.db.commit()
+
+
+  @staticmethod
+  def key(endpoint:str,params:dict)->str:
+    return endpoint+'?'+json.dumps(params,sort_keys=True)
+
+
+  def get(self,key:str)->dict|None:
+    with self.lock:
+      row = self.db.execute('SELECT saved,response FROM responses WHERE key=?',(key,)).fetchone()
+    if row and time()-row[0] < self.max_age:
+      return json.loads(row[1])
+    return None
+
+
+  def put(self,key:str,response:dict):
+    with self.lock:
+      self.db.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?)',(key,time(),json.dumps(response)))
+      self.db.commit()
+
+
+  def close(self):
+    with self.lock:
+      self.db.close()
+
+
+class SBSclient:
+  '''
+  sends GET requests to SBS server configured in SBSapi. Shared by SBSapi clones
+  '''
+  def __init__(self,sbs_api,rate=SBS_RATE,burst=SBS_BURST,max_connections=SBS_CONNECTIONS,cache_path=''):
+    '''
+    input:
+      sbs_api - SBSapi providing SBSsearch with url and headers and token_refresh()
+      cache_path - sqlite file with cached responses. No cache if empty
+    '''
+    self.api = sbs_api
+    self.bucket = TokenBucket(rate,burst)
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1,pool_maxsize=max_connections)
+    self.session.mount('https://',adapter)
+    self.session.mount('http://',adapter)
+    self.executor = ThreadPoolExecutor(max_workers=max_connections,thread_name_prefix='SBS')
+    self.cache = ResponseCache(cache_path) if cache_path else None
+    self.token_lock = threading.Lock()
+    self.inflight = dict() # {request key:asyncio.Future}
+    self.request_count = 0
+    self.cache_hits = 0
+
+
+  def __refresh_token(self,token_time):
+    '''
+    refreshes token once for all requests that were sent with token generated at token_time
+    '''
+    with self.token_lock:
+      if self.api.timestamp == token_time:
+        self.api.token_refresh(force=True)
+
+
+  def __request(self,endpoint:str,params:dict)->dict:
+    '''
+    blocking request with retries. Caller must reserve token from self.bucket for the first attempt
+    output:
+      JSON response. Responses with "error" are returned to caller, empty dict if response is not JSON
+    '''
+    with self.token_lock:
+      self.api.token_refresh()
+    for attempt in range(SBS_RETRIES+1):
+      if attempt:
+        self.bucket.wait()
+      sbs = self.api.SBSsearch
+      token_time = self.api.timestamp
+      try:
+        response = self.session.get(sbs.url+endpoint,params=params,headers=sbs.headers,verify=sbs.verify_request)
+        self.request_count += 1
+      except requests.exceptions.RequestException as e:
+        print(f'{attempt+1} attempt to get {endpoint} failed with {e}',flush=True)
+        sleep(SBS_BACKOFF*2**attempt)
+        continue
+
+      if response.status_code in TOKEN_STATUS:
+        print(f'Response status: {response.status_code}')
+        self.__refresh_token(token_time)
+        continue
+      if response.status_code in RETRY_STATUS and attempt < SBS_RETRIES:
+        retry_after = response.headers.get('Retry-After','')
+        delay = float(retry_after) if retry_after.isdigit() else SBS_BACKOFF*2**attempt
+        if response.status_code == 429:
+          self.bucket.pause(delay)
+        else:
+          sleep(delay)
+        continue
+      try:
+        return response.json()
+      except json.JSONDecodeError as e:
+        print(f'{endpoint} with {params} produced invalid response {response.status_code}: {e}')
+        return dict()
+    return dict()
+
+
+  def __cached(self,key:str)->dict|None:
+    if self.cache is None: return None
+    response = self.cache.get(key)
+    if response is not None:
+      self.cache_hits += 1
+    return response
+
+
+  def __save(self,key:str,response:dict):
+    if self.cache is not None and 'data' in response:
+      self.cache.put(key,response)
+
+
+  def get(self,endpoint:str,params:dict)->dict:
+    '''
+    blocking GET request
+    '''
+    key = ResponseCache.key(endpoint,params)
+    response = self.__cached(key)
+    if response is None:
+      self.bucket.wait()
+      response = self.__request(endpoint,params)
+      self.__save(key,response)
+    return response
+
+
+  async def aget(self,endpoint:str,params:dict)->dict:
+    '''
+    asynchronous GET request. Concurrent identical requests wait for the same response
+    '''
+    key = ResponseCache.key(endpoint,params)
+    response = self.__cached(key)
+    if response is not None:
+      return response
+
+    if key in self.inflight:
+      return await asyncio.shield(self.inflight[key])
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self.inflight[key] = future
+    try:
+      await self.bucket.acquire()
+      response = await loop.run_in_executor(self.executor,self.__request,endpoint,params)
+      self.__save(key,response)
+      future.set_result(response)
+      return response
+    except asyncio.CancelledError:
+      future.cancel()
+      raise
+    except Exception as e:
+      future.set_exception(e)
+      future.exception() # marks exception as retrieved if nobody waits for future
+      raise
+    finally:
+      del self.inflight[key]
+
+
+def run(coroutine):
+  '''
+  runs coroutine to completion from synchronous code, including code called from running event loop (e.g. Jupyter)
+  '''
+  try:
+    asyncio.get_running_loop()
+  except RuntimeError:
+    return asyncio.run(coroutine)
+  with ThreadPoolExecutor(max_workers=1) as e:
+    return e.submit(asyncio.run,coroutine).result()
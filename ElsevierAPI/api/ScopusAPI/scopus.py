@@ -5,6 +5,7 @@ from ..ResnetAPI.references import Reference, Author, DocMine
 from ..ResnetAPI.references import SCOPUS_CI,ARTICLE_ID_TYPES,INSTITUTIONS,AUTHORS,PUBLISHER,_AUTHORS_
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from titlecase import titlecase
+from ...utils.metastore import MetadataStore,JOURNAL_KIND,AFFILIATION_KIND,OPENACCESS_KIND,CITATION_KIND
 
 
 AUTHOR_SEARCH = 0
@@ -32,19 +33,31 @@ class Scopus:
     
     
     def __init__(self,APIconfig:dict,add_param=dict()):
+        '''
+        self.JournalInfo and self.AffiliationInfo contain records used in this session.
+        All records are kept in MetadataStore specified by APIconfig["MetadataStore"]
+        '''
         self.params = {'apiKey':APIconfig['ELSapikey'], 'insttoken':APIconfig['insttoken'],'httpAccept':'application/json'}
         self.params.update(add_param)
-        try:
-            self.JournalInfo = json.load(open(self.__journal_cache_name(),'r',encoding='utf-8'))
-        except FileNotFoundError:
-            self.JournalInfo = dict()
+        self.JournalInfo = dict() # {issn:[journal title,publisher,CiteScore,SJR,SNIP]}
+        self.AffiliationInfo = dict() # {institution:canonical Scopus name}
+        self.store = Scopus.metadata_store(APIconfig)
+        os.makedirs(SCOPUS_CACHE_DIR, exist_ok=True)
 
-        try:
-            self.AffiliationInfo = json.load(open(self.__aff_cache_name(),'r',encoding='utf-8'))
-        except FileNotFoundError:
-            self.AffiliationInfo = dict()
 
-        os.makedirs(SCOPUS_CACHE_DIR, exist_ok=True)
+    @staticmethod
+    def metadata_store(APIconfig:dict)->MetadataStore:
+        '''
+        output:
+            MetadataStore from APIconfig["MetadataStore"] or default store.
+            JSON caches made by previous versions are imported into new store
+        '''
+        store = MetadataStore.open(APIconfig.get('MetadataStore',''))
+        if store.is_empty(JOURNAL_KIND):
+            store.import_json(JOURNAL_KIND,Scopus.__journal_cache_name())
+        if store.is_empty(AFFILIATION_KIND):
+            store.import_json(AFFILIATION_KIND,Scopus.__aff_cache_name())
+        return store
         
 
     def _get_param_str(self):
@@ -71,18 +84,7 @@ class Scopus:
     
 
     def close(self):
-        def write_journal_info():
-            with open(self.__journal_cache_name(), 'w',encoding='utf-8') as f:
-                json.dump(self.JournalInfo,f,indent=1)
-
-        def write_instituion_info():
-            with open(self.__aff_cache_name(), 'w',encoding='utf-8') as f1:
-                json.dump(self.AffiliationInfo,f1,indent=1)        
-
-        with ThreadPoolExecutor(2, thread_name_prefix='CloseScopusCache') as e:
-                e.submit(write_journal_info)
-                e.submit(write_instituion_info)
-        e.shutdown()
+        self.store.flush()
 
 
     @staticmethod
@@ -102,13 +104,23 @@ class Scopus:
     
     def is_in_open_access(self,ref:Reference):
         doi = ref.identifier('DOI')
-        return Scopus.oa_status(doi) if doi else True
+        if not doi: return True
+        is_in_oa = self.store.get(OPENACCESS_KIND,doi)
+        if is_in_oa is None:
+            is_in_oa = Scopus.oa_status(doi)
+            self.store.put(OPENACCESS_KIND,doi,is_in_oa)
+        return is_in_oa
     
 
     def __journal_info(self,issn:str,j_title=''):
         try:
             return self.JournalInfo[issn]
         except KeyError:
+            record = self.store.get(JOURNAL_KIND,issn)
+            if record is not None:
+                self.JournalInfo[issn] = record
+                return record
+
             self.base_url = SCOPUS_API_BASEURL+'serial/title/issn/'+issn+'?'
             self.params.update({'view':'CITESCORE'})
             #result_str = urllib.request.urlopen(url).read().decode('utf-8')
@@ -136,6 +148,7 @@ class Scopus:
                 print(f'{j_title} with ISSN {issn} has no Scopus record')
 
             self.JournalInfo[issn] = record
+            self.store.put(JOURNAL_KIND,issn,record)
             self.params.pop('view','')
             return record
 
@@ -149,6 +162,11 @@ class Scopus:
         try:
             return str(self.AffiliationInfo[titlecase_institution])
         except KeyError:
+            affil_name = self.store.get(AFFILIATION_KIND,titlecase_institution)
+            if affil_name is not None:
+                self.AffiliationInfo[titlecase_institution] = affil_name
+                return str(affil_name)
+
             self.base_url = SCOPUS_API_BASEURL+'search/affiliation?'
             query = f'affil({institution})'
             self.params.update({'query': query,'sort':'relevancy'}) # ensures the most relevant hit to be 1st
@@ -158,9 +176,10 @@ class Scopus:
                 if 'error' in entry: return ''
                 affil_name = str(entry['affiliation-name'])
                 affil_variants = entry['name-variant']
-                for variant in affil_variants:
-                    self.AffiliationInfo[titlecase(variant['$'])] = affil_name
-                    self.AffiliationInfo[titlecase_institution] = affil_name
+                names = {titlecase(variant['$']):affil_name for variant in affil_variants}
+                names[titlecase_institution] = affil_name
+                self.AffiliationInfo.update(names)
+                self.store.put_many(AFFILIATION_KIND,names)
                 return affil_name
             else:
                 return ''
@@ -376,7 +395,8 @@ def loadCI(APIconfig:dict, references:set[Reference])->tuple[set[Reference], set
     Return
     ------
     articles_with_ci - {Reference} annotated with [SCOPUS_CI]\n
-    no_ci_articles - {Reference}
+    no_ci_articles - {Reference}\n
+    Citation counts found in MetadataStore are not requested from Scopus
     '''
     idtype2id2ref = dict()
     for ref in references:
@@ -387,25 +407,39 @@ def loadCI(APIconfig:dict, references:set[Reference])->tuple[set[Reference], set
             except KeyError:
                 idtype2id2ref[id_type] = {refid:ref}
 
+    store = Scopus.metadata_store(APIconfig)
+    idtype2missing_ids = dict()
+    for id_type, id2ref in idtype2id2ref.items():
+        stored_ci = store.get_many(CITATION_KIND,[id_type+':'+i for i in id2ref])
+        idtype2missing_ids[id_type] = list()
+        for refid, ref in id2ref.items():
+            try:
+                ref[SCOPUS_CI] = stored_ci[id_type+':'+refid]
+            except KeyError:
+                idtype2missing_ids[id_type].append(refid)
+
     with ThreadPoolExecutor(100, thread_name_prefix='ScopusCI') as e:
         scopus_futures = list()
-        for id_type, id2ref in idtype2id2ref.items():
-            ids = list(id2ref.keys())
+        for id_type, ids in idtype2missing_ids.items():
             for i in range(0,len(ids),100):
                 query = '{id_type}(' + ' OR '.join(ids[i:i+100])+')'
                 query = query.format(id_type=id_type)
                 search = ScopusSearch(query,APIconfig)
                 scopus_futures.append(e.submit(search._get_results))
 
-        scopus_articles = [f.result() for f in as_completed(scopus_futures)]
+        scopus_articles = [article for f in as_completed(scopus_futures) for article in f.result()]
         e.shutdown()
 
+    found_ci = dict()
     for article in scopus_articles:
         id_type,id = ScopusSearch.get_doc_id(article)
         try:
             idtype2id2ref[id_type][id][SCOPUS_CI] = article['citedby-count']
+            found_ci[id_type+':'+id] = article['citedby-count']
         except KeyError:
             continue
+    store.put_many(CITATION_KIND,found_ci)
+    store.flush()
     
     articles_with_ci = set()
     no_ci_articles = set()
@@ -0,0 +1,193 @@
+'''
+Persistent store for article, journal and affiliation metadata downloaded by Scopus and ETM clients.\n
+Records are JSON values in one sqlite table indexed by (kind,key), e.g. ("ISSN","0028-0836") or ("citations","PMID:123").\n
+Every kind has its own time to live in days (KIND2TTL). Expired records are not returned and are deleted by evict().\n
+Readers use one sqlite connection per thread in WAL mode and do not block each other or the writer.
+Writes are buffered and committed in batches of STORE_BATCH records, on flush() and at interpreter exit
+'''
+import os,json,time,atexit,sqlite3,threading
+
+METADATA_STORE = os.path.join(os.getcwd(),'ElsevierAPI/.cache/metadata.sqlite')
+JOURNAL_KIND = 'ISSN' # [journal title,publisher,CiteScore,SJR,SNIP]
+AFFILIATION_KIND = 'affiliation' # canonical Scopus affiliation name
+OPENACCESS_KIND = 'open access' # bool for DOI
+CITATION_KIND = 'citations' # Scopus citation count for "id_type:identifier"
+ETM_KIND = 'ETM' # ETM search response for request without credentials
+KIND2TTL = {JOURNAL_KIND:180,AFFILIATION_KIND:365,OPENACCESS_KIND:90,CITATION_KIND:30,ETM_KIND:7}
+DEFAULT_TTL = 30
+STORE_BATCH = 1000
+SQL_VARIABLES = 900 # max number of keys in one SELECT
+OPEN_STORES = dict() # {path:MetadataStore}
+OPEN_STORES_LOCK = threading.Lock()
+
+
+class MetadataStore:
+  '''
+  use MetadataStore.open(path) to share one store and its write buffer between clients
+  '''
+  def __init__(self,path=METADATA_STORE,kind2ttl:dict[str,int]=KIND2TTL,batch_size=STORE_BATCH):
+    self.path = path
+    self.kind2ttl = dict(kind2ttl)
+    self.batch_size = batch_size
+    self.lock = threading.RLock()
+    self.__pending = dict() # {(kind,key):(saved,value)} waiting for commit
+    self.__local = threading.local()
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path),exist_ok=True)
+    db = self.__db()
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS metadata (kind TEXT, key TEXT, saved REAL, value TEXT, PRIMARY KEY (kind,key)) WITHOUT ROWID')
+    db.execute('CREATE INDEX IF NOT EXISTS metadata_saved ON metadata (kind,saved)')
+    db.commit()
+
+
+  @classmethod
+  def open(cls,path='')->"MetadataStore":
+    '''
+    input:
+      path - defaults to METADATA_STORE
+    output:
+      store already opened in this process for path or new store
+    '''
+    path = os.path.abspath(path or METADATA_STORE)
+    with OPEN_STORES_LOCK:
+      store = OPEN_STORES.get(path)
+      if store is None:
+        store = cls(path)
+        OPEN_STORES[path] = store
+      return store
+
+
+  def __db(self)->sqlite3.Connection:
+    try:
+      return self.__local.db
+    except AttributeError:
+      db = sqlite3.connect(self.path,timeout=60)
+      db.execute('PRAGMA busy_timeout=60000')
+      self.__local.db = db
+      return db
+
+
+  def __oldest(self,kind:str)->float:
+    return time.time()-self.kind2ttl.get(kind,DEFAULT_TTL)*86400
+
+
+  def get(self,kind:str,key:str,default=None):
+    return self.get_many(kind,[key]).get(key,default)
+
+
+  def get_many(self,kind:str,keys:list[str])->dict:
+    '''
+    output:
+      {key:value} for keys with not expired records
+    '''
+    oldest = self.__oldest(kind)
+    key2value = dict()
+    to_select = list()
+    with self.lock:
+      for key in keys:
+        try:
+          saved,value = self.__pending[(kind,key)]
+          key2value[key] = value
+        except KeyError:
+          to_select.append(key)
+
+    db = self.__db()
+    for i in range(0,len(to_select),SQL_VARIABLES):
+      chunk = to_select[i:i+SQL_VARIABLES]
+      # saved is not in WHERE to make sqlite use primary key instead of metadata_saved index
+      sql = f'SELECT key,saved,value FROM metadata WHERE kind=? AND key IN ({",".join("?"*len(chunk))})'
+      for key,saved,value in db.execute(sql,[kind]+chunk):
+        if saved >= oldest:
+          key2value[key] = json.loads(value)
+    return key2value
+
+
+  def put(self,kind:str,key:str,value):
+    self.put_many(kind,{key:value})
+
+
+  def put_many(self,kind:str,key2value:dict):
+    now = time.time()
+    with self.lock:
+      for key,value in key2value.items():
+        self.__pending[(kind,key)] = (now,value)
+      if len(self.__pending) >= self.batch_size:
+        self.flush()
+
+
+  def flush(self):
+    '''
+    commits buffered records
+    '''
+    with self.lock:
+      if not self.__pending: return
+      rows = [(kind,key,saved,json.dumps(value)) for (kind,key),(saved,value) in self.__pending.items()]
+      db = self.__db()
+      with db:
+        db.executemany('INSERT OR REPLACE INTO metadata VALUES (?,?,?,?)',rows)
+      self.__pending.clear()
+
+
+  def keys(self,kind:str)->list[str]:
+    '''
+    output:
+      keys of not expired records of kind
+    '''
+    self.flush()
+    return [k for (k,) in self.__db().execute('SELECT key FROM metadata WHERE kind=? AND saved>=?',(kind,self.__oldest(kind)))]
+
+
+  def count(self,kind:str)->int:
+    self.flush()
+    return self.__db().execute('SELECT COUNT(*) FROM metadata WHERE kind=?',(kind,)).fetchone()[0]
+
+
+  def is_empty(self,kind:str)->bool:
+    self.flush()
+    return self.__db().execute('SELECT 1 FROM metadata WHERE kind=? LIMIT 1',(kind,)).fetchone() is None
+
+
+  def evict(self,max_records=0)->int:
+    '''
+    deletes expired records of all kinds
+    input:
+      max_records - if > 0 also deletes oldest records of every kind exceeding max_records
+    output:
+      number of deleted records
+    '''
+    self.flush()
+    db = self.__db()
+    deleted = 0
+    with self.lock, db:
+      kinds = [k for (k,) in db.execute('SELECT DISTINCT kind FROM metadata')]
+      for kind in kinds:
+        deleted += db.execute('DELETE FROM metadata WHERE kind=? AND saved<?',(kind,self.__oldest(kind))).rowcount
+        if max_records > 0:
+          deleted += db.execute('''DELETE FROM metadata WHERE kind=? AND key IN
+                                (SELECT key FROM metadata WHERE kind=? ORDER BY saved DESC LIMIT -1 OFFSET ?)''',
+                                (kind,kind,max_records)).rowcount
+    return deleted
+
+
+  def import_json(self,kind:str,json_path:str)->int:
+    '''
+    loads {key:value} dump made by previous versions of Scopus cache
+    output:
+      number of imported records
+    '''
+    try:
+      with open(json_path,'r',encoding='utf-8') as f:
+        key2value = dict(json.load(f))
+    except (FileNotFoundError,json.JSONDecodeError):
+      return 0
+    self.put_many(kind,key2value)
+    self.flush()
+    print(f'Imported {len(key2value)} {kind} records from {json_path} into {self.path}')
+    return len(key2value)
+
+
+@atexit.register
+def _flush_stores():
+  for store in list(OPEN_STORES.values()):
+    store.flush()
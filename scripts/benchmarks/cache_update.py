@@ -0,0 +1,82 @@
+import random
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph,PSObject,PSRelation
+from ElsevierAPI.api.ResnetAPI.NetworkxObjects import OBJECT_TYPE,EFFECT,REFCOUNT
+from ElsevierAPI.api.ResnetAPI.ResnetAPIcache import APIcache
+
+'''
+Checks that APIcache._patch_network used by APIcache.update_cache makes the same simplified network
+as simplify_graph of entire patched raw cache.
+Raw cache has parallel relations between the same node pairs and non-directional Binding relations
+'''
+REL_TYPES = ['DirectRegulation','Regulation','Expression']
+EFFECTS = ['positive','negative','unknown']
+KWARGS = {'cache_name':'test cache','ranks4simplifying':['DirectRegulation','Binding','Expression','Regulation']}
+
+
+def make_rel(nodes:list[PSObject],refcount:int)->PSRelation:
+  regulator,target = random.sample(nodes,2)
+  if random.random() < 0.2:
+    rel = PSRelation.make_rel(regulator.copy(),target.copy(),{OBJECT_TYPE:['Binding'],EFFECT:['unknown']},[],is_directional=False)
+  else:
+    props = {OBJECT_TYPE:[random.choice(REL_TYPES)],EFFECT:[random.choice(EFFECTS)]}
+    rel = PSRelation.make_rel(regulator.copy(),target.copy(),props,[])
+  rel[REFCOUNT] = [refcount]
+  return rel
+
+
+def changed(rel:PSRelation)->PSRelation:
+  '''
+  output:
+    relation with the same URN and new RelationNumberOfReferences like relation downloaded again from database
+  '''
+  new_rel = rel.copy()
+  new_rel[REFCOUNT] = [rel.count_refs()+random.randint(1,20)]
+  return new_rel
+
+
+def edges(g:ResnetGraph)->list:
+  return sorted((r,t,urn,rel.objtype(),rel.effect(),rel.count_refs()) for r,t,urn,rel in g.edges(keys=True,data='relation'))
+
+
+def rebuild(cache:APIcache,raw_graph:ResnetGraph)->ResnetGraph:
+  '''
+  output:
+    simplified network made from relations read again from raw cache RNEF
+  '''
+  return cache.simplify_graph(ResnetGraph.from_rels([rel.copy() for rel in raw_graph._psrels()]),**dict(KWARGS))
+
+
+def make_cache(raw_graph:ResnetGraph)->APIcache:
+  # cache configured only for simplify_graph without database connection
+  cache = APIcache.__new__(APIcache)
+  cache.entProps = ['Name']
+  cache.relprops2rnef = [REFCOUNT]
+  cache.network = rebuild(cache,raw_graph)
+  return cache
+
+
+def check(node_count=200,rel_count=3000,update_count=300):
+  random.seed(0)
+  nodes = [PSObject({'URN':[f'urn:n{i}'],'Name':[f'n{i}'],OBJECT_TYPE:['Protein']}) for i in range(node_count)]
+  raw_graph = ResnetGraph.from_rels([make_rel(nodes,random.randint(1,50)) for _ in range(rel_count)])
+  cache = make_cache(raw_graph)
+
+  raw_rels = list(raw_graph._psrels())
+  stale_rels = random.sample(raw_rels,update_count)
+  # half of stale relations are deleted, the other half are downloaded with new reference count
+  update_rels = [changed(rel) for rel in stale_rels[:update_count//2]]
+  # new relations have URNs not found in raw cache like relations added to database
+  new_rels = {rel.urn():rel for rel in [make_rel(nodes,random.randint(1,50)) for _ in range(update_count)]}
+  update_rels += [rel for urn,rel in new_rels.items() if urn not in raw_graph.urn2rel]
+  stale_urns = {rel.urn() for rel in stale_rels}
+  expected_raw = ResnetGraph.from_rels([rel.copy() for rel in raw_rels if rel.urn() not in stale_urns]+[rel.copy() for rel in update_rels])
+  pairs = cache._patch_network(raw_graph,stale_rels,ResnetGraph.from_rels(update_rels),**dict(KWARGS))
+  assert edges(raw_graph) == edges(expected_raw), 'simplification changed raw cache relations'
+
+  rebuilt = rebuild(cache,raw_graph)
+  assert edges(cache.network) == edges(rebuilt), 'patched network differs from rebuilt network'
+  print(f'{len(pairs)} node pairs were patched. Patched network with {cache.network.number_of_edges()} edges is identical to rebuilt network')
+
+
+if __name__ == "__main__":
+  check()
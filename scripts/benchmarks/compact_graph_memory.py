@@ -0,0 +1,81 @@
+import tracemalloc,time,random,gc
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph,PSObject,PSRelation
+from ElsevierAPI.api.ResnetAPI.NetworkxObjects import OBJECT_TYPE,EFFECT,MECHANISM,REFCOUNT
+from ElsevierAPI.api.ResnetAPI.references import SENTENCE,JOURNAL,PUBYEAR
+
+'''
+Compares memory used by ResnetGraph in default layout and after ResnetGraph.compact().
+Synthetic graph mimics graph loaded from RNEF: every string value is a separate object like strings made by lxml parser
+'''
+NODE_TYPES = ['Protein','SmallMol','Disease','Complex','FunctionalClass','CellProcess']
+REL_TYPES = ['Regulation','DirectRegulation','Binding','Expression','MolTransport','Biomarker']
+EFFECTS = ['positive','negative','unknown']
+MECHANISMS = ['direct interaction','','phosphorylation']
+JOURNALS = ['Nature','Cell','J Biol Chem','PLoS One','Sci Rep']
+
+
+def copystr(s:str):
+  return ''.join(list(s)) # new string object with the same value
+
+
+def make_graph(node_count:int,rel_count:int,refs_per_rel:int)->ResnetGraph:
+  random.seed(0)
+  nodes = list()
+  for i in range(node_count):
+    nodes.append(PSObject({'URN':[f'urn:agi-llid:{i}'],'Name':[f'node{i}'],
+                           OBJECT_TYPE:[copystr(random.choice(NODE_TYPES))]}))
+  rels = list()
+  for i in range(rel_count):
+    regulator, target = random.sample(nodes,2)
+    # nodes in relations are copies of graph nodes like in RNEF file with multiple <resnet> sections
+    regulator, target = regulator.copy(), target.copy()
+    props = {OBJECT_TYPE:[copystr(random.choice(REL_TYPES))],EFFECT:[copystr(random.choice(EFFECTS))]}
+    mechanism = random.choice(MECHANISMS)
+    if mechanism: props[MECHANISM] = [copystr(mechanism)]
+    rel = PSRelation.make_rel(regulator,target,props,[])
+    for r in range(refs_per_rel):
+      propset = rel.PropSetToProps[str(r+1)]
+      propset['PMID'].append(str(1000000*i+r))
+      propset[copystr(JOURNAL)].append(copystr(random.choice(JOURNALS)))
+      propset[copystr(PUBYEAR)].append(str(random.randint(1990,2025)))
+      propset[copystr(SENTENCE)].append(f'sentence {r} about relation {i}')
+      propset[copystr('TextRef')].append(f'info:pmid/{1000000*i+r}#abs:1')
+    rel[REFCOUNT] = [refs_per_rel]
+    rel.refs()
+    rels.append(rel)
+  return ResnetGraph.from_rels(rels)
+
+
+def measure(node_count=20000,rel_count=100000,refs_per_rel=3):
+  gc.collect()
+  tracemalloc.start()
+  start = time.time()
+  g = make_graph(node_count,rel_count,refs_per_rel)
+  default_size,_ = tracemalloc.get_traced_memory()
+  print(f'Default layout: {g.number_of_nodes()} nodes, {g.number_of_edges()} edges use {default_size/1e6:.1f} MB, built in {time.time()-start:.1f}s')
+  start = time.time()
+  g.compact()
+  gc.collect()
+  compact_size,_ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  print(f'Compact layout: {compact_size/1e6:.1f} MB ({100*(default_size-compact_size)/default_size:.1f}% less), compacted in {time.time()-start:.1f}s')
+  return default_size,compact_size
+
+
+def check_modifiable():
+  '''
+  compacted relations keep property lists and PropSetToProps defaultdicts of relations that were not compacted
+  '''
+  g = make_graph(10,20,2).compact()
+  rel = next(iter(g.edges.data('relation')))[2]
+  rel.PropSetToProps['1']['PMID'].append('1')
+  rel.PropSetToProps['3']['PMID'].append('2')
+  rel.update_with_value(MECHANISM,'binding')
+  assert rel.PropSetToProps['1']['PMID'][-1] == '1' and rel.PropSetToProps['3']['PMID'] == ['2']
+  assert 'binding' in rel[MECHANISM]
+  print('Compacted relations can be modified')
+
+
+if __name__ == "__main__":
+  check_modifiable()
+  measure()
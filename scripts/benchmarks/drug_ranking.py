@@ -0,0 +1,68 @@
+import time,random
+import numpy as np
+from scipy import sparse
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph,PSObject,PSRelation
+from ElsevierAPI.api.ResnetAPI.NetworkxObjects import OBJECT_TYPE,EFFECT
+
+'''
+Compares drug ranking in Drugs4Targets before sparse batching: {target_uid:corrected_rank} dictionary made for every drug
+and ranked by ResnetGraph.rank_regulator one drug at a time,
+with ranking from target ranks shared by all drugs and sparse drug x target matrix of corrected ranks (ResnetGraph.rank_regulators4pairs).
+Targets are connected with each other to rank drugs by targets at distance 1 to 5
+'''
+
+
+def make_graph(drug_count:int,target_count:int,targets_per_drug:int,target_links:int)->tuple[ResnetGraph,list[PSObject],list[PSObject]]:
+  random.seed(0)
+  drugs = [PSObject({'URN':[f'urn:drug{i}'],'Name':[f'drug{i}'],OBJECT_TYPE:['SmallMol']}) for i in range(drug_count)]
+  targets = [PSObject({'URN':[f'urn:target{i}'],'Name':[f'target{i}'],OBJECT_TYPE:['Protein']}) for i in range(target_count)]
+  rels = list()
+  for drug in drugs:
+    for target in random.sample(targets,targets_per_drug):
+      rels.append(PSRelation.make_rel(drug.copy(),target.copy(),{OBJECT_TYPE:['DirectRegulation'],EFFECT:['negative']},[]))
+  for _ in range(target_links):
+    regulator,target = random.sample(targets,2)
+    rels.append(PSRelation.make_rel(regulator.copy(),target.copy(),{OBJECT_TYPE:['Regulation'],EFFECT:['positive']},[]))
+  return ResnetGraph.from_rels(rels),drugs,targets
+
+
+def measure(drug_count=20000,target_count=500,targets_per_drug=5,target_links=2000):
+  g,drugs,targets = make_graph(drug_count,target_count,targets_per_drug,target_links)
+  target_uid2rank = {t.uid():random.uniform(0.1,5.0) for t in targets}
+  target_uids = list(target_uid2rank.keys())
+  target2col = {uid:j for j,uid in enumerate(target_uids)}
+  pX_corrections = {(d.uid(),t):random.uniform(1.5,2.5) for d in drugs for t in g[d.uid()]}
+  consistency_corrections = {(d.uid(),t):random.uniform(0.5,1.5) for d in drugs for t in g[d.uid()]}
+
+  start = time.time()
+  per_drug_ranks = dict()
+  for drug in drugs:
+    # Drugs4Targets.__rank before sparse batching
+    weights = dict(target_uid2rank)
+    for target_uid in g[drug.uid()]:
+      weights[target_uid] *= pX_corrections[(drug.uid(),target_uid)]
+      weights[target_uid] *= consistency_corrections[(drug.uid(),target_uid)]
+    per_drug_ranks[drug.uid()] = g.rank_regulator(drug,weights)
+  per_drug_time = time.time()-start
+
+  start = time.time()
+  rows = [i for i,d in enumerate(drugs) for _ in g[d.uid()]]
+  cols = [target2col[t] for d in drugs for t in g[d.uid()]]
+  ranks = [target_uid2rank[t] for d in drugs for t in g[d.uid()]]
+  pXs = [pX_corrections[(d.uid(),t)] for d in drugs for t in g[d.uid()]]
+  consistencies = [consistency_corrections[(d.uid(),t)] for d in drugs for t in g[d.uid()]]
+  # same multiplication order as Drugs4Targets.__drug_target_weights
+  values = np.array(ranks)*np.array(pXs)*np.array(consistencies)
+  pair_weights = sparse.csr_matrix((values,(rows,cols)),shape=(len(drugs),len(target_uids)))
+  matrix_ranks = g.rank_regulators4pairs(drugs,target_uid2rank,pair_weights,target_uids)
+  matrix_time = time.time()-start
+
+  different = sum(1 for uid,rank in per_drug_ranks.items() if matrix_ranks[uid] != rank)
+  same_order = sorted(per_drug_ranks,key=per_drug_ranks.get) == sorted(matrix_ranks,key=matrix_ranks.get)
+  print(f'{drug_count} drugs x {target_count} targets with {target_links} target-target relations: rank_regulator for every drug {per_drug_time:.2f}s, sparse pair weights {matrix_time:.2f}s ({per_drug_time/matrix_time:.1f}x faster)')
+  print(f'{different} ranks differ from rank_regulator, same drug order: {same_order}')
+  assert not different and same_order
+
+
+if __name__ == "__main__":
+  measure()
@@ -0,0 +1,126 @@
+import time,random
+from math import log,sqrt
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph,PSObject,PSRelation,PROTEIN_TYPES,CONSISTENCY
+from ElsevierAPI.api.ResnetAPI.NetworkxObjects import OBJECT_TYPE,EFFECT
+from ElsevierAPI.api.ResnetAPI.DrugTargetConfidence import DrugTargetConsistency
+
+'''
+Compares DrugTargetConsistency consistency calculation from sparse effect vote matrices
+with DrugTargetConsistency.__consistency4 that called ResnetGraph.effect_vote() for every drug-target-disease triple one drug at a time.
+__consistency4 counted disease linked to drug by parallel relations once for every relation,
+sparse calculation counts every disease once
+'''
+EFFECTS = ['positive','negative','unknown']
+consistencies = DrugTargetConsistency._DrugTargetConsistency__consistencies
+
+
+def make_nodes(prefix:str,objtype:str,count:int)->list[PSObject]:
+  return [PSObject({'URN':[f'urn:{prefix}{i}'],'Name':[f'{prefix}{i}'],OBJECT_TYPE:[objtype]}) for i in range(count)]
+
+
+def make_rel(regulator:PSObject,target:PSObject,effect:str,pmid:str,objtype='Regulation')->PSRelation:
+  rel = PSRelation.make_rel(regulator.copy(),target.copy(),{OBJECT_TYPE:[objtype],EFFECT:[effect]},[])
+  rel.PropSetToProps['1']['PMID'].append(pmid)
+  return rel
+
+
+def make_graph(drug_count:int,target_count:int,disease_count:int,rels_per_type:int)->tuple[ResnetGraph,list[PSObject]]:
+  '''
+  output:
+    graph where every drug is linked to disease by one relation at most
+  '''
+  random.seed(0)
+  drugs = make_nodes('drug','SmallMol',drug_count)
+  targets = make_nodes('target','Protein',target_count)
+  diseases = make_nodes('disease','Disease',disease_count)
+  rels = list()
+  for regulators,targets_ in [(drugs,targets),(drugs,diseases),(targets,diseases)]:
+    pairs = {(random.randrange(len(regulators)),random.randrange(len(targets_))) for _ in range(rels_per_type)}
+    if targets_ is not diseases or regulators is not drugs:
+      pairs = list(pairs)+random.sample(list(pairs),len(pairs)//10) # parallel relations
+    for i,(r,t) in enumerate(pairs):
+      rels.append(make_rel(regulators[r],targets_[t],random.choice(EFFECTS),str(i)))
+  return ResnetGraph.from_rels(rels),drugs
+
+
+def consist_coeff(consistent_count:int,inconsistent_count:int):
+  zero_adj = 0.1
+  zscore= log((consistent_count+zero_adj)/(inconsistent_count+zero_adj),10)
+  std = sqrt((1.0/(consistent_count+zero_adj)) + (1.0/(inconsistent_count+zero_adj)))
+  return zscore/std
+
+
+def consistency4(drug:PSObject,in_d2t2d:ResnetGraph)->dict[tuple[int,int,str],float]:
+  # DrugTargetConsistency.__consistency4 before sparse vote matrices
+  targets = list()
+  diseases = list()
+  target_types = PROTEIN_TYPES + ['SmallMol']
+  for r,target,rel in in_d2t2d.targets_of(drug):
+    target_objtype = target.objtype()
+    if target_objtype in ['Disease','Virus','CellProcess']:
+      diseases.append(target)
+    elif target_objtype in target_types:
+      if CONSISTENCY not in rel:
+        targets.append(target)
+
+  if not targets or not diseases:
+    return dict()
+
+  d2t_consistencies = dict()
+  for target in targets:
+    known_drug2target_effect = in_d2t2d.effect_vote(drug,target)
+    if known_drug2target_effect:
+      effect_str = 'positive' if known_drug2target_effect == 1 else 'negative'
+      consistency_counter = 0
+      inconsistency_counter = 0
+      for disease in diseases:
+        known_target2disease_effect = in_d2t2d.effect_vote(target,disease,any_direction=True)
+        if not known_target2disease_effect: continue
+        predicted_drug2disease_effect = known_drug2target_effect*known_target2disease_effect
+        known_drug2disease_effect = in_d2t2d.effect_vote(drug,disease)
+        if not known_drug2disease_effect: continue
+        if predicted_drug2disease_effect == known_drug2disease_effect:
+          consistency_counter += 1
+        else:
+          inconsistency_counter += 1
+      d2t_consistencies[(drug.uid(),target.uid(),effect_str)] = round(consist_coeff(consistency_counter,inconsistency_counter),3)
+  return d2t_consistencies
+
+
+def check_parallel_relations():
+  '''
+  disease linked to drug by two parallel relations is one consistent disease
+  '''
+  drug,target,disease = make_nodes('drug','SmallMol',1)+make_nodes('target','Protein',1)+make_nodes('disease','Disease',1)
+  rels = [make_rel(drug,target,'negative','1'),make_rel(target,disease,'positive','2'),
+          make_rel(drug,disease,'negative','3')]
+  parallel_rel = make_rel(drug,disease,'negative','4','QuantitativeChange')
+  g = ResnetGraph.from_rels(rels+[parallel_rel])
+  assert len(g._psrels4(drug.uid(),disease.uid())) == 2
+  key = (drug.uid(),target.uid(),'negative')
+  assert consistencies([drug],g)[key] == round(consist_coeff(1,0),3) == 0.315
+  assert consistency4(drug,g)[key] == round(consist_coeff(2,0),3) # disease was counted for every relation
+  print('Disease linked to drug by parallel relations is counted once')
+
+
+def measure(drug_count=500,target_count=2000,disease_count=1000,rels_per_type=50000):
+  g,drugs = make_graph(drug_count,target_count,disease_count,rels_per_type)
+  start = time.time()
+  per_drug = dict()
+  [per_drug.update(consistency4(drug,g)) for drug in drugs]
+  per_drug_time = time.time()-start
+  start = time.time()
+  sparse_consistencies = consistencies(drugs,g)
+  matrix_time = time.time()-start
+  print(f'{len(sparse_consistencies)} drug-target pairs: __consistency4 for every drug {per_drug_time:.2f}s, sparse vote matrices {matrix_time:.2f}s ({per_drug_time/matrix_time:.1f}x faster)')
+
+  different = [key for key,coeff in per_drug.items() if sparse_consistencies.get(key) != coeff]
+  # __consistency4 skipped drugs without diseases, sparse calculation gives their targets coefficient 0.0 like default correction
+  extra = {coeff for key,coeff in sparse_consistencies.items() if key not in per_drug}
+  print(f'{len(different)} of {len(per_drug)} consistencies differ from __consistency4, {len(sparse_consistencies)-len(per_drug)} pairs of drugs without diseases')
+  assert not different and extra.issubset({0.0})
+
+
+if __name__ == "__main__":
+  check_parallel_relations()
+  measure()
@@ -0,0 +1,66 @@
+import time,tracemalloc
+from compact_graph_memory import make_graph
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph
+
+'''
+Compares ResnetGraph.rn2tensor() with previous exporter building nested lists edge by edge
+and copying both node states for every edge endpoint
+'''
+
+
+def list_tensor(g:ResnetGraph,node_stats:dict,edge_stats:dict):
+  urn2idx,idx2objs = dict(),dict()
+  def objidx(obj):
+    try:
+      return urn2idx[obj.urn()]
+    except KeyError:
+      urn2idx[obj.urn()] = len(urn2idx)
+      idx2objs[len(idx2objs)] = obj
+      return urn2idx[obj.urn()]
+
+  node_types = list(node_stats.keys())
+  nodes = g._get_nodes()
+  node_features = [[]]*2*len(nodes)
+  for n in nodes:
+    features = [0]*len(node_types)
+    features[node_types.index(n.objtype())] = 1
+    node_features[objidx(n.make_active())] = features
+    node_features[objidx(n.make_repressed())] = features
+
+  edge_types = list(edge_stats.keys())
+  edge_list = list()
+  for r,t,rel in g.edges.data('relation'):
+    regulator,target = g._get_node(r),g._get_node(t)
+    ra,rr = objidx(regulator.make_active()),objidx(regulator.make_repressed())
+    ta,tr = objidx(target.make_active()),objidx(target.make_repressed())
+    sign = rel.effect_sign()
+    weight = rel.count_refs()
+    features = [0]*len(edge_types)
+    features[edge_types.index(rel.objtype())] = 1
+    if sign > 0:
+      edge_list += [[ra,ta,weight,features],[rr,tr,weight,features]]
+    elif sign < 0:
+      edge_list += [[ra,tr,weight,features],[rr,ta,weight,features]]
+    else:
+      edge_list += [[ra,ta,weight,features],[rr,tr,weight,features],[ra,tr,weight,features],[rr,ta,weight,features]]
+  return edge_list,node_features,idx2objs
+
+
+def measure(node_count=20000,rel_count=200000,refs_per_rel=1):
+  g = make_graph(node_count,rel_count,refs_per_rel)
+  node_stats = g._ResnetGraph__node_stats()
+  edge_stats = g._ResnetGraph__rel_stats()
+  for name,exporter in [('nested lists',lambda: list_tensor(g,node_stats,edge_stats)),
+                        ('rn2tensor()',lambda: g.rn2tensor(node_stats,None,edge_stats))]:
+    tracemalloc.start()
+    start = time.time()
+    result = exporter()
+    seconds = time.time()-start
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name}: {g.number_of_edges()} edges in {seconds:.2f}s, peak memory {peak/2**20:.0f}MB')
+    del result
+
+
+if __name__ == "__main__":
+  measure()
@@ -0,0 +1,44 @@
+import json,os,random,tempfile,time
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph,PSObject
+from ElsevierAPI.api.ResnetAPI.NetworkxObjects import OBJECT_TYPE,PSObjectEncoder,PSObjectDecoder
+from ElsevierAPI.api.ResnetAPI.mapping_index import MappingIndex
+
+'''
+Compares loading of database-wide map used by APIcache.get_map (JSON dump of entities + ResnetGraph._make_map)
+with loading of saved MappingIndex (APIcache.get_index) and remapping of entities with both maps
+'''
+OBJTYPES = ['Protein','Disease','SmallMol']
+PROPS = ['Name','Alias','LocusLink ID']
+
+
+def make_nodes(count:int)->list[PSObject]:
+  random.seed(0)
+  return [PSObject({'URN':[f'urn:agi-llid:{i}'],OBJECT_TYPE:[random.choice(OBJTYPES)],'Name':[f'Entity-{i}'],
+                    'Alias':[f'alias {i}.{j}' for j in range(3)],'LocusLink ID':[str(i)]}) for i in range(count)]
+
+
+def measure(node_count=200000,remap_count=50000):
+  nodes = make_nodes(node_count)
+  work_dir = tempfile.mkdtemp()
+  dump_path = os.path.join(work_dir,'mapfile.json')
+  json.dump(nodes,open(dump_path,'w'),cls=PSObjectEncoder)
+  MappingIndex(PROPS,nodes).save(os.path.join(work_dir,'mapfile'))
+
+  start = time.time()
+  mapdic = ResnetGraph._make_map(PROPS,[PSObject(n) for n in json.load(open(dump_path,'r'),cls=PSObjectDecoder)])
+  map_time = time.time()-start
+  start = time.time()
+  index = MappingIndex.load(os.path.join(work_dir,'mapfile'))
+  index_time = time.time()-start
+  print(f'{node_count} entities: JSON dump + _make_map {map_time:.2f}s, MappingIndex.load {index_time:.2f}s ({map_time/index_time:.1f}x faster)')
+
+  queries = [PSObject({'URN':[f'urn:query:{i}'],OBJECT_TYPE:[random.choice(OBJTYPES)],'Name':[f'ENTITY {random.randrange(node_count)}']}) for i in range(remap_count)]
+  for name,mapper in [('mapdic',mapdic),('MappingIndex',index)]:
+    objs = [PSObject(dict(q)) for q in queries]
+    start = time.time()
+    mapped = sum(o.remap(mapper,PROPS) for o in objs)
+    print(f'{name}: remapped {mapped} of {remap_count} entities in {time.time()-start:.2f}s')
+
+
+if __name__ == "__main__":
+  measure()
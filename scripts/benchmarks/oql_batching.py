@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ElsevierAPI.api.ResnetAPI.oql_batcher import OQLbatcher,ChunkSizer
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph
+
+'''
+Compares APISession.__iterate2__ before adaptive batching with OQLbatcher on simulated GOQL server.
+Old __iterate2__ iterated chunks of shorter list sequentially and ran chunks of longer list for every chunk in parallel.
+Simulated request takes OVERHEAD seconds plus SECONDS_PER_ID for every identifier in request
+'''
+OVERHEAD = 0.2
+SECONDS_PER_ID = 0.0005
+SESSIONS = 25
+
+
+def simulated_request(ids1:list,ids2:list)->ResnetGraph:
+  time.sleep(OVERHEAD+SECONDS_PER_ID*(len(ids1)+len(ids2)))
+  return ResnetGraph()
+
+
+def fixed_batches(ids1:list,ids2:list,step=500):
+  step2 = min(2*step,1000)
+  if len(ids1) <= len(ids2):
+    for i in range(0,len(ids1),step):
+      with ThreadPoolExecutor(SESSIONS) as e:
+        [f.result() for f in [e.submit(simulated_request,ids1[i:i+step],ids2[j:j+step2]) for j in range(0,len(ids2),step2)]]
+  else:
+    for i in range(0,len(ids2),step):
+      with ThreadPoolExecutor(SESSIONS) as e:
+        [f.result() for f in [e.submit(simulated_request,ids1[j:j+step2],ids2[i:i+step]) for j in range(0,len(ids1),step2)]]
+
+
+def adaptive_batches(ids1:list,ids2:list,step=500):
+  jobs = [(str(i),ids2) for i in range(0,len(ids1),step)]
+  run_chunk = lambda session,template,ids,name: simulated_request(ids1[int(template):int(template)+step],ids)
+  OQLbatcher(lambda: None,SESSIONS,ChunkSizer(min(2*step,1000))).run(jobs,run_chunk,'benchmark')
+
+
+def measure(len1=10000,len2=2000):
+  ids1,ids2 = list(range(len1)),list(range(len2))
+  start = time.time()
+  fixed_batches(ids1,ids2)
+  fixed_time = time.time()-start
+  start = time.time()
+  adaptive_batches(ids1,ids2)
+  adaptive_time = time.time()-start
+  print(f'{len1}x{len2} identifiers: fixed batches {fixed_time:.2f}s, adaptive batches {adaptive_time:.2f}s ({fixed_time/adaptive_time:.1f}x faster)')
+
+
+if __name__ == "__main__":
+  measure()
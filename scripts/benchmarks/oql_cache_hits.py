@@ -0,0 +1,51 @@
+import tempfile
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph,PSObject,PSRelation
+from ElsevierAPI.api.ResnetAPI.NetworkxObjects import OBJECT_TYPE,EFFECT,CHILDS
+from ElsevierAPI.api.ResnetAPI.oql_cache import OQLcache
+
+'''
+Checks that graph loaded from OQLcache is identical to graph returned by database query.
+Graph mimics results of ZeepToNetworkx._zeep2graph: PropSet ids are integers,
+property values can be None
+'''
+
+
+def live_graph()->ResnetGraph:
+  p1 = PSObject({'Id':[101],'URN':['urn:agi-llid:1'],'Name':['P1'],OBJECT_TYPE:['Protein'],'Alias':[None]})
+  p2 = PSObject({'Id':[102],'URN':['urn:agi-llid:2'],'Name':['P2'],OBJECT_TYPE:['Protein']})
+  rel = PSRelation.make_rel(p1,p2,{'Id':[201],OBJECT_TYPE:['Paralog'],EFFECT:['unknown'],'Score':[0.5]},[])
+  rel.PropSetToProps[0] = {'Similarity':['0.93'],'Identity':[None]}
+  rel.PropSetToProps[1] = {'Similarity':['0.71']}
+  return ResnetGraph.from_rels([rel])
+
+
+def propsets(g:ResnetGraph)->dict:
+  return {r.urn():{ps_id:dict(props) for ps_id,props in r.PropSetToProps.items()} for _,_,r in g.edges.data('relation')}
+
+
+def check():
+  with tempfile.TemporaryDirectory() as cache_dir:
+    cache = OQLcache(cache_dir)
+    live = live_graph()
+    key = cache.key('SELECT Relation WHERE objectType = Paralog',['Name'],['Similarity'],True,'https://server1')
+    cache.put(key,live,'SELECT Relation WHERE objectType = Paralog')
+    hit = cache.get(key)
+    assert isinstance(hit,ResnetGraph)
+    assert propsets(hit) == propsets(live)
+    assert [type(k) for k in next(iter(propsets(hit).values()))] == [int,int]
+    assert float(next(iter(hit.edges.data('relation')))[2].PropSetToProps[0]['Similarity'][0]) == 0.93
+    assert {n.urn():dict(n) for n in hit._get_nodes()} == {n.urn():dict(n) for n in live._get_nodes()}
+    assert {r.urn():dict(r) for _,_,r in hit.edges.data('relation')} == {r.urn():dict(r) for _,_,r in live.edges.data('relation')}
+
+    # graphs with values that snapshot cannot store are not cached
+    group = live_graph()
+    node_uid = next(iter(group.nodes))
+    group.nodes[node_uid][CHILDS] = [PSObject({'URN':['urn:agi-llid:3']})]
+    group_key = cache.key('SELECT Entity WHERE objectType = Group',['Name'],[],False,'https://server1')
+    cache.put(group_key,group,'SELECT Entity WHERE objectType = Group')
+    assert cache.get(group_key) is None
+  print('OQL cache hits are identical to database results')
+
+
+if __name__ == "__main__":
+  check()
@@ -0,0 +1,89 @@
+import time,random,math
+from ElsevierAPI.api.ResnetAPI.ref_counter import RefCounter,identifier_hyperlink
+from ElsevierAPI.api.ResnetAPI.RefStats import RefStats,IDENTIFIER_COLUMN
+from ElsevierAPI.api.ResnetAPI.references import Reference,Author,RELEVANCE,ETM_CITATION_INDEX,PUBYEAR,TITLE,JOURNAL,_AUTHORS_
+from ElsevierAPI.utils.pandas.panda_tricks import df
+
+'''
+Compares reference statistics in {(id_type,identifier):(ref,count)} dictionary used by RefStats before RefCounter with RefCounter.
+Workers fill their own counters with references from shared cache as cloned RefStats do in ETMStats.add_refs_etm.
+Worker counters are combined and bibliography is made by counter2df twice: with relevance and with reference counts
+'''
+WORKERS = 10
+ID_TYPES = ['PMID','DOI','PMC','PII']
+
+
+def make_refs(count:int)->list[Reference]:
+  random.seed(0)
+  refs = list()
+  for i in range(count):
+    id_type = random.choice(ID_TYPES)
+    ref = Reference(id_type,f'{id_type}{i}')
+    ref[RELEVANCE] = [random.uniform(0.5,50.0)]
+    ref[PUBYEAR] = [random.randint(1990,2024)]
+    ref[TITLE] = [f'Article title number {i}']
+    ref[JOURNAL] = [f'Journal {i%500}']
+    ref[_AUTHORS_] = [Author(f'Last{i}{j}',f'First{j}','M') for j in range(random.randint(1,6))]
+    refs.append(ref)
+  return refs
+
+
+def dict_counter2df(ref_counter:dict,use_relevance=True)->df:
+  '''
+  RefStats.counter2df before RefCounter without DataFrame formatting
+  '''
+  log_scores = []
+  for ref, refcount in ref_counter.values():
+    boosted_relevance = ref.relevance() * int(refcount)
+    log_scores.append(math.log(boosted_relevance,10))
+  min_log = min(log_scores)
+  maxmin = max(log_scores) - min_log
+
+  table_rows = set()
+  for (id_type,identifier), (ref,refcount) in ref_counter.items():
+    score = 100 * (math.log(ref.relevance()*refcount,10)-min_log)/maxmin if use_relevance else refcount
+    biblio_str,_,_ = ref._biblio_tuple()
+    table_rows.add(tuple([score,ref.pubyear(),id_type,identifier_hyperlink(id_type,identifier),biblio_str]))
+  header = [RELEVANCE if use_relevance else ETM_CITATION_INDEX,PUBYEAR,'Identifier type',IDENTIFIER_COLUMN,'Citation']
+  return df.from_rows(list(table_rows),header)
+
+
+def dict_counter(worker_refs:list[list[Reference]]):
+  ref_counter = dict()
+  for refs in worker_refs:
+    session_counter = dict()
+    for ref in refs:
+      key = ref.get_doc_id()
+      ref2count = session_counter.get(key)
+      session_counter[key] = (ref,ref2count[1]+1 if ref2count else 1)
+    for ref,count in session_counter.values():
+      key = ref.get_doc_id()
+      ref2count = ref_counter.get(key)
+      ref_counter[key] = (ref,ref2count[1]+count if ref2count else count)
+  dict_counter2df(ref_counter,True)
+  dict_counter2df(ref_counter,False)
+
+
+def columnar_counter(worker_refs:list[list[Reference]]):
+  stats = RefStats.__new__(RefStats)
+  stats.ref_counter = RefCounter()
+  for refs in worker_refs:
+    stats.ref_counter.merge(RefCounter().add_refs(refs))
+  stats.counter2df(True)
+  stats.counter2df(False)
+
+
+def measure(ref_count=50000,refs_per_worker=40000):
+  refs = make_refs(ref_count)
+  worker_refs = [random.choices(refs,k=refs_per_worker) for _ in range(WORKERS)]
+  start = time.time()
+  dict_counter(worker_refs)
+  dict_time = time.time()-start
+  start = time.time()
+  columnar_counter(worker_refs)
+  columnar_time = time.time()-start
+  print(f'{WORKERS} workers with {refs_per_worker} of {ref_count} references: dictionary {dict_time:.2f}s, RefCounter {columnar_time:.2f}s ({dict_time/columnar_time:.1f}x faster)')
+
+
+if __name__ == "__main__":
+  measure()
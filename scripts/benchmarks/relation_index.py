@@ -0,0 +1,107 @@
+import time,random
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph,PSObject,PSRelation
+from ElsevierAPI.api.ResnetAPI.NetworkxObjects import OBJECT_TYPE,EFFECT
+
+'''
+Compares relation_exist, find_relations and get_rels_between answered by ResnetGraph.relation_index
+with the same queries answered from graph adjacency without index.
+Index must stay valid after add_rel, remove_node, remove_edge and must be dropped
+after relation Effect or ObjTypeName are changed by rel[EFFECT] = ..., set_effect or flip_effect
+'''
+REL_TYPES = ['Regulation','DirectRegulation','Binding','Expression']
+EFFECTS = ['positive','negative','unknown']
+
+
+def make_graph(node_count:int,rel_count:int)->tuple[ResnetGraph,list[PSObject]]:
+  random.seed(0)
+  nodes = [PSObject({'URN':[f'urn:n{i}'],'Name':[f'n{i}'],OBJECT_TYPE:['Protein']}) for i in range(node_count)]
+  rels = [make_rel(nodes,i) for i in range(rel_count)]
+  return ResnetGraph.from_rels(rels),nodes
+
+
+def make_rel(nodes:list[PSObject],i:int)->PSRelation:
+  regulator,target = random.sample(nodes,2)
+  props = {OBJECT_TYPE:[random.choice(REL_TYPES)],EFFECT:[random.choice(EFFECTS)],'Mechanism':[random.choice(['direct','indirect'])],'Id':[i]}
+  return PSRelation.make_rel(regulator.copy(),target.copy(),props,[])
+
+
+def queries(nodes:list[PSObject],count:int)->list:
+  random.seed(1)
+  my_queries = list()
+  for _ in range(count):
+    psobjs1,psobjs2 = random.sample(nodes,5),random.sample(nodes,20)
+    rel_types = random.sample(REL_TYPES,random.randint(0,2))
+    effects = random.sample(EFFECTS,random.randint(0,1))
+    my_queries.append((psobjs1,psobjs2,rel_types,effects,random.random() < 0.5))
+  return my_queries
+
+
+def answers(g:ResnetGraph,my_queries:list)->list:
+  results = list()
+  for psobjs1,psobjs2,rel_types,effects,any_direction in my_queries:
+    uids1,uids2 = ResnetGraph.uids(psobjs1),ResnetGraph.uids(psobjs2)
+    results.append((g.relation_exist(psobjs1,psobjs2,rel_types,effects,any_direction=any_direction),
+                    {r.urn() for r in g.find_relations(uids1,uids2,rel_types,effects,any_direction=any_direction)},
+                    {r.urn() for r in g.get_rels_between(uids1,uids2,rel_types,effects,'' if any_direction else '>')}))
+  return results
+
+
+def compare(g:ResnetGraph,my_queries:list,step:str)->tuple[float,float]:
+  index = g.relation_index
+  g.relation_index = None
+  start = time.time()
+  live = answers(g,my_queries)
+  live_time = time.time()-start
+  g.relation_index = index
+  start = time.time()
+  indexed = answers(g,my_queries)
+  index_time = time.time()-start
+  assert live == indexed, f'indexed answers differ from graph adjacency after {step}'
+  return live_time,index_time
+
+
+def measure(query_count=2000):
+  '''
+  index helps when node pairs are connected by many parallel relations of different type and effect.
+  Unfiltered queries are always answered from graph adjacency
+  '''
+  for node_count,rel_count in [(1000,100000),(300,30000),(100,30000)]:
+    g,nodes = make_graph(node_count,rel_count)
+    my_queries = queries(nodes,query_count)
+    g.index_relations()
+    live_time,index_time = compare(g,my_queries,'index_relations')
+    print(f'{query_count} queries on {node_count} nodes/{rel_count} relations ({g.number_of_edges()/len(set(g.edges())):.1f} relations per connected pair): without index {live_time:.2f}s, with index {index_time:.2f}s')
+
+
+def check(node_count=300,rel_count=3000,query_count=2000):
+  g,nodes = make_graph(node_count,rel_count)
+  my_queries = queries(nodes,query_count)
+  g.index_relations()
+  compare(g,my_queries,'index_relations')
+
+  # structural changes are applied to index
+  g.add_rel(make_rel(nodes,rel_count))
+  g.remove_node(nodes[0].uid())
+  r,t,urn = next(iter(g.edges(keys=True)))
+  g.remove_edge(r,t,urn)
+  assert g.relation_index is not None
+  compare(g,my_queries,'add_rel, remove_node, remove_edge')
+
+  # Effect and ObjTypeName changes drop index
+  rels = [rel for _,_,rel in g.edges.data('relation')]
+  for mutate in [lambda rel: rel.__setitem__(EFFECT,['negative']),
+                 lambda rel: rel.set_effect('positive'),
+                 lambda rel: rel.flip_effect(),
+                 lambda rel: rel.__setitem__(OBJECT_TYPE,['Binding'])]:
+    g.index_relations()
+    [mutate(rel) for rel in random.sample(rels,100)]
+    answers(g,my_queries[:1])
+    assert g.relation_index is None, 'stale index was not dropped'
+    g.index_relations()
+    compare(g,my_queries,'relation mutation')
+  print('indexed answers are identical to graph adjacency answers')
+
+
+if __name__ == "__main__":
+  check()
+  measure()
@@ -0,0 +1,32 @@
+import time
+from compact_graph_memory import make_graph
+
+'''
+Measures repeated PSRelation.refs() calls on synthetic graph.
+Before memoization every call converted authors, sorted and deduplicated sentences of all references.
+Forced recomputation emulates it by resetting relation cache before every call
+'''
+
+def measure(rel_count=100000,refs_per_rel=3,repeats=5):
+  g = make_graph(rel_count//5,rel_count,refs_per_rel)
+  rels = [rel for _,_,rel in g.edges.data('relation')]
+
+  start = time.time()
+  for _ in range(repeats):
+    for rel in rels:
+      rel._refs_cache = None
+      rel.refs()
+  recompute_time = time.time()-start
+  print(f'{repeats}x{len(rels)} refs() calls with recomputation: {recompute_time:.2f}s')
+
+  start = time.time()
+  for _ in range(repeats):
+    for rel in rels:
+      rel.refs()
+  memoized_time = time.time()-start
+  print(f'{repeats}x{len(rels)} memoized refs() calls: {memoized_time:.2f}s ({recompute_time/memoized_time:.0f}x faster)')
+  return recompute_time,memoized_time
+
+
+if __name__ == "__main__":
+  measure()
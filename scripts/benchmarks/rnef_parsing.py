@@ -0,0 +1,47 @@
+import os,time,pickle,tempfile
+from compact_graph_memory import make_graph
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph
+
+'''
+Measures RNEF parsing in current process and in worker processes used by ResnetGraph.fromRNEFflist
+for files larger than RNEF_PROCESSES_MIN_SIZE.
+Parent process unpickles results of every byte range parsed by worker process.
+Worker processes are faster only if unpickling all ranges takes less time than parsing them in current process
+'''
+
+
+def edges(g:ResnetGraph)->list:
+  return sorted(g.edges(keys=True))
+
+
+def measure(node_count=5000,rel_count=20000,refs_per_rel=2,max_processes=4,ranges=4):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    rnef_file = os.path.join(tmp_dir,'graph.rnef')
+    make_graph(node_count,rel_count,refs_per_rel).dump2rnef(rnef_file,['Name'],[],with_section_size=1000)
+    file_size = os.path.getsize(rnef_file)
+
+    start = time.time()
+    serial_g = ResnetGraph.fromRNEFflist([rnef_file],max_processes=1)
+    serial_time = time.time()-start
+
+    declaration, byte_ranges = ResnetGraph._rnef_ranges(rnef_file)
+    start = time.time()
+    parsed = ResnetGraph._read_rnef_range(rnef_file,*byte_ranges[0],declaration)
+    parse_time = time.time()-start
+    pickled = pickle.dumps(parsed)
+    start = time.time()
+    pickle.loads(pickled)
+    unpickle_time = time.time()-start
+    print(f'{file_size/1e6:.1f} MB RNEF file: parsed in current process in {serial_time:.2f}s. Range parsing {parse_time:.2f}s, unpickling its results {unpickle_time:.2f}s ({unpickle_time/parse_time:.0%})')
+
+    start = time.time()
+    parallel_g = ResnetGraph()
+    for nodes,rels in ResnetGraph.read_rnef_parallel([rnef_file],max_processes=max_processes,range_size=file_size//ranges+1):
+      parallel_g.add_psobjs(nodes,True)
+      parallel_g._ResnetGraph__add_psrels(rels,add_nodes=False,merge=True)
+    parallel_time = time.time()-start
+    print(f'{ranges} ranges parsed by {max_processes} processes on {os.cpu_count()} CPUs in {parallel_time:.2f}s ({serial_time/parallel_time:.1f}x faster), same edges: {edges(parallel_g) == edges(serial_g)}')
+
+
+if __name__ == "__main__":
+  measure()
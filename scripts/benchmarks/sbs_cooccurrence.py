@@ -0,0 +1,72 @@
+import json,os,tempfile,threading,time
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from urllib.parse import urlparse,parse_qs
+from ElsevierAPI.api.SBS_API.sbs import SBSapi
+
+'''
+Compares sequential SBSapi.sentcooc4list (multithread=False) with asynchronous one (multithread=True)
+against local mock SciBite Search server answering every request after LATENCY seconds.
+Mock server also serves OAuth2 token requests. Second asynchronous run takes all responses from persistent cache
+'''
+LATENCY = 0.1 # seconds
+
+
+class MockSBS(BaseHTTPRequestHandler):
+  def log_message(self,*args): pass
+
+
+  def __send(self,response:dict):
+    body = json.dumps(response).encode()
+    self.send_response(200)
+    self.send_header('Content-Type','application/json')
+    self.send_header('Content-Length',str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def do_POST(self):
+    self.__send({'access_token':'mock','token_type':'bearer','expires_in':3600})
+
+
+  def do_GET(self):
+    time.sleep(LATENCY)
+    url = urlparse(self.path)
+    params = parse_qs(url.query)
+    if url.path.endswith('/entities'):
+      self.__send({'data':[{'id':'GENETREE$'+params['suggestPrefix'][0]}]})
+    elif url.path.endswith('/sentences/'):
+      query = params['queries'][0]
+      sents = [{'dataset':'Medline','documentId':'x'*37+str(i),'field':'abstract','content':f'{query} sentence',
+                'title':f'{query} title {i}','publishDate':'2020','_score':1.0,'id':f'{query}{i}-1'} for i in range(3)]
+      self.__send({'data':sents,'pagination':{'totalItems':len(sents)}})
+    else:
+      docid = url.path.rsplit('/',1)[1]
+      self.__send({'data':{'id':docid,'dataset':'Medline','native_id':docid,'title':'title '+docid,
+                           'authors':[{'name_normalized':'Doe J'}],'last_modified_date':'2020-01-01'}})
+
+
+def measure(entity_count=200,rate=50):
+  server = ThreadingHTTPServer(('127.0.0.1',0),MockSBS)
+  threading.Thread(target=server.serve_forever,daemon=True).start()
+  url = f'http://127.0.0.1:{server.server_port}'
+  cache = os.path.join(tempfile.mkdtemp(),'sbs_cache.sqlite')
+  config = {'SBSurl':url,'SBStoken_url':url,'SBSclientID':'mock','SBSecret':'mock','SBSrate':rate}
+  entities = [f'gene{i}' for i in range(entity_count)]
+
+  sequential = SBSapi(config)
+  sequential.multithread = False
+  start = time.time()
+  sequential.sentcooc4list(entities,['cancer'])
+  sequential_time = time.time()-start
+
+  for run in ['first','cached']:
+    concurrent = SBSapi({**config,'SBScache':cache})
+    start = time.time()
+    concurrent.sentcooc4list(entities,['cancer'])
+    concurrent_time = time.time()-start
+    print(f'Sequential: {sequential_time:.2f}s, asynchronous {run} run: {concurrent_time:.2f}s ({sequential_time/concurrent_time:.1f}x faster)')
+  server.shutdown()
+
+
+if __name__ == "__main__":
+  measure()
@@ -0,0 +1,59 @@
+import time,pickle
+from compact_graph_memory import make_graph
+from ElsevierAPI.api.ResnetAPI.ResnetGraph import ResnetGraph
+
+'''
+Compares ResnetGraph.simplify() with sequential simplification that visits every edge of graph copy.
+Synthetic graphs with fewer nodes have more node pairs with parallel relations.
+Also measures pickling of parallel relations that worker processes would need to merge node pairs:
+parent process pickles them and unpickles merged relations slower than it merges them itself,
+therefore simplification does not use worker processes
+'''
+RANKS = [['DirectRegulation','Binding','Regulation']]
+
+
+def sequential_simplify(g:ResnetGraph,ranks:list[list[str]]):
+  simple_g = ResnetGraph(g.copy())
+  simple_g.urn2rel = dict(g.urn2rel)
+  for ruid, tuid in g.edges():
+    rels = simple_g._psrels4(ruid,tuid)
+    if len(rels) > 1:
+      simple_g._ResnetGraph__set_bestrel(rels,ranks,edge_duplication=False)
+  return simple_g
+
+
+def pickling_time(g:ResnetGraph,simple_g:ResnetGraph)->float:
+  '''
+  output:
+    time to pickle parallel relations and unpickle their merged relations in parent process
+  '''
+  parallel_pairs = [(u,v) for u,nbrs in g._adj.items() for v,keydict in nbrs.items() if len(keydict) > 1]
+  parallel = [g._psrels4(u,v) for u,v in parallel_pairs]
+  merged = pickle.dumps([simple_g._psrels4(u,v) for u,v in parallel_pairs])
+  start = time.time()
+  pickle.dumps(parallel)
+  pickle.loads(merged)
+  return time.time()-start
+
+
+def measure(rel_count=20000,refs_per_rel=2):
+  for node_count in [2000,500,200]:
+    # simplification changes relations shared by graph copies, therefore every run gets new graph
+    g = make_graph(node_count,rel_count,refs_per_rel)
+    start = time.time()
+    sequential_g = sequential_simplify(g,RANKS)
+    sequential_time = time.time()-start
+
+    g = make_graph(node_count,rel_count,refs_per_rel)
+    pair_count = sum(1 for nbrs in g._adj.values() for keydict in nbrs.values() if len(keydict) > 1)
+    start = time.time()
+    simple_g = g.simplify(RANKS[0])
+    simplify_time = time.time()-start
+    same = list(simple_g.edges(keys=True)) == list(sequential_g.edges(keys=True))
+    print(f'{node_count} nodes, {rel_count} relations, {pair_count} node pairs with parallel relations: sequential {sequential_time:.2f}s, simplify() {simplify_time:.2f}s ({sequential_time/simplify_time:.1f}x faster), same edges: {same}')
+    print(f'  pickling parallel and merged relations for worker processes {pickling_time(g,simple_g):.2f}s')
+    assert same
+
+
+if __name__ == "__main__":
+  measure()